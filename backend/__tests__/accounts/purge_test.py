@@ -0,0 +1,70 @@
+"""Module for testing account deletion and the background purge"""
+import logging
+import os
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from backend.config import settings
+from backend.database.schema import DBAccount, DBBoard, DBCustomer, DBImage, DBItem
+from backend.utils import stripe
+from backend.utils.account_purge import AccountPurger
+from backend.__tests__ import mock
+
+@pytest.fixture
+def purger(session):
+    return AccountPurger(sessionmaker(bind=session.get_bind()), 2, 60)
+
+@pytest.fixture
+def deleted_account(client, session, auth_headers, monkeypatch, tmp_path):
+    """Give account 1 a Stripe customer and an uploaded image, and then delete it."""
+    monkeypatch.setattr(settings, 'static_path', str(tmp_path))
+    os.mkdir(tmp_path / 'images')
+    (tmp_path / 'images' / 'upload.png').write_bytes(b'image')
+    session.add(DBImage(uuid=mock.to_uuid(1, 'media'), uploader_id=mock.to_uuid(1), filename='upload.png'))
+    session.get(DBCustomer, mock.to_uuid(1, 'customer')).stripe_id = 'cus_1'
+    session.commit()
+    response = client.delete("/accounts/me", headers=auth_headers(1))
+    assert response.status_code == 204
+    return mock.to_uuid(1)
+
+def test_deleted_account_is_hidden(client, session, deleted_account, create_login, exception):
+    # The account is marked, but nothing has been purged yet
+    assert session.get(DBAccount, deleted_account).deleted_at is not None
+    assert len(session.execute(select(DBBoard).where(DBBoard.owner_id == deleted_account)).scalars().all()) == 2
+    response = client.get(f"/accounts/{deleted_account}")
+    assert response.json() == exception("entity_not_found", f"Unable to find account with id={deleted_account}")
+    assert response.status_code == 404
+    response = client.get("/accounts/alice")
+    assert response.status_code == 404
+    response = client.post("/auth/token", data=create_login(1))
+    assert response.status_code == 401
+
+def test_purge(session, deleted_account, purger, monkeypatch, tmp_path):
+    deleted_customers = []
+    monkeypatch.setattr(stripe, 'delete_customer', lambda customer: deleted_customers.append(customer.stripe_id))
+    assert purger.purge_all() == 1
+    session.expire_all()
+    assert session.get(DBAccount, deleted_account) is None
+    assert session.execute(select(DBBoard).where(DBBoard.owner_id == deleted_account)).scalars().all() == []
+    assert session.execute(select(DBItem).where(DBItem.board_id.in_([ mock.to_uuid(1, 'board'), mock.to_uuid(2, 'board') ]))).scalars().all() == []
+    assert session.get(DBImage, mock.to_uuid(1, 'media')) is None
+    assert not os.path.exists(tmp_path / 'images' / 'upload.png')
+    assert deleted_customers == [ 'cus_1' ]
+    # Other accounts' boards are left alone
+    assert session.get(DBBoard, mock.to_uuid(3, 'board')) is not None
+
+def test_purge_resumes_after_failure(session, deleted_account, purger, monkeypatch, caplog):
+    def unreachable(customer):
+        raise ConnectionError()
+    monkeypatch.setattr(stripe, 'delete_customer', unreachable)
+    assert purger.purge_all() == 0
+    assert purger.errors == 1
+    assert any(record.levelno == logging.ERROR and deleted_account in record.message for record in caplog.records)
+    session.expire_all()
+    assert session.get(DBAccount, deleted_account) is not None
+    monkeypatch.setattr(stripe, 'delete_customer', lambda customer: None)
+    assert purger.purge_all() == 1
+    session.expire_all()
+    assert session.get(DBAccount, deleted_account) is None
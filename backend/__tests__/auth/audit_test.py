@@ -0,0 +1,96 @@
+"""Module for testing the auth event writer"""
+from json import loads
+from time import monotonic, sleep
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.schema import *
+from backend.utils.audit import AuditWriter
+
+def file_sessions(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+def test_writer_batches_events(tmp_path):
+    Session = file_sessions(tmp_path)
+    writer = AuditWriter(Session, batch_size=2, flush_interval=10, max_queue=100)
+    writer.start()
+    with Session() as session:
+        for i in range(5):
+            writer.record(session, f"account-{i}", "login", "127.0.0.1", { "number": i })
+        # Nothing was written through the caller's session, and nothing is queued until it commits
+        assert len(session.new) == 0
+        assert writer._queue.qsize() == 0
+        session.commit()
+    writer.stop()
+    with Session() as session:
+        events = session.execute(select(DBAuthEvent).order_by(DBAuthEvent.account_id)).scalars().all()
+        assert [ event.account_id for event in events ] == [ f"account-{i}" for i in range(5) ]
+        assert [ loads(event.detail)["number"] for event in events ] == list(range(5))
+        assert all(event.timestamp is not None for event in events)
+
+def test_writer_falls_back_when_full(tmp_path, monkeypatch):
+    Session = file_sessions(tmp_path)
+    writer = AuditWriter(Session, batch_size=10, flush_interval=10, max_queue=1)
+    monkeypatch.setattr(writer, "_run", writer._stopping.wait) # keep the queue from draining until stopped
+    writer.start()
+    with Session() as session:
+        writer.record(session, "queued", "login", "127.0.0.1")
+        session.commit()
+        writer.record(session, "direct", "login", "127.0.0.1")
+        writer.record(session, "direct", "logout", "127.0.0.1")
+        # The overflow was added to the caller's session, and is written when it commits
+        assert len(session.new) == 2
+        session.commit()
+    writer.stop()
+    with Session() as session:
+        assert len(session.execute(select(DBAuthEvent)).scalars().all()) == 3
+
+def test_writer_drops_rolled_back_events(tmp_path):
+    Session = file_sessions(tmp_path)
+    writer = AuditWriter(Session, batch_size=10, flush_interval=10, max_queue=100)
+    writer.start()
+    with Session() as session:
+        session.add(DBAuthEvent(account_id="account", event_type="registration", host="127.0.0.1"))
+        session.flush()
+        writer.record(session, "rolled back", "registration", "127.0.0.1")
+        session.rollback()
+        writer.record(session, "committed", "login", "127.0.0.1")
+        session.commit()
+    writer.stop()
+    with Session() as session:
+        assert session.execute(select(DBAuthEvent.account_id)).scalars().all() == [ "committed" ]
+
+def test_writer_falls_back_when_stopped(session):
+    writer = AuditWriter(lambda: session, batch_size=10, flush_interval=10, max_queue=100)
+    writer.record(session, "account", "logout", "127.0.0.1")
+    assert session.execute(select(DBAuthEvent.event_type)).scalars().all() == [ "logout" ]
+
+def test_writer_retries_failed_batches(tmp_path, monkeypatch):
+    Session = file_sessions(tmp_path)
+    writer = AuditWriter(Session, batch_size=10, flush_interval=10, max_queue=100)
+    write, failures = writer._write, []
+    def flaky(rows):
+        if rows and not failures:
+            failures.append(rows)
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return write(rows)
+    monkeypatch.setattr(writer, "_write", flaky)
+    writer.start()
+    with Session() as session:
+        writer.record(session, "first", "login", "127.0.0.1")
+        session.commit()
+        while not failures:
+            sleep(0.01)
+        writer.record(session, "second", "login", "127.0.0.1")
+        session.commit()
+    # The writer is still running, and wrote the failed batch and the events after it
+    deadline = monotonic() + 5
+    with Session() as session:
+        while len(session.execute(select(DBAuthEvent)).scalars().all()) < 2 and monotonic() < deadline:
+            sleep(0.01)
+        assert writer.running
+        assert sorted(session.execute(select(DBAuthEvent.account_id)).scalars().all()) == [ "first", "second" ]
+    writer.stop()
@@ -3,9 +3,14 @@ from backend.database.schema import *
 from backend.config import settings
 from time import sleep
 from datetime import datetime, UTC
-from sqlalchemy import select
+from threading import Thread
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
 
 from backend.__tests__ import mock
+from backend.utils import auth_cache, email_handler
+from backend import auth
+from backend.dependencies import configure_sqlite
 
 def test_me_not_authenticated(client, exception):
     response = client.get("/accounts/me")
@@ -34,7 +39,7 @@ def test_register_account(session, client, form_headers, exception):
     permission = db_account.permission.__dict__.copy()
     del permission['_sa_instance_state']
     assert permission == {
-        "id": mock.to_uuid(103, 'account'),
+        "id": mock.to_uuid(104, 'account'),
         "account_id": mock.to_uuid(101, 'account'),
         "role": "user",
     }
@@ -44,7 +49,7 @@ def test_register_account(session, client, form_headers, exception):
     del email_verification['expires_at']
     del email_verification['_sa_instance_state']
     assert email_verification == {
-        "id": mock.to_uuid(104, 'account'),
+        "id": mock.to_uuid(103, 'account'),
         "account_id": mock.to_uuid(101, 'account'),
         "email": "fred@example.com",
     }
@@ -164,6 +169,21 @@ def test_login_by_username(client, form_headers, get_account):
     assert response.json() == get_account(1)
     assert response.status_code == 200
 
+def test_login_ignores_case(client, form_headers, get_account):
+    for identifier in [ "ALICE", "Alice@Example.com" ]:
+        response = client.post("/auth/web/login", headers=form_headers, data={ "identifier": identifier, "password": "password1" })
+        assert response.status_code == 204
+        response = client.get("/accounts/me")
+        assert response.json() == get_account(1)
+
+def test_register_existing_identifier_other_case(client, form_headers, accounts, exception):
+    mock.last_uuid = mock.OFFSETS['account'] + 100
+    response = client.post("/auth/registration", headers=form_headers, data={ "username": "Alice", "email": "alicenew@example.com", "password": "drowssap1" })
+    assert response.json() == exception("duplicate_entity", "Entity account with username=Alice already exists")
+    response = client.post("/auth/registration", headers=form_headers, data={ "username": "alicenew", "email": "ALICE@example.com", "password": "drowssap1" })
+    assert response.json() == exception("duplicate_entity", "Entity account with email=ALICE@example.com already exists")
+    assert response.status_code == 422
+
 def test_login_incorrect_password(client, form_headers, create_login, exception):
     login = create_login(1)
     login['password'] = "incorrect password"
@@ -260,4 +280,143 @@ def test_logout_deletes_and_invalidates_refresh_token(client, monkeypatch, login
     client.cookies.set(settings.jwt_refresh_cookie_key, refresh_token)
     response = client.post("/auth/web/refresh")
     assert response.json() == exception("invalid_refresh_token", "Authentication failed: Refresh token expired or was invalid")
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+def test_role_change_forces_token_refresh(session, client, auth_headers, get_board, exception):
+    # Account 4 cannot see private board 3
+    headers = auth_headers(4)
+    response = client.get(f"/boards/{mock.to_uuid(3, 'board')}", headers=headers)
+    assert response.status_code == 404
+    # Promote them and make sure the old token's claims are rejected
+    account = session.get(DBAccount, mock.to_uuid(4, 'account'))
+    account.permission.role = "app_moderator"
+    session.add(account.permission)
+    session.commit()
+    response = client.get(f"/boards/{mock.to_uuid(3, 'board')}", headers=headers)
+    assert response.json() == exception("invalid_access_token", "Authentication failed: Access token expired or was invalid")
+    assert response.status_code == 401
+    # A new token carries the new role
+    response = client.get(f"/boards/{mock.to_uuid(3, 'board')}", headers=auth_headers(4))
+    assert response.json() == get_board(3)
+    assert response.status_code == 200
+
+def test_new_permission_bumps_claims_version(session, client):
+    account = session.get(DBAccount, mock.to_uuid(4, 'account'))
+    version = account.claims_version
+    session.delete(account.permission)
+    session.commit()
+    # Only the account's ID is set on the new row
+    session.add(DBPermission(account_id=account.id, role="app_moderator"))
+    session.commit()
+    assert account.claims_version == version + 1
+
+def test_entitlement_claims(client, auth_headers):
+    token = auth_headers(5)["Authorization"].split()[1]
+    payload = auth._extract_access_payload(token)
+    assert payload.role == "app_administrator"
+    assert payload.tier == "free"
+    assert payload.verified == True
+    assert payload.ver == 1 # promoted once during setup
+
+def test_forcelogout_clears_cached_token(client, auth_headers):
+    headers = auth_headers(1)
+    response = client.get("/accounts/me", headers=headers)
+    assert response.status_code == 200
+    assert auth_cache.get_payload(headers["Authorization"].split()[1]) is not None
+    response = client.post("/auth/forcelogout", headers=headers)
+    assert response.status_code == 204
+    assert auth_cache.get_payload(headers["Authorization"].split()[1]) is None
+
+def test_refresh_rotates_refresh_token(client, login, exception):
+    # Log in and save the first refresh token
+    response = login(client, 1)
+    old_token = response.cookies.get(settings.jwt_refresh_cookie_key)
+    # Refreshing should replace the refresh token too
+    response = client.post("/auth/web/refresh")
+    assert response.status_code == 204
+    new_token = response.cookies.get(settings.jwt_refresh_cookie_key)
+    assert new_token is not None and new_token != old_token
+    # The new token can be used again
+    response = client.post("/auth/web/refresh")
+    assert response.status_code == 204
+
+def test_refresh_token_reuse_revokes_family(session, client, login, exception):
+    # Log in, save the first refresh token and rotate it
+    response = login(client, 1)
+    old_token = response.cookies.get(settings.jwt_refresh_cookie_key)
+    response = client.post("/auth/web/refresh")
+    assert response.status_code == 204
+    new_token = response.cookies.get(settings.jwt_refresh_cookie_key)
+    # Reusing the old token after the grace period fails
+    token = session.execute(select(DBRefreshToken)).scalar_one()
+    token.rotated_at -= settings.jwt_refresh_grace + 1
+    session.commit()
+    client.cookies.set(settings.jwt_refresh_cookie_key, old_token)
+    response = client.post("/auth/web/refresh")
+    assert response.json() == exception("invalid_refresh_token", "Authentication failed: Refresh token expired or was invalid")
+    assert response.status_code == 401
+    # And revokes the rotated token as well
+    client.cookies.set(settings.jwt_refresh_cookie_key, new_token)
+    response = client.post("/auth/web/refresh")
+    assert response.json() == exception("invalid_refresh_token", "Authentication failed: Refresh token expired or was invalid")
+    assert response.status_code == 401
+    assert len(list(session.execute(select(DBRefreshToken)).scalars().all())) == 0
+
+def test_replaced_refresh_token_gets_the_same_token(client, login):
+    # A request that still had the old cookie, or lost the new one, refreshes within the grace period
+    response = login(client, 1)
+    old_token = response.cookies.get(settings.jwt_refresh_cookie_key)
+    new_token = client.post("/auth/web/refresh").cookies.get(settings.jwt_refresh_cookie_key)
+    client.cookies.set(settings.jwt_refresh_cookie_key, old_token)
+    response = client.post("/auth/web/refresh")
+    assert response.status_code == 204
+    assert response.cookies.get(settings.jwt_refresh_cookie_key) == new_token
+    # Which is still the latest token
+    client.cookies.set(settings.jwt_refresh_cookie_key, new_token)
+    response = client.post("/auth/web/refresh")
+    assert response.status_code == 204
+    assert response.cookies.get(settings.jwt_refresh_cookie_key) not in [ old_token, new_token ]
+
+def test_concurrent_refreshes_get_the_same_token(client, login, database_path):
+    token = login(client, 1).cookies.get(settings.jwt_refresh_cookie_key)
+    # Two connections, like two requests refreshing with the same cookie at once
+    engine = create_engine(f"sqlite:///{database_path}", connect_args={"check_same_thread": False})
+    configure_sqlite(engine)
+    Sessions = sessionmaker(bind=engine)
+    tokens = []
+    def refresh_second():
+        with Sessions() as second:
+            tokens.append(auth.refresh_access_token(second, token)[1])
+            second.commit()
+    with Sessions() as first:
+        tokens.append(auth.refresh_access_token(first, token)[1])
+        # The second refresh waits for the first to commit its rotation
+        thread = Thread(target=refresh_second)
+        thread.start()
+        sleep(0.2)
+        first.commit()
+    thread.join()
+    engine.dispose()
+    assert len(tokens) == 2 and tokens[0] == tokens[1]
+    client.cookies.set(settings.jwt_refresh_cookie_key, tokens[0])
+    assert client.post("/auth/web/refresh").status_code == 204
+
+def test_prune_refresh_tokens(session, monkeypatch, client, login):
+    # Add some expired tokens
+    for i in range(3):
+        session.add(DBRefreshToken(token_id=f"expired{i}", account_id=mock.to_uuid(1, 'account'), expires_at=0))
+    session.commit()
+    # Issuing a token prunes a batch of expired ones
+    monkeypatch.setattr(settings, 'jwt_refresh_prune_batch', 2)
+    login(client, 1)
+    assert len(list(session.execute(select(DBRefreshToken)).scalars().all())) == 2
+    assert auth.prune_refresh_tokens(session) == 1
+    assert auth.prune_refresh_tokens(session) == 0
+
+def test_request_password_change_ignores_case(session, client, monkeypatch):
+    sent = []
+    monkeypatch.setattr(email_handler, "send_password_change_email", lambda account, change_request: sent.append(account.id))
+    response = client.post("/auth/request-change-password", params={ "email": "ALICE@Example.com" })
+    assert response.status_code == 204
+    assert sent == [ mock.to_uuid(1) ]
+    assert session.execute(select(DBPasswordChangeRequest.account_id)).scalars().all() == [ mock.to_uuid(1) ]
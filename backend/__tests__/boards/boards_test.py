@@ -22,6 +22,19 @@ def test_get_visible(client, get_board, auth_headers):
     }
     assert response.status_code == 200
 
+def test_get_visible_without_sync_session(client, get_board, auth_headers, monkeypatch):
+    # listing boards and items only uses the async session
+    from backend import app
+    from backend.dependencies import get_session
+    headers = auth_headers(2)
+    def no_session():
+        raise AssertionError("sync session opened")
+    monkeypatch.setitem(app.dependency_overrides, get_session, no_session)
+    response = client.get("/boards", headers=headers)
+    assert [ board["id"] for board in response.json()["contents"] ] == [ get_board(2)["id"], get_board(3)["id"], get_board(1)["id"] ]
+    response = client.get(f"/boards/{mock.to_uuid(1, 'board')}/items", headers=headers)
+    assert response.status_code == 200
+
 def test_get_editable(client, auth_headers, get_board):
     # account 2 is the owner of board 3 and an editor on board 1, and thus should not see board 2
     response = client.get("/boards/editable", headers=auth_headers(2))
@@ -1,11 +1,12 @@
 import pytest
 
-from sqlalchemy import create_engine, StaticPool
+from sqlalchemy import create_engine, StaticPool, NullPool
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from starlette.testclient import TestClient
 
 from backend import app, auth
-from backend.dependencies import get_session, name_to_identifier
+from backend.dependencies import get_session, get_read_session, get_async_session, get_async_read_session, unit_of_work, configure_sqlite, name_to_identifier, recent_writers, AsyncBackingSession
 from backend.database import schema
 from backend.database.schema import *
 
@@ -15,25 +16,38 @@ from PIL import Image
 import os
 from random import random
 
-from backend.utils import email_handler, rate_limiter
+from backend.utils import email_handler, rate_limiter, auth_cache
 
 # Essential fixtures
 
 @pytest.fixture
-def session(monkeypatch):
+def database_path(tmp_path):
+    # a file, so the sync and async engines can share it
+    return tmp_path / "test.db"
+
+@pytest.fixture
+def session(monkeypatch, database_path):
     monkeypatch.setattr(schema, 'gen_uuid', mock.uuid)
     engine = create_engine(
-        "sqlite://",
+        f"sqlite:///{database_path}",
         connect_args={"check_same_thread": False},
         poolclass=StaticPool,
     )
+    configure_sqlite(engine)
     Base.metadata.create_all(engine) # uses the schema's Base
     Session = sessionmaker(bind=engine)
+    auth.track_claims(Session)
     with Session() as session:
         yield session
 
 @pytest.fixture
-def client(session, monkeypatch):
+def async_session_maker(database_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool)
+    configure_sqlite(engine.sync_engine)
+    return async_sessionmaker(bind=engine, expire_on_commit=False, sync_session_class=AsyncBackingSession)
+
+@pytest.fixture
+def client(session, async_session_maker, monkeypatch):
     # override authentication functions
     monkeypatch.setattr(auth, "hash_password", mock.hash_password)
     monkeypatch.setattr(auth, "check_password", mock.check_password)
@@ -42,9 +56,21 @@ def client(session, monkeypatch):
     monkeypatch.setattr(rate_limiter, 'KEY_LIMITS', mock.KEY_LIMITS)
     
     # set up the client
-    app.dependency_overrides[get_session] = lambda: session
+    def get_test_session():
+        with unit_of_work(session):
+            yield session
+    app.dependency_overrides[get_session] = get_test_session
+    app.dependency_overrides[get_read_session] = lambda: session
+    async def get_test_async_session():
+        async with async_session_maker() as async_session:
+            yield async_session
+    app.dependency_overrides[get_async_session] = get_test_async_session
+    app.dependency_overrides[get_async_read_session] = get_test_async_session
     yield TestClient(app)
     app.dependency_overrides.clear()
+    auth_cache.clear()
+    rate_limiter.backend.clear()
+    recent_writers.clear()
     
 @pytest.fixture
 def exception():
@@ -191,6 +217,8 @@ def setup(session, accounts, boards, editors, items, todo_items, pins):
         db_item.list_id = mock.to_uuid(item['list_id'], 'item') if item['list_id'] is not None else None
         db_items[mock.to_uuid(i + 1, 'item')] = db_item
         session.add(db_item)
+        if db_item.list_id is None:
+            session.flush() # lists are inserted before the items in them
     session.commit()
 
     # Create todo list items
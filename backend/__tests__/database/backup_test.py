@@ -0,0 +1,115 @@
+"""Module for testing online backups and restores"""
+from threading import Thread, Event
+import logging
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import select, func
+
+from backend import backup as backup_cli
+from backend.config import settings
+from backend.database.schema import DBAccount, DBAuthEvent
+from backend.utils import backup
+from backend.__tests__ import mock
+
+def count(path, table: str) -> int:
+    with sqlite3.connect(path) as connection:
+        return connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+@pytest.fixture
+def events(session):
+    """Fill the database with enough auth events to take many batches to copy."""
+    session.add_all([ DBAuthEvent(account_id=mock.to_uuid(1), event_type="login", host="127.0.0.1", detail="x" * 500) for _ in range(2000) ])
+    session.commit()
+    return 2000
+
+def test_backup_while_writing(database_path, tmp_path, events):
+    # Another connection keeps committing while the backup copies a page at a time
+    stopping, started, writes = Event(), Event(), []
+    def writer():
+        with sqlite3.connect(database_path, timeout=5) as connection:
+            while not stopping.is_set():
+                connection.execute("INSERT INTO auth_events (id, account_id, event_type, host, timestamp) VALUES (randomblob(16), randomblob(16), 'login', 'writer', CURRENT_TIMESTAMP)")
+                connection.commit()
+                writes.append(None)
+                started.set()
+    thread = Thread(target=writer)
+    thread.start()
+    started.wait()
+    try:
+        before = len(writes)
+        pages = backup.backup(str(database_path), str(tmp_path / "copy.db"), pages=1, pause=1)
+    finally:
+        stopping.set()
+        thread.join()
+    assert pages > 100
+    assert len(writes) > before # the writer wasn't held up
+    with sqlite3.connect(tmp_path / "copy.db") as copy:
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        assert copy.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    # The copy has everything from before it started, and nothing from after it finished
+    assert events + before <= count(tmp_path / "copy.db", "auth_events") <= events + len(writes)
+    assert not os.path.exists(tmp_path / "copy.db.partial")
+
+def test_snapshot_retention(database_path, tmp_path):
+    folder = str(tmp_path / "backups")
+    paths = [ backup.snapshot(folder, str(database_path), retention=2) for _ in range(3) ]
+    assert backup.list_snapshots(folder, str(database_path)) == paths[1:]
+    assert all(os.path.basename(path).startswith("test-") for path in paths)
+
+def test_one_process_takes_snapshots(database_path, tmp_path):
+    folder = str(tmp_path / "backups")
+    first = backup.Snapshotter(str(database_path), folder, 3600, 2)
+    second = backup.Snapshotter(str(database_path), folder, 3600, 2)
+    assert first.claim()
+    assert first.claim()
+    assert not second.claim()
+    # Another takes over once it stops
+    first.stop()
+    assert second.claim()
+    second.stop()
+
+def test_failed_snapshot_is_logged(database_path, tmp_path, caplog):
+    folder = tmp_path / "backups"
+    folder.write_text("not a folder")
+    snapshotter = backup.Snapshotter(str(database_path), str(folder), 3600, 2)
+    assert snapshotter.take() is None
+    assert snapshotter.errors == 1
+    assert any(record.levelno == logging.ERROR and "Failed to take a snapshot" in record.message for record in caplog.records)
+
+def test_restore(session, database_path, tmp_path):
+    path = backup.snapshot(str(tmp_path / "backups"), str(database_path))
+    session.delete(session.get(DBAccount, mock.to_uuid(1)))
+    session.commit()
+    backup.restore(path, str(database_path))
+    # Open connections see the restored database, which is still in WAL mode
+    session.expire_all()
+    assert session.execute(select(func.count()).select_from(DBAccount)).scalar() == 5
+    assert session.get(DBAccount, mock.to_uuid(1)).username == "alice"
+    with sqlite3.connect(database_path) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_restore_damaged_snapshot(database_path, tmp_path):
+    damaged = tmp_path / "damaged.db"
+    with sqlite3.connect(database_path) as source, sqlite3.connect(damaged) as copy:
+        source.backup(copy)
+    with open(damaged, "r+b") as file:
+        file.seek(4096 * 3)
+        file.write(b"\xff" * 4096)
+    with pytest.raises(sqlite3.DatabaseError):
+        backup.restore(str(damaged), str(database_path))
+    assert count(database_path, "accounts") == 5
+
+def test_command_line(session, database_path, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(settings, "db_url", f"sqlite:///{database_path}")
+    monkeypatch.setattr(settings, "db_backup_path", str(tmp_path / "backups"))
+    assert backup_cli.main([ "restore" ]) == 1
+    assert backup_cli.main([ "snapshot" ]) == 0
+    path = capsys.readouterr().out.strip()
+    assert backup_cli.main([ "list" ]) == 0
+    assert capsys.readouterr().out.strip() == path
+    session.delete(session.get(DBAccount, mock.to_uuid(1)))
+    session.commit()
+    assert backup_cli.main([ "restore" ]) == 0
+    assert count(database_path, "accounts") == 5
@@ -0,0 +1,51 @@
+"""Module for testing that bulk deletes remove the same rows as the ORM's cascades"""
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from backend.database import accounts as accounts_db, boards as boards_db, items as items_db
+from backend.database.schema import Base, DBAccount, DBBoard, DBItem, DBPin, DBReport
+from backend.__tests__ import mock
+
+def snapshot(session) -> dict[str, list]:
+    # auth events are logged separately from the delete
+    tables = { table.name: sorted(map(tuple, session.execute(select(table)).all()), key=repr) for table in Base.metadata.tables.values() if table.name != "auth_events" }
+    # the ORM leaves behind connections from other pins to a deleted pin, which nothing can load, while bulk deletes remove them
+    pins = set(session.execute(select(DBPin.id)).scalars().all())
+    tables["connection_table"] = [ row for row in tables["connection_table"] if row[1] in pins ]
+    return tables
+
+@pytest.fixture
+def compare(session, database_path, tmp_path):
+    """Delete an object with the ORM in a copy of the database, and with `bulk` in the test database, and compare what's left."""
+    def _compare(entity: type, id: str, bulk):
+        session.add(DBReport(account_id=mock.to_uuid(2), entity_id=mock.to_uuid(1, 'board'), entity_type="board", report_type="spam", report_text="Spam", moderator_id=mock.to_uuid(5)))
+        session.commit()
+        with sqlite3.connect(database_path) as source, sqlite3.connect(tmp_path / "orm.db") as copy:
+            source.backup(copy)
+        with Session(create_engine(f"sqlite:///{tmp_path / 'orm.db'}")) as orm_session:
+            orm_session.delete(orm_session.get(entity, id))
+            orm_session.commit()
+            expected = snapshot(orm_session)
+        bulk(session)
+        session.commit()
+        assert snapshot(session) == expected
+    return _compare
+
+def test_delete_board(compare):
+    board_id = mock.to_uuid(2, 'board') # has lists, a todo list, and connected pins
+    compare(DBBoard, board_id, lambda session: boards_db.delete_boards(session, [ board_id ]))
+
+def test_delete_list(compare):
+    item_id = mock.to_uuid(2, 'item') # has a pin connected to another list
+    compare(DBItem, item_id, lambda session: items_db.delete_items(session, [ item_id ]))
+
+@pytest.mark.parametrize("id", [ 1, 5 ]) # 1 owns boards and edits another, 5 is a moderator with an assigned report
+def test_delete_account(compare, id):
+    account_id = mock.to_uuid(id)
+    def purge(session):
+        while not accounts_db.purge(session, account_id, 1): # one item at a time
+            session.commit()
+    compare(DBAccount, account_id, purge)
@@ -0,0 +1,54 @@
+"""Module for testing compressed text columns"""
+from json import loads
+
+from sqlalchemy import select, func, insert
+
+from backend.config import settings
+from backend.database.schema import *
+from backend.utils.audit import AuditWriter
+from backend.__tests__ import mock
+
+TEXT = "# Plans\n\n" + "".join(f"- Step {i}: write the next part of the plan\n" for i in range(200))
+
+def stored(session, column, id) -> tuple[str, bytes | str]:
+    """Get the SQLite type and the raw value of a column."""
+    entity = column.class_
+    return session.execute(select(func.typeof(column), func.cast(column, LargeBinary)).where(entity.id == id)).one()
+
+def test_long_text_is_compressed(session):
+    session.add(DBItemDocument(id=mock.to_uuid(100, 'item'), board_id=mock.to_uuid(1, 'board'), position="0,0", title="Plans", text=TEXT))
+    session.add(DBItemNote(id=mock.to_uuid(101, 'item'), board_id=mock.to_uuid(1, 'board'), position="0,0", text="Short note"))
+    session.commit()
+    session.expire_all()
+    type, raw = stored(session, DBItemDocument.text, mock.to_uuid(100, 'item'))
+    assert type == "blob" and raw[:1] == CompressedText.DEFLATE
+    assert len(raw) < len(TEXT) / 10
+    assert session.get(DBItemDocument, mock.to_uuid(100, 'item')).text == TEXT
+    # Short text is stored as it is
+    assert stored(session, DBItemNote.text, mock.to_uuid(101, 'item'))[0] == "text"
+    assert session.get(DBItemNote, mock.to_uuid(101, 'item')).text == "Short note"
+
+def test_text_that_doesnt_shrink_is_stored_as_text(session, monkeypatch):
+    monkeypatch.setattr(settings, "db_compress_threshold", 1)
+    session.add(DBItemNote(id=mock.to_uuid(100, 'item'), board_id=mock.to_uuid(1, 'board'), position="0,0", text="Hi"))
+    session.commit()
+    session.expire_all()
+    assert stored(session, DBItemNote.text, mock.to_uuid(100, 'item'))[0] == "text"
+    assert session.get(DBItemNote, mock.to_uuid(100, 'item')).text == "Hi"
+
+def test_uncompressed_rows_still_load(session):
+    # Rows written before the column was compressed
+    session.execute(insert(DBAuthEvent.__table__).values(id=mock.to_uuid(1, 'media'), account_id=mock.to_uuid(1), event_type="login", host="127.0.0.1", detail=func.cast(TEXT, Text)))
+    session.commit()
+    assert stored(session, DBAuthEvent.detail, mock.to_uuid(1, 'media'))[0] == "text"
+    assert session.get(DBAuthEvent, mock.to_uuid(1, 'media')).detail == TEXT
+
+def test_auth_event_details_use_the_dictionary(session):
+    detail = { "id": mock.to_uuid(1), "username": "alice", "email": "alice@example.com", "profile_image": None, "display_name": "Alice" }
+    AuditWriter(None, 1, 1, 1).record(session, mock.to_uuid(1), "registration", "127.0.0.1", detail)
+    event = session.execute(select(DBAuthEvent)).scalar_one()
+    type, raw = stored(session, DBAuthEvent.detail, event.id)
+    assert type == "blob" and raw[:1] == CompressedText.DEFLATE_DICTIONARY
+    assert len(raw) < len(event.detail) / 2
+    session.expire_all()
+    assert loads(session.get(DBAuthEvent, event.id).detail) == detail
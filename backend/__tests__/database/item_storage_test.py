@@ -0,0 +1,30 @@
+"""Module for testing items stored in a single table"""
+import os
+import subprocess
+import sys
+
+from backend.database.schema import SINGLE_TABLE_ITEMS
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The layout is chosen when the schema is imported, so the item tests run again in another process
+SCRIPT = f"""
+import sys, types
+package = types.ModuleType("backend")
+package.__path__ = [ {BACKEND!r} ]
+sys.modules["backend"] = package
+from backend.config import settings
+settings.db_item_storage = "single"
+del sys.modules["backend"]
+from backend.database.schema import Base
+assert "items_note" not in Base.metadata.tables
+import pytest
+sys.exit(pytest.main([ "-q", "-x", "-p", "no:cacheprovider", "__tests__/items" ]))
+"""
+
+def test_single_table_items():
+    if SINGLE_TABLE_ITEMS:
+        return # this run already covers it
+    environment = { **os.environ, "PYTHONPATH": os.path.dirname(BACKEND) }
+    result = subprocess.run([ sys.executable, "-c", SCRIPT ], cwd=BACKEND, env=environment, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout[-2000:]
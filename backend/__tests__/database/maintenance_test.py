@@ -0,0 +1,114 @@
+"""Module for testing the periodic maintenance tasks"""
+from datetime import datetime, UTC, timedelta
+import logging
+
+import pytest
+from sqlalchemy import select, func
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.schema import *
+from backend.utils import auth_cache
+from backend.utils.account_purge import AccountPurger
+from backend.utils.maintenance import MaintenanceScheduler, TASKS
+from backend.__tests__ import mock
+
+def scheduler(session, batch_size: int, budget: int) -> MaintenanceScheduler:
+    return MaintenanceScheduler(sessionmaker(bind=session.get_bind()), TASKS, batch_size, budget, 300)
+
+def count(session, entity: type) -> int:
+    return session.execute(select(func.count()).select_from(entity)).scalar()
+
+@pytest.fixture
+def expired(session):
+    """Add expired and current rows of every kind the tasks clean up."""
+    past = datetime.now(UTC) - timedelta(1)
+    future = datetime.now(UTC) + timedelta(1)
+    for i in range(3):
+        session.add(DBRefreshToken(token_id=f"expired{i}", account_id=mock.to_uuid(1), expires_at=0))
+        session.add(DBEmailVerification(account_id=mock.to_uuid(1), email="new@example.com", expires_at=past))
+        session.add(DBPasswordChangeRequest(account_id=mock.to_uuid(1), expires_at=past))
+        session.add(DBEditorInvitation(board_id=mock.to_uuid(1, 'board'), email="new@example.com", expires_at=past))
+        session.add(DBAuthEvent(account_id=mock.to_uuid(1), event_type="login", host="127.0.0.1", timestamp=past - timedelta(30)))
+    session.add(DBEmailVerification(account_id=mock.to_uuid(2), email="new@example.com", expires_at=future))
+    session.add(DBAuthEvent(account_id=mock.to_uuid(2), event_type="login", host="127.0.0.1"))
+    # Registered the way auth.register_account does it, so other rows point at the account
+    unverified = DBAccount(username="unverified", hashed_password="hash")
+    session.add(unverified)
+    session.flush()
+    unverified.permission = DBPermission(account_id=unverified.id)
+    unverified.customer = DBCustomer(account_id=unverified.id)
+    session.commit()
+
+def test_cleanup(session, expired):
+    maintenance = scheduler(session, 2, 1000)
+    assert maintenance.run_all() == False
+    session.expire_all()
+    assert count(session, DBRefreshToken) == 0
+    assert [ verification.account_id for verification in session.execute(select(DBEmailVerification)).scalars().all() ] == [ mock.to_uuid(2) ]
+    assert count(session, DBPasswordChangeRequest) == 0
+    assert count(session, DBEditorInvitation) == 0
+    assert [ event.account_id for event in session.execute(select(DBAuthEvent)).scalars().all() ] == [ mock.to_uuid(2) ]
+    # The unverified account is left to the purge, which removes the rows that point at it
+    assert session.execute(select(DBAccount).where(DBAccount.username == "unverified")).scalar().deleted_at is not None
+    assert AccountPurger(sessionmaker(bind=session.get_bind()), 10, 60).purge_all() == 1
+    session.expire_all()
+    assert session.execute(select(DBAccount).where(DBAccount.username == "unverified")).scalar() is None
+    assert count(session, DBAccount) == 5
+    # Every batch was counted
+    metrics = maintenance.metrics["auth_events"]
+    assert (metrics.runs, metrics.rows, metrics.last_rows, metrics.errors, metrics.pending) == (1, 3, 3, 0, False)
+    assert maintenance.metrics["unverified_accounts"].rows == 1
+
+def test_passes_are_logged(session, expired, caplog):
+    maintenance = scheduler(session, 2, 1000)
+    caplog.set_level(logging.DEBUG, logger="backend.utils.maintenance")
+    maintenance.run_all()
+    assert caplog.records[-1].levelno == logging.INFO
+    assert "auth_events 3 rows in" in caplog.records[-1].getMessage()
+    assert "email_verifications 3 rows in" in caplog.records[-1].getMessage()
+    # The next pass finds nothing, and the totals stay
+    maintenance.run_all()
+    assert (caplog.records[-1].levelno, caplog.records[-1].getMessage()) == (logging.DEBUG, "Maintenance pass: nothing to do")
+    metrics = maintenance.metrics["auth_events"]
+    assert (metrics.runs, metrics.rows, metrics.last_rows) == (2, 3, 0)
+
+def test_budget(session, expired):
+    # Without time for a second batch, each run deletes one and leaves the rest for later
+    maintenance = scheduler(session, 2, 0)
+    assert maintenance.run_task("password_changes") == True
+    assert count(session, DBPasswordChangeRequest) == 1
+    assert maintenance.metrics["password_changes"].pending == True
+    assert maintenance.run_task("password_changes") == False
+    assert count(session, DBPasswordChangeRequest) == 0
+    assert maintenance.metrics["password_changes"].rows == 3
+
+def test_subscription_compaction(session, client, auth_headers):
+    past = datetime.now(UTC) - timedelta(1)
+    for id, type, expiration in [ (1, "active", past), (2, "inactive", past - timedelta(7)), (3, "terminated", past), (4, "active", datetime.now(UTC) + timedelta(1)) ]:
+        customer = session.get(DBCustomer, mock.to_uuid(id, 'customer'))
+        customer.type = type
+        customer.expiration = expiration
+    session.commit()
+    versions = { account.id: account.claims_version for account in session.execute(select(DBAccount)).scalars().all() }
+    # Cache a snapshot for the first account, which is already inactive
+    assert client.get("/accounts/me", headers=auth_headers(1)).status_code == 200
+    assert auth_cache.accounts.get(mock.to_uuid(1)).tier == "inactive"
+    scheduler(session, 500, 1000).run_all()
+    session.expire_all()
+    customers = [ session.get(DBCustomer, mock.to_uuid(id, 'customer')) for id in range(1, 5) ]
+    assert [ (customer.type, customer.expiration is None) for customer in customers ] == [ ("inactive", False), ("free", True), ("free", True), ("active", False) ]
+    # The claims and snapshots of the compacted customers' accounts are invalidated, but not the others'
+    updated = { account.id: account.claims_version for account in session.execute(select(DBAccount)).scalars().all() }
+    assert [ updated[mock.to_uuid(id)] - versions[mock.to_uuid(id)] for id in range(1, 5) ] == [ 1, 1, 1, 0 ]
+    assert auth_cache.accounts.get(mock.to_uuid(1)) is None
+
+def test_failing_task(session, expired, caplog):
+    def broken(session, limit):
+        raise RuntimeError()
+    maintenance = MaintenanceScheduler(sessionmaker(bind=session.get_bind()), { "broken": broken, **TASKS }, 2, 1000, 300)
+    caplog.set_level(logging.INFO, logger="backend.utils.maintenance")
+    # The other tasks still run
+    maintenance.run_all()
+    assert maintenance.metrics["broken"].errors == 1
+    assert "broken failed" in caplog.records[-1].getMessage()
+    assert count(session, DBEditorInvitation) == 0
@@ -0,0 +1,107 @@
+"""Module for testing schema migrations"""
+import pytest
+from sqlalchemy import create_engine, inspect, insert, select, text, StaticPool
+
+from backend.database import migrations
+from backend.database.schema import Base, DBAccount, DBBoard, DBReport
+from backend.__tests__ import mock
+
+def memory_engine():
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+def test_fresh_database_is_stamped():
+    engine = memory_engine()
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        assert migrations.get_version(connection) == len(migrations.MIGRATIONS)
+
+def test_legacy_database_is_migrated():
+    engine = memory_engine()
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE accounts (id VARCHAR(36) PRIMARY KEY, username VARCHAR(64), email VARCHAR(64))"))
+        connection.execute(text("INSERT INTO accounts (id, username) VALUES ('1', 'alice')"))
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        assert migrations.get_version(connection) == len(migrations.MIGRATIONS)
+        assert "claims_version" in [ c['name'] for c in inspect(connection).get_columns("accounts") ]
+        assert connection.execute(text("SELECT claims_version FROM accounts")).scalar() == 0
+    # Upgrading again does nothing
+    migrations.upgrade(engine)
+
+def test_identifier_indexes_are_created():
+    engine = memory_engine()
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE accounts (id VARCHAR(36) PRIMARY KEY, username VARCHAR(64), email VARCHAR(64))"))
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        indexes = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'accounts'")).scalars().all()
+        assert "ix_accounts_username_lower" in indexes
+        assert "ix_accounts_email_lower" in indexes
+
+def test_identifier_collisions_stop_the_migration():
+    engine = memory_engine()
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE accounts (id VARCHAR(36) PRIMARY KEY, username VARCHAR(64), email VARCHAR(64))"))
+        connection.execute(text("INSERT INTO accounts (id, username, email) VALUES ('1', 'alice', 'alice@example.com'), ('2', 'Alice', 'other@example.com'), ('3', 'bob', NULL), ('4', 'charlie', NULL)"))
+    with pytest.raises(migrations.MigrationConflict) as error:
+        migrations.upgrade(engine)
+    assert "accounts.id=1 username='alice'" in str(error.value)
+    assert "accounts.id=2 username='Alice'" in str(error.value)
+    assert "bob" not in str(error.value)
+    # Nothing was applied, and fixing the rows lets the upgrade finish
+    with engine.begin() as connection:
+        assert migrations.get_version(connection) is None
+        connection.execute(text("UPDATE accounts SET username = 'alice2' WHERE id = '2'"))
+    migrations.upgrade(engine)
+
+def test_uuids_are_converted_to_bytes():
+    engine = memory_engine()
+    account_id, board_id = mock.to_uuid(1, 'account'), mock.to_uuid(1, 'board')
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE accounts (id VARCHAR(36) PRIMARY KEY, username VARCHAR(64), email VARCHAR(64))"))
+        connection.execute(text("CREATE TABLE boards (id VARCHAR(36) PRIMARY KEY, identifier VARCHAR(64), name VARCHAR(64), owner_id VARCHAR(36), public BOOLEAN)"))
+        connection.execute(text("INSERT INTO accounts (id, username) VALUES (:id, 'alice')"), { "id": account_id })
+        connection.execute(text("INSERT INTO boards (id, identifier, name, owner_id) VALUES (:id, 'board', 'Board', :owner_id)"), { "id": board_id, "owner_id": account_id })
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT typeof(id), length(id) FROM accounts")).one() == ("blob", 16)
+        assert connection.execute(text("SELECT typeof(owner_id) FROM boards")).scalar() == "blob"
+        # They are still read and matched as strings
+        assert connection.execute(select(DBBoard.id).where(DBBoard.owner_id == account_id)).scalar() == board_id
+
+def test_migrations_create_the_schema_indexes():
+    engine = memory_engine()
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+        indexes = { index.name for table in Base.metadata.tables.values() for index in table.indexes }
+        for name in indexes:
+            connection.execute(text(f"DROP INDEX {name}"))
+        for migration in migrations.MIGRATIONS:
+            migration(connection)
+        created = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")).scalars().all())
+    assert created <= indexes
+    # these were created along with the original tables
+    assert indexes - created == { "ix_accounts_username", "ix_accounts_email", "ix_accounts_hashed_password" }
+
+def test_report_moderators_reference_accounts():
+    engine = memory_engine()
+    moderator, deleted = mock.to_uuid(1, 'account'), mock.to_uuid(2, 'account')
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+        migrations.set_version(connection, migrations.MIGRATIONS.index(migrations.report_moderator_accounts))
+        connection.execute(text("DROP TABLE reports"))
+        connection.execute(text(
+            "CREATE TABLE reports (id BLOB PRIMARY KEY, account_id BLOB NOT NULL REFERENCES accounts (id), entity_id BLOB NOT NULL, entity_type VARCHAR(36) NOT NULL, "
+            "report_type VARCHAR(32) NOT NULL, report_text TEXT NOT NULL, status VARCHAR(32) NOT NULL, moderator_id BLOB REFERENCES permissions (id), created_at DATETIME, resolved_at DATETIME)"
+        ))
+        connection.execute(insert(DBAccount), [ { "id": moderator, "username": "alice", "hashed_password": "hash" } ])
+        connection.execute(insert(DBReport), [
+            { "id": mock.to_uuid(1, 'media'), "account_id": moderator, "entity_id": moderator, "entity_type": "account", "report_type": "spam", "report_text": "", "status": "assigned", "moderator_id": moderator },
+            { "id": mock.to_uuid(2, 'media'), "account_id": moderator, "entity_id": moderator, "entity_type": "account", "report_type": "spam", "report_text": "", "status": "assigned", "moderator_id": deleted },
+        ])
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        keys = { tuple(key['constrained_columns']): key['referred_table'] for key in inspect(connection).get_foreign_keys("reports") }
+        assert keys[("moderator_id",)] == "accounts"
+        assert connection.execute(select(DBReport.moderator_id).order_by(DBReport.id)).scalars().all() == [ moderator, None ]
+        assert "ix_reports_moderator_id" in [ index['name'] for index in inspect(connection).get_indexes("reports") ]
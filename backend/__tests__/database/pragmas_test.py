@@ -0,0 +1,17 @@
+"""Module for testing the SQLite connection settings"""
+from sqlalchemy import create_engine, text
+
+from backend.config import settings
+from backend.dependencies import configure_sqlite
+
+def test_pragmas_on_every_connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    configure_sqlite(engine)
+    # Hold one connection open so the pool has to create another
+    with engine.connect() as first, engine.connect() as second:
+        for connection in [ first, second ]:
+            assert connection.execute(text("PRAGMA journal_mode")).scalar().lower() == settings.db_journal_mode.lower()
+            assert connection.execute(text("PRAGMA synchronous")).scalar() == 1 # NORMAL
+            assert connection.execute(text("PRAGMA busy_timeout")).scalar() == settings.db_busy_timeout
+            assert connection.execute(text("PRAGMA cache_size")).scalar() == settings.db_cache_size
+            assert connection.execute(text("PRAGMA foreign_keys")).scalar() == int(settings.db_foreign_keys)
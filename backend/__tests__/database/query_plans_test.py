@@ -0,0 +1,77 @@
+"""Module for testing that the queries made by the routes use indexes"""
+import re
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import accounts as accounts_db, boards as boards_db
+from backend.database.schema import DBCustomer
+from backend.utils import email_handler
+from backend.utils.maintenance import MaintenanceScheduler, TASKS
+from backend.__tests__ import mock
+
+def test_queries_use_indexes(client, session, async_session_maker, auth_headers, monkeypatch):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if re.match(r"\s*(SELECT|UPDATE|DELETE)\b", statement) and re.search(r"\bWHERE\b", statement) and not executemany:
+            statements.append((statement, parameters))
+    engines = [ session.get_bind(), async_session_maker.kw['bind'].sync_engine ]
+    alice, bob, eve = auth_headers(1), auth_headers(2), auth_headers(5)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+
+    # Read everything a board page and the account pages load
+    assert client.get("/boards/", headers=alice).is_success
+    assert client.get("/boards/editable", headers=alice).is_success
+    assert client.get(f"/boards/{mock.to_uuid(2, 'board')}/", headers=alice).is_success
+    assert client.get("/boards/alice-child/", headers=alice).is_success
+    assert client.get(f"/boards/{mock.to_uuid(2, 'board')}/editors", headers=alice).is_success
+    assert client.get(f"/boards/{mock.to_uuid(2, 'board')}/items/", headers=alice).is_success
+    assert client.get(f"/boards/{mock.to_uuid(2, 'board')}/items/{mock.to_uuid(2, 'item')}", headers=alice).is_success
+    assert client.get("/accounts/me/uploads/images", headers=alice).is_success
+    assert client.get("/accounts/bob", headers=alice).is_success
+    assert client.get(f"/accounts/{mock.to_uuid(2, 'account')}", headers=alice).is_success
+    # Write items, sub-items and pins
+    assert client.post(f"/boards/{mock.to_uuid(2, 'board')}/items", headers=alice, json={ "list_id": mock.to_uuid(2, 'item'), "type": "note", "text": "Note" }).is_success
+    assert client.put(f"/boards/{mock.to_uuid(2, 'board')}/items/{mock.to_uuid(3, 'item')}", headers=alice, json={ "type": "note", "text": "Updated" }).is_success
+    assert client.post(f"/boards/{mock.to_uuid(1, 'board')}/items/todo", headers=alice, json={ "list_id": mock.to_uuid(5, 'item'), "text": "Task", "done": False, "link": None }).is_success
+    assert client.put(f"/boards/{mock.to_uuid(2, 'board')}/items/pins/connect?p1={mock.to_uuid(1, 'pin')}&p2={mock.to_uuid(3, 'pin')}", headers=alice).is_success
+    assert client.delete(f"/boards/{mock.to_uuid(2, 'board')}/items/pins/{mock.to_uuid(3, 'pin')}", headers=alice).is_success
+    assert client.delete(f"/boards/{mock.to_uuid(2, 'board')}/items/{mock.to_uuid(11, 'item')}", headers=alice).is_success
+    # Reports
+    assert client.post("/reports/", headers=bob, json={ "entity_id": mock.to_uuid(1, 'board'), "entity_type": "board", "report_type": "spam", "report_text": "Spam" }).is_success
+    assert client.get("/reports/", headers=bob).is_success
+    assert client.get("/reports/assigned", headers=eve).is_success
+    # Accounts
+    assert client.put("/accounts/me", headers=bob, json={ "display_name": "Bob" }).is_success
+    assert client.post("/auth/forcelogout", headers=bob).is_success
+    monkeypatch.setattr(email_handler, "send_password_change_email", lambda account, request: None)
+    assert client.post("/auth/request-change-password?email=Bob@Example.com").is_success
+    # Staff
+    report_id = client.get("/reports/", headers=bob).json()["contents"][0]["id"]
+    assert client.get("/reports/all", headers=eve).is_success
+    assert client.put(f"/reports/{report_id}/assignee/{mock.to_uuid(5, 'account')}", headers=eve).is_success
+    assert client.get(f"/reports/{report_id}", headers=eve).is_success
+    assert client.delete(f"/reports/{report_id}/assignee", headers=eve).is_success
+    assert client.get(f"/boards/{mock.to_uuid(3, 'board')}", headers=eve).is_success
+    assert client.get(f"/boards/{mock.to_uuid(3, 'board')}/editors", headers=eve).is_success
+    # Stripe webhooks look customers up by their Stripe ID
+    session.get(DBCustomer, mock.to_uuid(2, 'customer')).stripe_id = "cus_2"
+    session.commit()
+    assert accounts_db.get_by_stripe_id(session, "cus_2").account_id == mock.to_uuid(2)
+    # Background jobs
+    MaintenanceScheduler(sessionmaker(bind=session.get_bind()), TASKS, 10, 1000, 300).run_all()
+    boards_db.delete_boards(session, [ mock.to_uuid(3, 'board') ])
+    while not accounts_db.purge(session, mock.to_uuid(1), 1):
+        session.commit()
+    session.commit()
+
+    for engine in engines:
+        event.remove(engine, "before_cursor_execute", record)
+    assert len(statements) > 0
+    connection = session.connection()
+    for statement, parameters in statements:
+        plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        # a SCAN reads every row of the table, or every entry of an index, even when it uses one
+        scans = [ row.detail for row in plan if row.detail.startswith("SCAN") ]
+        assert scans == [], statement
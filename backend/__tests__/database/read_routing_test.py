@@ -0,0 +1,44 @@
+"""Module for testing how sessions are routed between the primary and the read engine"""
+from fastapi.dependencies.models import Dependant
+from fastapi.routing import APIRoute
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from backend import dependencies
+from backend.database.schema import Base, DBAuthEvent
+from backend.main import app
+
+def request(host: str) -> Request:
+    return Request({ "type": "http", "headers": [], "client": (host, 0) })
+
+def test_reads_stick_to_primary_after_write(tmp_path, monkeypatch):
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(primary)
+    monkeypatch.setattr(dependencies, "Session", sessionmaker(bind=primary))
+    monkeypatch.setattr(dependencies, "ReadSession", sessionmaker(bind=replica))
+    dependencies.recent_writers.clear()
+    # Reads go to the read engine by default
+    session = next(dependencies.get_read_session(request("1.1.1.1")))
+    assert session.get_bind() is replica
+    # A request that only reads does not make its client sticky
+    for session in dependencies.get_session(request("1.1.1.1")):
+        session.execute(text("SELECT 1"))
+    assert next(dependencies.get_read_session(request("1.1.1.1"))).get_bind() is replica
+    # After a write, that client reads from the primary, but others don't
+    for session in dependencies.get_session(request("1.1.1.1")):
+        session.add(DBAuthEvent(account_id="account", event_type="login", host="1.1.1.1"))
+    assert next(dependencies.get_read_session(request("1.1.1.1"))).get_bind() is primary
+    assert next(dependencies.get_read_session(request("2.2.2.2"))).get_bind() is replica
+    dependencies.recent_writers.clear()
+
+def calls(dependant: Dependant) -> set:
+    return { dependant.call } | { call for sub in dependant.dependencies for call in calls(sub) }
+
+def test_read_routes_use_read_sessions():
+    routes = [ route for route in app.routes if isinstance(route, APIRoute) and "GET" in route.methods
+        and route.path.startswith(("/boards", "/reports", "/accounts")) ]
+    assert len(routes) > 0
+    for route in routes:
+        assert dependencies.get_session not in calls(route.dependant), route.path
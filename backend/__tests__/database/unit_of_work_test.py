@@ -0,0 +1,71 @@
+"""Module for testing that each request is a single transaction"""
+from email.message import EmailMessage
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.schema import Base, DBAuthEvent
+from backend.dependencies import unit_of_work
+from backend.exceptions import EntityNotFound
+from backend.utils import email_handler
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+def test_commits_once(sessions):
+    commits = []
+    with sessions() as session:
+        event.listen(session, "after_commit", commits.append)
+        with unit_of_work(session):
+            for i in range(3):
+                session.add(DBAuthEvent(account_id="account", event_type="login", host="127.0.0.1"))
+                session.flush()
+    assert len(commits) == 1
+    with sessions() as session:
+        assert len(session.execute(select(DBAuthEvent)).scalars().all()) == 3
+
+def test_rolls_back_on_exception(sessions):
+    with sessions() as session:
+        with pytest.raises(EntityNotFound):
+            with unit_of_work(session):
+                session.add(DBAuthEvent(account_id="account", event_type="login", host="127.0.0.1"))
+                session.flush()
+                raise EntityNotFound("account", "id", "account")
+    with sessions() as session:
+        assert session.execute(select(DBAuthEvent)).scalars().all() == []
+
+def test_emails_are_sent_after_commit(sessions, monkeypatch):
+    sent = []
+    class SMTP():
+        def __init__(self, host, port):
+            pass
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            pass
+        def login(self, user, password):
+            pass
+        def send_message(self, message):
+            sent.append(message["Subject"])
+    monkeypatch.setattr(email_handler.smtplib, "SMTP_SSL", SMTP)
+    def send(subject: str):
+        message = EmailMessage()
+        message["Subject"] = subject
+        email_handler.send_email(message)
+    with sessions() as session:
+        with pytest.raises(EntityNotFound):
+            with unit_of_work(session):
+                session.add(DBAuthEvent(account_id="account", event_type="registration", host="127.0.0.1"))
+                session.flush()
+                email_handler.send_after_commit(session, send, "rolled back")
+                raise EntityNotFound("account", "id", "account")
+        with unit_of_work(session):
+            session.add(DBAuthEvent(account_id="account", event_type="registration", host="127.0.0.1"))
+            session.flush()
+            email_handler.send_after_commit(session, send, "committed")
+            assert sent == []
+    # Only the committed request's email was sent
+    assert sent == [ "committed" ]
@@ -0,0 +1,119 @@
+"""Module for testing the write coordinator"""
+import asyncio
+import pytest
+import sqlite3
+from threading import Thread, Timer
+
+from sqlalchemy import create_engine, event, select, func, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+
+from backend.exceptions import ServiceOverloaded
+from backend.utils.write_coordinator import WriteCoordinator
+
+class Base(DeclarativeBase):
+    pass
+
+class Row(Base):
+    __tablename__ = "rows"
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+def make_sessions(path, coordinator: WriteCoordinator) -> sessionmaker:
+    # no busy timeout, so any contention for SQLite's lock fails straight away
+    engine = create_engine(f"sqlite:///{path}", connect_args={ "timeout": 0 })
+    Base.metadata.create_all(engine)
+    sessions = sessionmaker(bind=engine)
+    coordinator.install(sessions)
+    return sessions
+
+def test_concurrent_writers(tmp_path):
+    sessions = make_sessions(tmp_path / "test.db", WriteCoordinator(64, 5000, 0, 10))
+    errors = []
+    def write():
+        try:
+            for _ in range(20):
+                with sessions() as session:
+                    session.add(Row())
+                    session.commit()
+        except Exception as e:
+            errors.append(e)
+    threads = [ Thread(target=write) for _ in range(8) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with sessions() as session:
+        assert session.scalar(select(func.count()).select_from(Row)) == 160
+
+def test_slot_is_held_until_transaction_ends(tmp_path):
+    coordinator = WriteCoordinator(1, 10, 0, 10)
+    sessions = make_sessions(tmp_path / "test.db", coordinator)
+    with sessions() as first, sessions() as second:
+        first.add(Row())
+        first.flush()
+        # bulk statements need the slot too
+        with pytest.raises(ServiceOverloaded):
+            second.execute(insert(Row).values(id=100))
+        first.rollback()
+        second.execute(insert(Row).values(id=100))
+        second.commit()
+    # nobody is left waiting or holding the slot
+    assert coordinator.waiting == 0
+    with sessions() as session:
+        session.add(Row())
+        session.commit()
+
+def test_slot_is_free_after_commit(tmp_path):
+    coordinator = WriteCoordinator(1, 10, 0, 10)
+    sessions = make_sessions(tmp_path / "test.db", coordinator)
+    held = []
+    with sessions() as session:
+        # work deferred until after the commit, like sending emails, runs without the slot
+        event.listen(session, "after_commit", lambda _: held.append(coordinator._slot.locked()))
+        session.add(Row())
+        session.commit()
+    assert held == [ False ]
+
+def test_never_waits_on_the_event_loop(tmp_path):
+    sessions = make_sessions(tmp_path / "test.db", WriteCoordinator(64, 5000, 0, 10))
+    async def write(session):
+        session.add(Row())
+        session.flush()
+    with sessions() as first, sessions() as second:
+        first.add(Row())
+        first.flush()
+        # fails straight away instead of blocking the loop for the whole timeout
+        with pytest.raises(ServiceOverloaded):
+            asyncio.run(write(second))
+        first.commit()
+        asyncio.run(write(second))
+        second.commit()
+
+def test_queue_is_bounded(tmp_path):
+    sessions = make_sessions(tmp_path / "test.db", WriteCoordinator(0, 1000, 0, 10))
+    with sessions() as first, sessions() as second:
+        first.add(Row())
+        first.flush()
+        second.add(Row())
+        with pytest.raises(ServiceOverloaded):
+            second.flush()
+
+def test_retries_while_another_process_writes(tmp_path):
+    path = tmp_path / "test.db"
+    sessions = make_sessions(path, WriteCoordinator(64, 1000, 5, 10))
+    other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    Timer(0.05, other.execute, [ "COMMIT" ]).start()
+    with sessions() as session:
+        session.add(Row())
+        session.commit()
+    # without retries, it fails while the lock is held
+    sessions = make_sessions(path, WriteCoordinator(64, 1000, 0, 10))
+    other.execute("BEGIN IMMEDIATE")
+    with sessions() as session:
+        session.add(Row())
+        with pytest.raises(OperationalError):
+            session.flush()
+    other.execute("COMMIT")
+    other.close()
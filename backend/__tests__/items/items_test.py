@@ -1,8 +1,10 @@
 """Module for testing the item routes"""
 
+from sqlalchemy import event
+
 from backend.__tests__ import mock
 
-from backend.database.schema import DBCustomer
+from backend.database.schema import DBCustomer, SINGLE_TABLE_ITEMS
 
 def test_get_items1(client, get_item):
     response = client.get(f"/boards/{mock.to_uuid(1, 'board')}/items")
@@ -155,6 +157,19 @@ def test_create_private_item_unauthorized(client, auth_headers, items, exception
     assert response.json() == exception("entity_not_found", f"Unable to find board with id={mock.to_uuid(3, 'board')}")
     assert response.status_code == 404
 
+def test_create_item_without_reload(session, client, auth_headers, items):
+    # each row is one insert, and the server defaults come back with it rather than in another query
+    headers = auth_headers(1)
+    statements = []
+    event.listen(session.get_bind(), "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    mock.last_uuid = mock.OFFSETS['item'] + len(items)
+    response = client.post(f"/boards/{mock.to_uuid(1, 'board')}/items", headers=headers, json={ "type": "media", "url": "/static/images/test_image.png" })
+    assert response.status_code == 201
+    inserts = [ i for i, statement in enumerate(statements) if statement.startswith("INSERT") ]
+    assert [ statements[i].split(" (")[0] for i in inserts ] == ([ "INSERT INTO items" ] if SINGLE_TABLE_ITEMS else [ "INSERT INTO items", "INSERT INTO items_media" ])
+    assert "RETURNING created_at, updated_at" in statements[inserts[0]]
+    assert not any(statement.startswith("SELECT") for statement in statements[inserts[-1]:])
+
 def test_create_item_missing_fields(client, auth_headers, items, exception):
     item = { "type": "note" }
     mock.last_uuid = mock.OFFSETS['item'] + len(items)
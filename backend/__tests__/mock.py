@@ -49,4 +49,5 @@ KEY_LIMITS = {
     "submit_report": (100, 1),
     "media": (100, 1),
     "static": (100, 1),
+    "stripe": (100, 1),
 }
\ No newline at end of file
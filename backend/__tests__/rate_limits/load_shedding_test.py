@@ -0,0 +1,83 @@
+"""Module for testing adaptive concurrency limits"""
+import asyncio
+import pytest
+from fastapi import Request
+from threading import current_thread, main_thread
+
+from backend.utils import load_shedding
+from backend.utils.load_shedding import Bulkhead
+from backend.utils.rate_limiter import limit
+
+def test_limit_adapts():
+    bulkhead = Bulkhead(4, 6, 0, 100)
+    # Fast requests raise the limit up to the maximum
+    for _ in range(100):
+        bulkhead.in_flight += 1
+        bulkhead.release(0.01)
+    assert bulkhead.limit == 6
+    # Slow requests lower it, but never below one
+    bulkhead.in_flight += 1
+    bulkhead.release(1)
+    assert bulkhead.limit < 6
+    for _ in range(100):
+        bulkhead.in_flight += 1
+        bulkhead.release(1)
+    assert bulkhead.limit == 1
+    assert bulkhead.in_flight == 0
+
+def test_queue():
+    async def run():
+        bulkhead = Bulkhead(1, 1, 1, 100)
+        assert await bulkhead.acquire(1)
+        # One request can wait, and gets the slot when it is released
+        waiting = asyncio.create_task(bulkhead.acquire(1))
+        await asyncio.sleep(0)
+        # The queue is full
+        assert not await bulkhead.acquire(1)
+        bulkhead.release(0.01)
+        assert await waiting
+        assert bulkhead.in_flight == 1
+        # Waiting too long gives up
+        assert not await bulkhead.acquire(0.01)
+        bulkhead.release(0.01)
+        assert bulkhead.in_flight == 0
+    asyncio.run(run())
+
+def test_route_groups():
+    assert load_shedding.route_group("board", "GET") == "board_read"
+    assert load_shedding.route_group("board_action", "PUT") == "board_write"
+    assert load_shedding.route_group("auth", "POST") == "auth"
+    assert load_shedding.route_group("main", "GET") is None
+
+def test_overloaded_group(client, setup, monkeypatch):
+    async def full(self, timeout):
+        return False
+    monkeypatch.setattr(Bulkhead, "acquire", full)
+    response = client.get("/boards")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["error"] == "service_overloaded"
+    # Routes outside of any group are unaffected
+    assert client.get("/status").status_code == 200
+
+def test_sync_routes_use_their_group_threads():
+    def route(request):
+        return current_thread()
+    async def run():
+        request = Request({ "type": "http", "method": "GET", "path": "/", "headers": [] })
+        auth, board = limit("auth")(route), limit("board")(route)
+        # Take every thread of the auth group
+        limiter = load_shedding.THREAD_LIMITERS["auth"]
+        borrowers = [ object() for _ in range(int(limiter.total_tokens)) ]
+        for borrower in borrowers:
+            await limiter.acquire_on_behalf_of(borrower)
+        try:
+            # Board routes still run, off the event loop, while auth routes wait for a thread
+            assert await asyncio.wait_for(board(request), 1) is not main_thread()
+            with pytest.raises(TimeoutError):
+                await asyncio.wait_for(auth(request), 0.1)
+        finally:
+            for borrower in borrowers:
+                limiter.release_on_behalf_of(borrower)
+        assert await auth(request) is not main_thread()
+    asyncio.run(run())
@@ -0,0 +1,158 @@
+"""Module for testing the rate limiter"""
+import pytest
+from io import BytesIO
+import asyncio
+import sqlite3
+import time
+
+from backend.utils import rate_limiter
+from backend.utils.rate_limiter import MemoryBackend, SQLiteBackend
+
+@pytest.fixture(params=[ "memory", "sqlite" ])
+def clock(request, tmp_path, monkeypatch):
+    # a fake clock for the limiter, starting from a clean slate with each backend
+    now = [ 1000.0 ]
+    monkeypatch.setattr(rate_limiter, "time", lambda: now[0])
+    backend = MemoryBackend(100) if request.param == "memory" else SQLiteBackend(str(tmp_path / "limits.db"))
+    monkeypatch.setattr(rate_limiter, "backend", backend)
+    return now
+
+def test_burst_then_rate(clock):
+    count, window_size = rate_limiter.KEY_LIMITS["board"]
+    # A full burst is allowed
+    for _ in range(count):
+        assert rate_limiter.hit("board", "1.1.1.1")
+    assert not rate_limiter.hit("board", "1.1.1.1")
+    # Other hosts and keys are unaffected
+    assert rate_limiter.hit("board", "2.2.2.2")
+    assert rate_limiter.hit("account", "1.1.1.1")
+    # One more request is allowed after each interval
+    clock[0] += window_size / count
+    assert rate_limiter.hit("board", "1.1.1.1")
+    assert not rate_limiter.hit("board", "1.1.1.1")
+    # The full burst is available again after a window
+    clock[0] += window_size
+    for _ in range(count):
+        assert rate_limiter.hit("board", "1.1.1.1")
+
+def test_forced_is_never_limited(clock):
+    for _ in range(1000):
+        assert rate_limiter.hit("forced", "1.1.1.1")
+    if isinstance(rate_limiter.backend, MemoryBackend):
+        assert len(rate_limiter.backend.usage) == 0
+
+def test_unknown_key(clock):
+    with pytest.raises(ValueError):
+        rate_limiter.hit("unknown", "1.1.1.1")
+
+def test_idle_hosts_are_evicted(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backend", MemoryBackend(10))
+    for i in range(1000):
+        rate_limiter.hit("board", f"10.0.{i // 256}.{i % 256}")
+    assert len(rate_limiter.backend.usage) == 10
+
+def test_sqlite_backend_is_shared(tmp_path):
+    # Two backends on the same file behave like two worker processes
+    path = str(tmp_path / "limits.db")
+    workers = [ SQLiteBackend(path), SQLiteBackend(path) ]
+    results = [ workers[i % 2].hit("1.1.1.1", "board", 1, 5, 1000.0) for i in range(10) ]
+    assert results == [ True ] * 5 + [ False ] * 5
+
+def test_sqlite_backend_prunes_expired(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "limits.db"), prune_every=10)
+    for i in range(9):
+        backend.hit(f"host{i}", "board", 1, 5, 1000.0)
+    backend.hit("late", "board", 1, 5, 2000.0)
+    assert backend._connection().execute("SELECT host FROM rate_limits").fetchall() == [ ("late",) ]
+
+@pytest.fixture
+def strict_limits(client, monkeypatch):
+    # one request per minute for every key
+    monkeypatch.setattr(rate_limiter, "KEY_LIMITS", { key: (1, 60) for key in rate_limiter.KEY_LIMITS })
+    monkeypatch.setattr(rate_limiter, "backend", MemoryBackend(100))
+    return client
+
+def test_middleware_rejects(strict_limits, exception):
+    assert strict_limits.get("/status").status_code == 200
+    response = strict_limits.get("/status")
+    assert response.json() == exception("too_many_requests", "You are accessing this resource too quickly. Please try again later.")
+    assert response.status_code == 429
+
+def test_middleware_rejects_before_dependencies(strict_limits, monkeypatch):
+    from backend import app
+    from backend.dependencies import get_session
+    response = strict_limits.get("/accounts/me")
+    assert response.status_code == 403 # not authenticated
+    # The second request never opens a session or checks for an access token
+    def no_session():
+        raise AssertionError("session opened")
+    monkeypatch.setitem(app.dependency_overrides, get_session, no_session)
+    response = strict_limits.get("/accounts/me")
+    assert response.status_code == 429
+
+def test_middleware_ignores_unlimited_routes(strict_limits):
+    for _ in range(3):
+        assert strict_limits.get("/favicon.ico").status_code != 429
+        assert strict_limits.get("/no/such/route").status_code == 404
+
+def test_middleware_checks_sqlite_off_the_event_loop(strict_limits, tmp_path, monkeypatch):
+    on_loop = []
+    class Backend(SQLiteBackend):
+        def hit(self, *args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return super().hit(*args)
+    monkeypatch.setattr(rate_limiter, "backend", Backend(str(tmp_path / "limits.db")))
+    assert strict_limits.get("/status").status_code == 200
+    assert strict_limits.get("/status").status_code == 429
+    assert on_loop == [ False, False ]
+
+def test_sqlite_backend_fails_open_when_locked(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "limits.db"), timeout=0.01)
+    backend.hit("host", "board", 60, 60, 1000.0)
+    with sqlite3.connect(tmp_path / "limits.db", isolation_level=None) as other:
+        other.execute("BEGIN IMMEDIATE")
+        start = time.monotonic()
+        assert backend.hit("host", "board", 60, 60, 1000.0) # over the limit, but allowed
+        assert time.monotonic() - start < 1
+        other.execute("ROLLBACK")
+    assert not backend.hit("host", "board", 60, 60, 1000.0)
+
+def test_cost(clock):
+    count, _ = rate_limiter.KEY_LIMITS["board"]
+    assert rate_limiter.hit("board", "1.1.1.1", count - 1)
+    assert not rate_limiter.hit("board", "1.1.1.1", 2)
+    assert rate_limiter.hit("board", "1.1.1.1")
+    # Costs above the count use the whole burst, but are still allowed
+    assert rate_limiter.hit("board", "2.2.2.2", count * 10)
+    assert not rate_limiter.hit("board", "2.2.2.2")
+
+def test_limits_per_account(client, setup, auth_headers, monkeypatch):
+    alice, bob = auth_headers(1), auth_headers(2)
+    monkeypatch.setattr(rate_limiter, "KEY_LIMITS", { key: (1, 60) for key in rate_limiter.KEY_LIMITS })
+    monkeypatch.setattr(rate_limiter, "backend", MemoryBackend(100))
+    # Each account has its own budget, even from the same host
+    assert client.get("/accounts/me", headers=alice).status_code == 200
+    assert client.get("/accounts/me", headers=bob).status_code == 200
+    assert client.get("/accounts/me", headers=alice).status_code == 429
+    # Requests without a valid token share the host's budget
+    assert client.get("/accounts/me").status_code == 403
+    assert client.get("/accounts/me", headers={ "Authorization": "Bearer invalid" }).status_code == 429
+
+def test_upload_cost(client, setup, auth_headers, create_image, static_path, monkeypatch):
+    headers = auth_headers(1)
+    monkeypatch.setattr(rate_limiter.settings, "static_path", static_path)
+    monkeypatch.setattr(rate_limiter, "KEY_LIMITS", { key: (4, 60) for key in rate_limiter.KEY_LIMITS })
+    monkeypatch.setattr(rate_limiter, "backend", MemoryBackend(100))
+    buffer = BytesIO()
+    create_image(100, 100).save(buffer, format="PNG")
+    image = buffer.getvalue()
+    # This upload costs as much as 4 requests
+    monkeypatch.setattr(rate_limiter.settings, "rate_limit_upload_unit", len(image) // 3)
+    response = client.post("/media/images/upload", headers=headers, files={ "file": ("test_upload_cost.png", image, "image/png") })
+    assert response.status_code == 201
+    response = client.post("/media/images/upload", headers=headers, files={ "file": ("test_upload_cost.png", image, "image/png") })
+    assert response.status_code == 429
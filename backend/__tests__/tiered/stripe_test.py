@@ -0,0 +1,25 @@
+"""Module for testing the Stripe webhook"""
+from sqlalchemy import event
+
+from backend.__tests__ import mock
+from backend.database.schema import DBCustomer
+from backend.utils import email_handler, stripe
+
+def test_webhook_commits_once(session, client, monkeypatch):
+    customer = session.get(DBCustomer, mock.to_uuid(1, 'customer'))
+    customer.type = "active"
+    customer.stripe_id = "cus_1"
+    session.commit()
+    webhook = { "type": "invoice.payment_failed", "data": { "object": { "customer": "cus_1" } } }
+    monkeypatch.setattr(stripe.stripe.Webhook, "construct_event", lambda payload, sig_header, secret: webhook)
+    commits, sent = [], []
+    event.listen(session, "after_commit", lambda _: commits.append(None))
+    monkeypatch.setattr(email_handler, "send_subscription_failure_email", lambda customer: sent.append(len(commits)))
+    response = client.post("/stripe/webhook", headers={ "stripe-signature": "signature" }, content=b"{}")
+    assert response.status_code == 200
+    # The change is saved by the request's single commit
+    assert len(commits) == 1
+    session.expire_all()
+    assert session.get(DBCustomer, mock.to_uuid(1, 'customer')).type == "inactive"
+    # The email was composed during the request
+    assert sent == [ 0 ]
@@ -1,8 +1,14 @@
 """Tests related to restricting features to free-tier users."""
+from datetime import datetime, UTC, timedelta
+from time import monotonic
+
+from jose import jwt
 
 from backend.config import settings
 from backend.__tests__ import mock
 from backend.database.schema import DBCustomer
+from backend.utils import auth_cache
+from backend.utils.entitlements import effective_tier
 
 def test_create_premium_item(client, auth_headers, items, exception):
     config = { "type": "document", "title": "Created Document" }
@@ -147,4 +153,46 @@ def test_create_item_over_limit_owner_authoritative_positive(session, monkeypatc
         **def_item(1),
         **config,
     }
-    assert response.status_code == 201
\ No newline at end of file
+    assert response.status_code == 201
+def test_effective_tier():
+    now = datetime(2025, 1, 10, tzinfo=UTC)
+    grace = timedelta(seconds=settings.subscription_grace_period)
+    assert effective_tier("active", now + timedelta(1), now) == ("active", now + timedelta(1))
+    assert effective_tier("active", now - timedelta(1), now) == ("inactive", now - timedelta(1) + grace)
+    assert effective_tier("inactive", now - timedelta(1), now) == ("inactive", now - timedelta(1) + grace)
+    assert effective_tier("active", now - grace, now) == ("free", None)
+    assert effective_tier("terminated", now + timedelta(1), now) == ("terminated", now + timedelta(1))
+    assert effective_tier("terminated", now - timedelta(1), now) == ("free", None)
+    # Stored datetimes are naive UTC
+    assert effective_tier("active", datetime(2025, 1, 11), now) == ("active", datetime(2025, 1, 11, tzinfo=UTC))
+    assert effective_tier("lifetime", None, now) == ("lifetime", None)
+    assert effective_tier(None, None, now) == (None, None)
+
+def test_expired_subscription(session, client, auth_headers, items, exception):
+    # An expired subscription keeps premium features during the grace period, before the maintenance job has run
+    customer = session.get(DBCustomer, mock.to_uuid(1, 'customer'))
+    customer.type = "active"
+    customer.expiration = datetime.now(UTC) - timedelta(1)
+    session.commit()
+    config = { "type": "document", "title": "Created Document" }
+    mock.last_uuid = mock.OFFSETS['item'] + len(items)
+    response = client.post(f"/boards/{mock.to_uuid(1, 'board')}/items", headers=auth_headers(1), json=config)
+    assert response.status_code == 201
+    # And loses them afterwards, even though it is still stored as active
+    customer.expiration = datetime.now(UTC) - timedelta(seconds=settings.subscription_grace_period + 1)
+    session.commit()
+    response = client.post(f"/boards/{mock.to_uuid(1, 'board')}/items", headers=auth_headers(1), json=config)
+    assert response.json() == exception("premium_feature", "This feature is exclusive to Premium users. Please upgrade your subscription.")
+    assert response.status_code == 403
+
+def test_snapshot_expires_with_tier(session, create_login, client):
+    # A snapshot is only cached until the tier changes, and so are the claims in access tokens
+    customer = session.get(DBCustomer, mock.to_uuid(1, 'customer'))
+    customer.type = "active"
+    expiration = datetime.now(UTC) + timedelta(seconds=30)
+    customer.expiration = expiration
+    session.commit()
+    response = client.post("/auth/token", data=create_login(1))
+    payload = jwt.decode(response.json()["access_token"], settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
+    assert (payload["tier"], payload["tier_exp"]) == ("active", int(expiration.timestamp()))
+    assert auth_cache.accounts._entries[mock.to_uuid(1)][0] <= monotonic() + 30
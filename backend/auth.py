@@ -6,17 +6,18 @@ import uuid
 import bcrypt
 from jose import jwt
 from jose.exceptions import ExpiredSignatureError, JWTError
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, update as update_statement, event, inspect, func
+from sqlalchemy.orm import Session, sessionmaker
 import re
-from json import dumps
 
 from backend.config import settings
+from backend import dependencies
 from backend.dependencies import DBSession
-from backend.database.schema import DBAccount, DBRefreshToken, DBPermission, DBCustomer, DBEmailVerification, DBPasswordChangeRequest, DBAuthEvent
+from backend.database.schema import DBAccount, DBRefreshToken, DBPermission, DBCustomer, DBEmailVerification, DBPasswordChangeRequest
 from backend.exceptions import *
-from backend.models.auth import AccessPayload, RefreshPayload, Login, Registration, PasswordChange
+from backend.models.auth import AccessPayload, AccountSnapshot, RefreshPayload, Login, Registration, PasswordChange
 from backend.models.accounts import AuthenticatedAccount
-from backend.utils import email_handler
+from backend.utils import email_handler, auth_cache, audit
 
 def hash_password(password: str) -> str:
     """Hash a password with bcrypt.
@@ -48,19 +49,28 @@ def check_password(password: str, hashed_password: str) -> str:
     )
 
 # gotta repeat these here because of circular imports
+def get_by_identifier(session: DBSession, *identifiers: str) -> DBAccount | None: # type: ignore
+    """Retrieve the account whose username, email or pending email matches any of the identifiers, ignoring case.
+    
+    This is a single query, and each comparison uses one of the lower-cased unique indexes."""
+    identifiers = [ identifier.lower() for identifier in identifiers ]
+    pending = select(DBEmailVerification.account_id).where(func.lower(DBEmailVerification.email).in_(identifiers)) # also check unverified emails
+    stmt = select(DBAccount).where(
+        func.lower(DBAccount.username).in_(identifiers)
+        | func.lower(DBAccount.email).in_(identifiers)
+        | DBAccount.id.in_(pending)
+    )
+    return session.execute(stmt).scalars().first()
+
 def get_by_email(session: DBSession, email: str) -> DBAccount | None: # type: ignore
-    """Retrieve account by email"""
-    stmt = select(DBAccount).where(DBAccount.email == email)
-    account: DBAccount | None = session.execute(stmt).scalars().one_or_none()
-    if account is not None:
-        return account
-    stmt = select(DBEmailVerification).where(DBEmailVerification.email == email) # also check unverified emails
-    verification: DBEmailVerification | None = session.execute(stmt).scalars().one_or_none()
-    return verification.account if verification is not None else None
+    """Retrieve account by email or pending email, ignoring case"""
+    pending = select(DBEmailVerification.account_id).where(func.lower(DBEmailVerification.email) == email.lower()) # also check unverified emails
+    stmt = select(DBAccount).where((func.lower(DBAccount.email) == email.lower()) | DBAccount.id.in_(pending))
+    return session.execute(stmt).scalars().first()
 
 def get_by_username(session: DBSession, username: str) -> DBAccount | None: # type: ignore
-    """Retrieve account by email"""
-    stmt = select(DBAccount).where(DBAccount.username == username)
+    """Retrieve account by username, ignoring case"""
+    stmt = select(DBAccount).where(func.lower(DBAccount.username) == username.lower())
     return session.execute(stmt).scalars().one_or_none()
 
 def register_account(host: str, session: DBSession, form: Registration) -> DBAccount: # type: ignore
@@ -77,9 +87,11 @@ def register_account(host: str, session: DBSession, form: Registration) -> DBAcc
         DuplicateEntity: if the username or email is already taken
     """
     # Make sure the username and email are not already registered
-    if get_by_email(session, form.email) is not None:
-        raise DuplicateEntity("account", "email", form.email)
-    if get_by_username(session, form.username) is not None:
+    existing: DBAccount | None = get_by_identifier(session, form.email, form.username)
+    if existing is not None:
+        pending = existing.email_verification.email if existing.email_verification is not None else None
+        if form.email.lower() in [ (existing.email or "").lower(), (pending or "").lower() ]:
+            raise DuplicateEntity("account", "email", form.email)
         raise DuplicateEntity("account", "username", form.username)
     # Validation
     if len(form.email) > 64:
@@ -98,22 +110,17 @@ def register_account(host: str, session: DBSession, form: Registration) -> DBAcc
     )
     # Add and setup
     session.add(new_account)
-    session.commit()
-    session.refresh(new_account)
+    session.flush()
     new_account.permission = DBPermission( account_id=new_account.id )
     new_account.customer = DBCustomer( account_id=new_account.id )
     session.add(new_account)
-    session.commit()
     # Send email verification
     email_verification = DBEmailVerification( account_id=new_account.id, email=form.email )
     session.add(email_verification)
-    session.commit()
-    session.refresh(email_verification)
-    email_handler.send_verification_email(new_account, email_verification)
+    session.flush()
+    email_handler.send_after_commit(session, email_handler.send_verification_email, new_account, email_verification)
     # Log the event
-    event = DBAuthEvent(account_id=new_account.id, event_type="registration", host=host, detail=dumps(AuthenticatedAccount.model_validate(new_account.__dict__).model_dump()))
-    session.add(event)
-    session.commit()
+    audit.record(session, new_account.id, "registration", host, AuthenticatedAccount.model_validate(new_account.__dict__).model_dump())
     # Return
     return new_account
     
@@ -131,10 +138,8 @@ def generate_tokens(session: DBSession, form: Login, host: str | None = None) ->
         InvalidCredentials: if the username or password is invalid
     """
     # Verify login
-    account: DBAccount = get_by_email(session, form.identifier)
-    if account is None:
-        account = get_by_username(session, form.identifier)
-    if account is None:
+    account: DBAccount | None = get_by_identifier(session, form.identifier)
+    if account is None or account.deleted_at is not None:
         raise InvalidCredentials()
     account = verify_account(account, form.password)
     # Generate an access token
@@ -151,9 +156,7 @@ def generate_tokens(session: DBSession, form: Login, host: str | None = None) ->
     )
     # Log the event
     if host is not None:
-        event = DBAuthEvent(account_id=account.id, event_type="login", host=host)
-        session.add(event)
-        session.commit()
+        audit.record(session, account.id, "login", host)
     # Return these tokens
     return access_token, refresh_token
 
@@ -189,20 +192,33 @@ def extract_account(session: DBSession, token: str) -> DBAccount: # type: ignore
         DBAccount: The account tied to the token
 
     Raises:
-        InvalidAccessToken: if the token is expired or invalid
+        InvalidAccessToken: if the token is expired or invalid, or its claims are out of date
     """
     # Get the information
     payload = _extract_access_payload(token)
     # Make sure the account exists
     account_id = payload.sub
     account = session.get(DBAccount, account_id)
-    if account is None:
+    if account is None or account.deleted_at is not None:
         raise InvalidAccessToken()
+    # Trust the entitlement claims if they are current, or make the client refresh the token if not
+    if payload.ver is not None:
+        if payload.ver != account.claims_version:
+            raise InvalidAccessToken()
+        if auth_cache.accounts.get(account.id) is None:
+            # The tier claim is only good until the tier changes, after which the snapshot is built from the database
+            auth_cache.accounts.set(account.id, AccountSnapshot(
+                id=account.id,
+                email_verified=account.email is not None,
+                role=payload.role,
+                tier=payload.tier,
+                tier_until=payload.tier_exp,
+            ), min(payload.exp, payload.tier_exp or payload.exp) - int(datetime.now(UTC).timestamp()))
     # Return the account
     return account
 
-def refresh_access_token(session: DBSession, refresh_token: str) -> str: # type: ignore
-    """Attempts to refresh an access token
+def refresh_access_token(session: DBSession, refresh_token: str) -> tuple[str, str]: # type: ignore
+    """Attempts to refresh an access token, rotating the refresh token
     
     Args:
         session (Session): The database session
@@ -210,22 +226,35 @@ def refresh_access_token(session: DBSession, refresh_token: str) -> str: # type:
         
     Returns:
         str: The new access token
+        str: The new refresh token. The old one is only accepted for `jwt_refresh_grace` more seconds, and gets the same new token.
         
     Raises:
-        InvalidRefreshToken: if the token is expired or invalid
+        InvalidRefreshToken: if the token is expired or invalid, or was already used
     """
     # Verify the refresh token and extract the payload
     payload: RefreshPayload = _extract_refresh_payload(session, refresh_token)
     # Get the account
     account = session.get(DBAccount, payload.sub)
-    if account is None:
+    if account is None or account.deleted_at is not None:
         raise InvalidRefreshToken()
-    # Generate a new access token
-    return jwt.encode(
+    # Generate a new access token and rotate the refresh token
+    access_token = jwt.encode(
         _generate_access_payload(account).model_dump(),
         settings.jwt_secret_key,
         algorithm=settings.jwt_algorithm
     )
+    # A token that was just rotated out gets the same replacement as the refresh that rotated it
+    db_token: DBRefreshToken = session.get(DBRefreshToken, payload.fid or payload.uid)
+    if payload.uid == db_token.previous_uid:
+        successor = _current_refresh_payload(db_token)
+    else:
+        successor = _generate_refresh_payload(session, account, payload.fid or payload.uid, payload.uid)
+    refresh_token = jwt.encode(
+        successor.model_dump(),
+        settings.jwt_secret_key,
+        algorithm=settings.jwt_algorithm
+    )
+    return access_token, refresh_token
     
 def revoke_one_refresh_token(host: str, session: DBSession, token: str): # type: ignore
     """Removes a refresh tokens for an account in the database, ensuring it cannot be used to log in again.
@@ -236,12 +265,10 @@ def revoke_one_refresh_token(host: str, session: DBSession, token: str): # type:
     """
     # Verify the refresh token and extract the payload
     payload: RefreshPayload = _extract_refresh_payload(session, token)
-    stmt = delete(DBRefreshToken).where(DBRefreshToken.token_id == payload.uid)
+    stmt = delete(DBRefreshToken).where(DBRefreshToken.token_id == (payload.fid or payload.uid))
     session.execute(stmt)
     # Log the event
-    event = DBAuthEvent(account_id=payload.sub, event_type="logout", host=host)
-    session.add(event)
-    session.commit()
+    audit.record(session, payload.sub, "logout", host)
     
 def revoke_refresh_tokens(host: str, session: DBSession, account: DBAccount): # type: ignore
     """Removes all refresh tokens for an account in the database, logging them out on all devices.
@@ -252,10 +279,9 @@ def revoke_refresh_tokens(host: str, session: DBSession, account: DBAccount): #
     """
     stmt = delete(DBRefreshToken).where(DBRefreshToken.account_id == account.id)
     session.execute(stmt)
+    auth_cache.invalidate_account(account.id)
     # Log the event
-    event = DBAuthEvent(account_id=account.id, event_type="force_logout", host=host)
-    session.add(event)
-    session.commit()
+    audit.record(session, account.id, "force_logout", host)
 
 def _generate_access_payload(account: DBAccount) -> AccessPayload:
     """Create a payload for an access token for this account.
@@ -270,12 +296,21 @@ def _generate_access_payload(account: DBAccount) -> AccessPayload:
     iat = int(datetime.now(UTC).timestamp())
     exp = iat + settings.jwt_access_duration
     # Create the token
-    return AccessPayload(
+    payload = AccessPayload(
         sub=str(account.id),
         iss=settings.app_domain,
         iat=iat,
         exp=exp
     )
+    # Add entitlement claims
+    if settings.jwt_entitlement_claims:
+        snapshot = auth_cache.get_snapshot(account)
+        payload.ver = account.claims_version
+        payload.role = snapshot.role
+        payload.tier = snapshot.tier
+        payload.tier_exp = snapshot.tier_until
+        payload.verified = snapshot.email_verified
+    return payload
 
 def _extract_access_payload(token: str) -> AccessPayload:
     """Verify and extract payload from JWT access token.
@@ -289,24 +324,31 @@ def _extract_access_payload(token: str) -> AccessPayload:
     Raises:
         InvalidAccessToken: if the token has expired or was tampered with
     """
+    # Skip decoding tokens that were already verified
+    cached = auth_cache.get_payload(token)
+    if cached is not None:
+        return cached
     try:
-        payload = jwt.decode(
+        payload = AccessPayload(**jwt.decode(
             token,
             settings.jwt_secret_key,
             algorithms=[settings.jwt_algorithm]
-        )
-        return AccessPayload(**payload)
+        ))
     except ExpiredSignatureError:
         raise InvalidAccessToken()
     except JWTError:
         raise InvalidAccessToken()
+    auth_cache.set_payload(token, payload)
+    return payload
 
-def _generate_refresh_payload(session: DBSession, account: DBAccount) -> RefreshPayload: # type: ignore
-    """Create a payload for an access token for this account.
+def _generate_refresh_payload(session: DBSession, account: DBAccount, family_id: str | None = None, replacing: str | None = None) -> RefreshPayload: # type: ignore
+    """Create a payload for a refresh token for this account.
     
     Args:
         session (Session): The database session
         account (DBAccount): The account to create a token for
+        family_id (str | None): The token family to rotate, or None to start a new one
+        replacing (str | None): The uid of the token being rotated out
         
     Returns:
         RefreshPayload: The JWT payload for this account
@@ -316,19 +358,39 @@ def _generate_refresh_payload(session: DBSession, account: DBAccount) -> Refresh
     exp = iat + settings.jwt_refresh_duration
     # Create an ID for this token
     uid = str(uuid.uuid4())
-    # Track in the database
-    token = DBRefreshToken(token_id=uid, account_id=account.id, expires_at=exp)
-    session.add(token)
-    session.commit()
+    prune_refresh_tokens(session)
+    if family_id is None:
+        session.add(DBRefreshToken(token_id=uid, current_uid=uid, account_id=account.id, rotated_at=iat, expires_at=exp))
+        family_id = uid
+    else:
+        # Rotate the family only if nothing else rotated it first. If something did, both get its token.
+        stmt = update_statement(DBRefreshToken) \
+            .where(DBRefreshToken.token_id == family_id, func.coalesce(DBRefreshToken.current_uid, DBRefreshToken.token_id) == replacing) \
+            .values(current_uid=uid, previous_uid=replacing, rotated_at=iat, expires_at=exp)
+        if session.execute(stmt, execution_options={ "synchronize_session": False }).rowcount == 0:
+            token: DBRefreshToken = session.get(DBRefreshToken, family_id, populate_existing=True)
+            return _current_refresh_payload(token)
     # Create the token
     return RefreshPayload(
         sub=str(account.id),
         uid=uid,
+        fid=family_id,
         iss=settings.app_domain,
         iat=iat,
         exp=exp
     )
 
+def _current_refresh_payload(token: DBRefreshToken) -> RefreshPayload:
+    """Recreate the payload of the latest token in a family, which encodes to the same JWT it was issued as."""
+    return RefreshPayload(
+        sub=str(token.account_id),
+        uid=token.current_uid or token.token_id,
+        fid=token.token_id,
+        iss=settings.app_domain,
+        iat=token.rotated_at,
+        exp=token.expires_at
+    )
+
 def _extract_refresh_payload(session: DBSession, token: str) -> RefreshPayload: # type: ignore
     """Verify and extract payload from JWT refresh token.
     
@@ -339,31 +401,52 @@ def _extract_refresh_payload(session: DBSession, token: str) -> RefreshPayload:
         RefreshPayload: The payload of this JWT
         
     Raises:
-        InvalidRefreshToken: if the token has expired or was tampered with
+        InvalidRefreshToken: if the token has expired, was tampered with, or was already rotated
     """
     # extract the payload
-    payload: dict
+    payload: RefreshPayload
     try:
-        payload = jwt.decode(
+        payload = RefreshPayload(**jwt.decode(
             token,
             settings.jwt_secret_key,
             algorithms=[settings.jwt_algorithm]
-        )
+        ))
     except ExpiredSignatureError:
         raise InvalidRefreshToken()
     except JWTError:
         raise InvalidRefreshToken()
-    # ensure it's actually in the database
-    db_token: DBRefreshToken = session.get(DBRefreshToken, payload['uid'])
-    if db_token is None or str(db_token.account_id) != payload['sub']:
+    # ensure its family is actually in the database
+    db_token: DBRefreshToken = session.get(DBRefreshToken, payload.fid or payload.uid)
+    if db_token is None or str(db_token.account_id) != payload.sub:
         raise InvalidRefreshToken()
-    # ensure it hasn't expired in the database and delete if it has
-    if db_token.expires_at < int(datetime.now(UTC).timestamp()):
+    # ensure it hasn't expired in the database, and that it is the latest token in its family, or the one
+    # before it within the grace period (two refreshes with the same cookie, or a client that lost the new one).
+    # an old token being reused after that means it was probably stolen, so revoke the whole family.
+    now = int(datetime.now(UTC).timestamp())
+    current = payload.uid == (db_token.current_uid or db_token.token_id)
+    replaced = payload.uid == db_token.previous_uid and db_token.rotated_at is not None and now - db_token.rotated_at <= settings.jwt_refresh_grace
+    if db_token.expires_at < now or not (current or replaced):
         session.delete(db_token)
-        session.commit()
+        session.commit() # the request fails, so commit now rather than with the rest of the request
         raise InvalidRefreshToken()
     # return
-    return RefreshPayload(**payload)
+    return payload
+
+def prune_refresh_tokens(session: DBSession, limit: int | None = None) -> int: # type: ignore
+    """Delete a batch of expired refresh tokens. Does not commit.
+    
+    Args:
+        session (Session): The database session
+        limit (int | None): The most tokens to delete, defaulting to jwt_refresh_prune_batch
+
+    Returns:
+        int: The number of tokens deleted
+    """
+    expired = select(DBRefreshToken.token_id) \
+        .where(DBRefreshToken.expires_at < int(datetime.now(UTC).timestamp())) \
+        .limit(limit or settings.jwt_refresh_prune_batch)
+    stmt = delete(DBRefreshToken).where(DBRefreshToken.token_id.in_(expired))
+    return session.execute(stmt, execution_options={ "synchronize_session": False }).rowcount
 
 def verify_email(host: str,session: DBSession, verification_id: str) -> DBAccount: # type: ignore
     """Verify an email account and update it."""
@@ -378,18 +461,15 @@ def verify_email(host: str,session: DBSession, verification_id: str) -> DBAccoun
     account.email = verification.email
     session.add(account)
     session.delete(verification)
-    session.commit()
-    session.refresh(account)
+    session.flush()
     # Log the event
-    event = DBAuthEvent(account_id=account.id, event_type="email_verified", host=host, detail=dumps(AuthenticatedAccount.model_validate(account.__dict__).model_dump()))
-    session.add(event)
-    session.commit()
+    audit.record(session, account.id, "email_verified", host, AuthenticatedAccount.model_validate(account.__dict__).model_dump())
     return account
 
 def request_password_change(host: str, session: DBSession, email: str) -> None: # type: ignore
     """Sends a password change request form to the provided email address."""
     # Do nothing if this is not associated with a verified account.
-    stmt = select(DBAccount).where(DBAccount.email == email)
+    stmt = select(DBAccount).where(func.lower(DBAccount.email) == email.lower())
     account: DBAccount | None = session.execute(stmt).scalars().one_or_none()
     if account is None:
         return
@@ -399,13 +479,10 @@ def request_password_change(host: str, session: DBSession, email: str) -> None:
     # Send the request email
     change_request = DBPasswordChangeRequest( account_id=account.id )
     session.add(change_request)
-    session.commit()
-    session.refresh(change_request)
-    email_handler.send_password_change_email(account, change_request)
+    session.flush()
+    email_handler.send_after_commit(session, email_handler.send_password_change_email, account, change_request)
     # Log the event
-    event = DBAuthEvent(account_id=account.id, event_type="password_change_request", host=host, detail=dumps(AuthenticatedAccount.model_validate(account.__dict__).model_dump()))
-    session.add(event)
-    session.commit()
+    audit.record(session, account.id, "password_change_request", host, AuthenticatedAccount.model_validate(account.__dict__).model_dump())
 
 def password_change(host: str,session: DBSession, request_id: str, change: PasswordChange) -> DBAccount: # type: ignore
     """Change a password."""
@@ -423,10 +500,42 @@ def password_change(host: str,session: DBSession, request_id: str, change: Passw
     account.hashed_password = hash_password(change.password)
     session.add(account)
     session.delete(change_request)
-    session.commit()
-    session.refresh(account)
+    session.flush()
     # Log the event
-    event = DBAuthEvent(account_id=account.id, event_type="password_changed", host=host, detail=dumps(AuthenticatedAccount.model_validate(account.__dict__).model_dump()))
-    session.add(event)
-    session.commit()
-    return account
\ No newline at end of file
+    audit.record(session, account.id, "password_changed", host, AuthenticatedAccount.model_validate(account.__dict__).model_dump())
+    return account
+
+def _bump_claims_version(session: Session, flush_context, instances):
+    """Invalidate the entitlement claims in existing access tokens when a role or subscription changes."""
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, DBPermission):
+            changed = inspect(obj).attrs.role.history.has_changes()
+        elif isinstance(obj, DBCustomer):
+            changed = inspect(obj).attrs.type.history.has_changes()
+        else:
+            continue
+        # New rows may only have the account's ID set
+        account = obj.account if obj.account is not None or obj.account_id is None else session.get(DBAccount, obj.account_id)
+        if changed and account is not None:
+            account.claims_version += 1
+
+def track_claims(session_factory: sessionmaker | type[Session]) -> None:
+    """Bump the claims version whenever a session from this factory flushes a role or subscription change.
+    Bulk updates aren't flushed, so they call `bump_claims_versions` themselves."""
+    event.listen(session_factory, "before_flush", _bump_claims_version)
+
+def bump_claims_versions(session: Session, account_ids: list[str]) -> None:
+    """Invalidate the entitlement claims and cached snapshots of these accounts, after a bulk update to their roles or subscriptions."""
+    if len(account_ids) == 0:
+        return
+    statement = update_statement(DBAccount).where(DBAccount.id.in_(account_ids)).values(claims_version=DBAccount.claims_version + 1)
+    session.execute(statement, execution_options={ "synchronize_session": False })
+    # Bulk updates don't trigger the cache's mapper events
+    def after_commit(_):
+        for account_id in account_ids:
+            auth_cache.invalidate_account(account_id)
+    event.listen(session, "after_commit", after_commit, once=True)
+
+# Sessions made by the application, sync and async
+track_claims(dependencies.Session)
+track_claims(dependencies.AsyncBackingSession)
@@ -0,0 +1,47 @@
+"""Command line interface for database backups.
+
+Run from the backend folder with `PYTHONPATH=.. python -m backend.backup <command>`:
+
+- `snapshot` takes a snapshot of the database into db_backup_path while the application is running
+- `list` lists the snapshots, oldest first
+- `restore <snapshot>` replaces the database with a snapshot, or with the newest one if none is given
+"""
+
+from argparse import ArgumentParser
+import sqlite3
+import sys
+
+from backend.config import settings
+from backend.utils import backup
+
+def main(arguments: list[str] | None = None) -> int:
+    parser = ArgumentParser(prog="python -m backend.backup", description="Back up and restore the SQLite database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot", help="take a snapshot of the database")
+    commands.add_parser("list", help="list the snapshots, oldest first")
+    restore = commands.add_parser("restore", help="replace the database with a snapshot")
+    restore.add_argument("snapshot", nargs="?", help="the snapshot to restore, defaulting to the newest")
+    options = parser.parse_args(arguments)
+
+    source = backup.database_path()
+    if options.command == "snapshot":
+        print(backup.snapshot(settings.db_backup_path, source))
+    elif options.command == "list":
+        for path in backup.list_snapshots(settings.db_backup_path, source):
+            print(path)
+    elif options.command == "restore":
+        snapshots = backup.list_snapshots(settings.db_backup_path, source)
+        snapshot = options.snapshot or (snapshots[-1] if snapshots else None)
+        if snapshot is None:
+            print(f"There are no snapshots in {settings.db_backup_path}", file=sys.stderr)
+            return 1
+        try:
+            backup.restore(snapshot, source)
+        except sqlite3.DatabaseError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"Restored {source} from {snapshot}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
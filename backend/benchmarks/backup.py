@@ -0,0 +1,72 @@
+"""Measure how much a backup adds to the latency of requests running at the same time.
+
+Worker threads run small transactions like a request does, reading an account and inserting an
+auth event, while the database is copied with the defaults (`db_backup_pages` pages per batch,
+`db_backup_pause` milliseconds apart) and all at once. Run from the backend folder with
+`PYTHONPATH=.. python -m backend.benchmarks.backup`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import perf_counter, sleep
+import os
+import statistics
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.schema import Base, DBAccount, DBAuthEvent
+from backend.dependencies import configure_sqlite
+from backend.utils.backup import backup
+
+SIZE = 200 * 1024 * 1024 # bytes of auth events to fill the database with
+THREADS = 4
+BASELINE = 2 # seconds to measure without a backup
+
+def fill(Session) -> None:
+    detail = "x" * 1000
+    with Session() as session:
+        session.add(DBAccount(id="account", username="user", hashed_password="hash"))
+        for _ in range(SIZE // len(detail) // 10000):
+            session.execute(insert(DBAuthEvent), [ { "account_id": "account", "event_type": "login", "host": "127.0.0.1", "detail": detail } for _ in range(10000) ])
+        session.commit()
+
+def worker(Session, stopping: Event) -> list[float]:
+    latencies = []
+    while not stopping.is_set():
+        start = perf_counter()
+        with Session() as session:
+            account = session.execute(select(DBAccount).where(DBAccount.id == "account")).scalar_one()
+            session.add(DBAuthEvent(account_id=account.id, event_type="login", host="127.0.0.1"))
+            session.commit()
+        latencies.append(perf_counter() - start)
+        sleep(0.001) # time spent on the rest of the request
+    return latencies
+
+def measure(name: str, Session, during) -> None:
+    stopping = Event()
+    with ThreadPoolExecutor(THREADS) as executor:
+        futures = [ executor.submit(worker, Session, stopping) for _ in range(THREADS) ]
+        start = perf_counter()
+        during()
+        elapsed = perf_counter() - start
+        stopping.set()
+        latencies = sorted(latency for future in futures for latency in future.result())
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:>10}: {elapsed:5.2f} s, {len(latencies) / elapsed:6.0f} transactions/s, p50 {p50:6.2f} ms, p99 {p99:7.2f} ms, max {latencies[-1] * 1000:7.2f} ms")
+
+if __name__ == "__main__":
+    with TemporaryDirectory() as folder:
+        path = os.path.join(folder, "benchmark.db")
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        fill(Session)
+        print(f"database: {os.path.getsize(path) / 1024 / 1024:.0f} MiB")
+        measure("no backup", Session, lambda: sleep(BASELINE))
+        measure("batches", Session, lambda: backup(path, os.path.join(folder, "batches.db")))
+        measure("all at once", Session, lambda: backup(path, os.path.join(folder, "once.db"), pages=-1))
+        engine.dispose()
@@ -0,0 +1,67 @@
+"""Measure deleting a large board through the ORM's cascades and with bulk DELETE statements.
+
+The board has notes, todo lists with todo items, and lists with notes in them, and every list
+has a pin connected to the next one. Run from the backend folder with
+`PYTHONPATH=.. python -m backend.benchmarks.bulk_delete`.
+"""
+
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import os
+import tracemalloc
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.boards import delete_boards
+from backend.database.schema import Base, DBAccount, DBBoard, DBItemNote, DBItemTodo, DBItemList, DBTodoItem, DBPin
+from backend.dependencies import configure_sqlite
+
+ITEMS = 10000 # in total, including the ones in lists
+
+def create_board(Session) -> str:
+    with Session() as session:
+        account = DBAccount(username="user", hashed_password="hash")
+        board = DBBoard(name="board", identifier="board", icon="earth", owner=account)
+        session.add(board)
+        session.flush()
+        previous = None
+        for i in range(ITEMS // 10):
+            todo = DBItemTodo(board=board, position="0,0", title=f"todo {i}")
+            todo.contents = [ DBTodoItem(text=f"task {j}", done=False) for j in range(3) ]
+            item_list = DBItemList(board=board, position="0,0", title=f"list {i}")
+            session.add_all([ todo, item_list, DBItemNote(board=board, position="0,0", text=f"note {i}") ])
+            session.flush()
+            session.add_all([ DBItemNote(board=board, list=item_list, index=j, text=f"note {i}.{j}") for j in range(7) ])
+            pin = DBPin(board=board, item=item_list)
+            if previous is not None:
+                pin.connections.append(previous)
+            session.add(pin)
+            previous = pin
+        session.commit()
+        return board.id
+
+def measure(name: str, bulk: bool) -> None:
+    with TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'benchmark.db')}")
+        configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        board_id = create_board(Session)
+        tracemalloc.start()
+        start = perf_counter()
+        with Session() as session:
+            if bulk:
+                delete_boards(session, [ board_id ])
+            else:
+                session.delete(session.get(DBBoard, board_id))
+            session.commit()
+        elapsed = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        engine.dispose()
+    print(f"{name:>4}: deleted a {ITEMS} item board in {elapsed * 1000:7.0f} ms, peak memory {peak / 1024 / 1024:6.1f} MiB")
+
+if __name__ == "__main__":
+    measure("orm", False)
+    measure("bulk", True)
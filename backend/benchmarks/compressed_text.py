@@ -0,0 +1,74 @@
+"""Measure the storage saved by compressed text columns, and what compression costs reads and writes.
+
+Documents hold a few KiB of markdown, and auth events hold the account snapshot that most of
+them record. Each is written and read back through the ORM with and without compression, which
+is turned off by raising `db_compress_threshold`. Run from the backend folder with
+`PYTHONPATH=.. python -m backend.benchmarks.compressed_text`.
+"""
+
+from json import dumps
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import os
+import random
+
+from sqlalchemy import create_engine, select, func, text, LargeBinary
+from sqlalchemy.orm import sessionmaker
+
+from backend.config import settings
+from backend.database.schema import Base, DBAccount, DBBoard, DBItemDocument, DBAuthEvent, gen_uuid
+from backend.dependencies import configure_sqlite
+
+DOCUMENTS = 2000
+EVENTS = 20000
+WORDS = "the a plan board list note todo item project step next meeting design review ship test fix write draft idea".split()
+
+def document(rng: random.Random) -> str:
+    lines = [ f"# {rng.choice(WORDS).title()} {rng.choice(WORDS)}" ]
+    for _ in range(rng.randint(40, 120)):
+        lines.append(f"- [{rng.choice(' x')}] " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))))
+    return "\n".join(lines)
+
+def detail(i: int) -> str:
+    return dumps({ "id": gen_uuid(), "username": f"user{i}", "email": f"user{i}@example.com", "profile_image": None, "display_name": f"User {i}" })
+
+def measure(name: str, threshold: int) -> None:
+    settings.db_compress_threshold = threshold
+    rng = random.Random(0)
+    with TemporaryDirectory() as folder:
+        path = os.path.join(folder, "benchmark.db")
+        engine = create_engine(f"sqlite:///{path}")
+        configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            board = DBBoard(name="board", identifier="board", icon="earth", owner=DBAccount(username="user", hashed_password="hash"))
+            session.add(board)
+            session.commit()
+            board_id = board.id
+        results = []
+        for kind, rows in [ ("documents", [ DBItemDocument(board_id=board_id, position="0,0", title="doc", text=document(rng)) for _ in range(DOCUMENTS) ]),
+                            ("events", [ DBAuthEvent(account_id=gen_uuid(), event_type="registration", host="127.0.0.1", detail=detail(i)) for i in range(EVENTS) ]) ]:
+            entity, column = (DBItemDocument, DBItemDocument.text) if kind == "documents" else (DBAuthEvent, DBAuthEvent.detail)
+            start = perf_counter()
+            with Session() as session:
+                session.add_all(rows)
+                session.commit()
+                ids = [ row.id for row in rows ]
+            write = (perf_counter() - start) / len(rows) * 1e6
+            start = perf_counter()
+            with Session() as session:
+                for chunk in range(0, len(ids), 500):
+                    session.execute(select(column).where(entity.id.in_(ids[chunk:chunk + 500]))).scalars().all()
+            read = (perf_counter() - start) / len(rows) * 1e6
+            with Session() as session:
+                size = session.execute(select(func.sum(func.length(func.cast(column, LargeBinary))))).scalar()
+            results.append(f"{kind} {size / 1024 / 1024:5.1f} MiB, {write:3.0f} us/write, {read:4.1f} us/read")
+        with engine.connect() as connection:
+            connection.execute(text("VACUUM"))
+        engine.dispose()
+        print(f"{name:>12}: {', '.join(results)}, file {os.path.getsize(path) / 1024 / 1024:5.1f} MiB")
+
+if __name__ == "__main__":
+    measure("uncompressed", 2**31)
+    measure("compressed", 128)
@@ -0,0 +1,92 @@
+"""Measure board loads and item creation with items in joined tables and in a single table.
+
+The layout is chosen when the schema is imported, so each one is measured in its own process.
+Run from the backend folder with `PYTHONPATH=.. python -m backend.benchmarks.item_storage`.
+"""
+
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import os
+import subprocess
+import sys
+import types
+
+BOARD_ITEMS = 40 # top-level items on the board, a quarter of them lists
+LIST_ITEMS = 5 # items in each list
+LOADS = 300
+CREATES = 2000
+
+def load_backend(storage: str) -> None:
+    """Import the backend's settings without the app, and choose the item layout before anything imports the schema."""
+    package = types.ModuleType("backend")
+    package.__path__ = [ os.path.dirname(os.path.dirname(os.path.abspath(__file__))) ]
+    sys.modules["backend"] = package
+    from backend.config import settings
+    settings.db_item_storage = storage
+
+def measure(storage: str) -> None:
+    load_backend(storage)
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from backend.database.schema import Base, DBAccount, DBBoard, DBItemNote, DBItemLink, DBItemTodo, DBItemList
+    from backend.database.items import get_items
+    from backend.dependencies import configure_sqlite
+    from backend.models.items import ItemCollection
+
+    with TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'benchmark.db')}")
+        configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            account = DBAccount(username="user", hashed_password="hash")
+            board = DBBoard(name="board", identifier="board", icon="earth", public=True, owner=account)
+            session.add(board)
+            session.flush()
+            for i in range(BOARD_ITEMS):
+                match i % 4:
+                    case 0: session.add(DBItemNote(board=board, position="0,0", text=f"note {i}"))
+                    case 1: session.add(DBItemLink(board=board, position="0,0", title=f"link {i}", url="https://www.example.com/"))
+                    case 2: session.add(DBItemTodo(board=board, position="0,0", title=f"todo {i}"))
+                    case 3:
+                        item_list = DBItemList(board=board, position="0,0", title=f"list {i}")
+                        session.add(item_list)
+                        session.flush()
+                        for j in range(LIST_ITEMS):
+                            session.add(DBItemNote(board=board, list=item_list, index=j, text=f"note {i}.{j}"))
+            session.commit()
+            board_id = board.id
+
+        queries = []
+        event.listen(engine, "before_cursor_execute", lambda *args: queries.append(None))
+        start = perf_counter()
+        for _ in range(LOADS):
+            with Session() as session:
+                get_items(session, board_id, None)
+        load = (perf_counter() - start) / LOADS * 1000
+        load_queries = len(queries) / LOADS
+        # converting the items to a response also loads their pins and todo items
+        start = perf_counter()
+        for _ in range(LOADS):
+            with Session() as session:
+                ItemCollection.model_validate(get_items(session, board_id, None))
+        response = (perf_counter() - start) / LOADS * 1000
+
+        queries.clear()
+        start = perf_counter()
+        for i in range(CREATES):
+            with Session() as session:
+                session.add(DBItemNote(board_id=board_id, position="0,0", text=f"created {i}"))
+                session.commit()
+        create = (perf_counter() - start) / CREATES * 1000
+        create_queries = len(queries) / CREATES
+        size = os.path.getsize(os.path.join(folder, 'benchmark.db'))
+        engine.dispose()
+    print(f"{storage:>6}: board load {load:6.2f} ms ({load_queries:.0f} queries), with response {response:6.2f} ms, create {create:5.2f} ms ({create_queries:.0f} queries), {size / 1024:.0f} KiB")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        measure(sys.argv[1])
+    else:
+        for storage in [ "joined", "single" ]:
+            subprocess.run([ sys.executable, os.path.abspath(__file__), storage ], check=True)
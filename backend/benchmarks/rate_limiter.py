@@ -0,0 +1,47 @@
+"""Measure the overhead of the rate limiter per request.
+
+Compares the GCRA limiter with the sliding-window lists it replaced, and the shared SQLite
+backend with the in-process one, for traffic spread over many hosts. Run from the backend folder with `PYTHONPATH=.. python -m backend.benchmarks.rate_limiter`.
+"""
+
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+import os
+import tracemalloc
+
+from backend.utils import rate_limiter
+
+HOSTS = 10000
+REQUESTS = 200000
+
+def sliding_window(usage: dict, key: str, host: str) -> bool:
+    """The previous implementation, which kept a list of timestamps per host and key."""
+    count, window_size = rate_limiter.KEY_LIMITS[key]
+    now = time()
+    window = usage.setdefault(host, {}).setdefault(key, [])
+    window[:] = [ t for t in window if now - t < window_size ]
+    window.append(now)
+    return len(window) <= count
+
+def measure(name: str, hit) -> None:
+    hosts = [ f"10.0.{(i % HOSTS) // 256}.{i % 256}" for i in range(REQUESTS) ]
+    start = perf_counter()
+    for host in hosts:
+        hit("board", host)
+    elapsed = perf_counter() - start
+    # Memory is measured separately, as tracing slows everything down
+    tracemalloc.start()
+    for host in hosts:
+        hit("main", host)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>16}: {elapsed / REQUESTS * 1e6:6.2f} us/request, peak {peak / 1024:8.0f} KiB for {HOSTS} hosts")
+
+if __name__ == "__main__":
+    usage = {}
+    measure("sliding window", lambda key, host: sliding_window(usage, key, host))
+    rate_limiter.backend = rate_limiter.MemoryBackend(rate_limiter.settings.rate_limit_cache_size)
+    measure("gcra (memory)", rate_limiter.hit)
+    with TemporaryDirectory() as folder:
+        rate_limiter.backend = rate_limiter.SQLiteBackend(os.path.join(folder, "rate_limits.db"))
+        measure("gcra (sqlite)", rate_limiter.hit)
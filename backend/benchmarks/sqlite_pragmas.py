@@ -0,0 +1,64 @@
+"""Measure concurrent read/write throughput with and without the SQLite connection pragmas.
+
+Several threads read accounts and log auth events against a database file, the way request
+handlers do. Run from the backend folder with `PYTHONPATH=.. python -m backend.benchmarks.sqlite_pragmas`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import os
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.schema import Base, DBAccount, DBAuthEvent
+from backend.dependencies import configure_sqlite
+
+ACCOUNTS = 1000
+THREADS = 8
+OPERATIONS = 500 # per thread
+WRITE_RATIO = 0.2
+
+def worker(Session, seed: int) -> tuple[int, int]:
+    """Run a mix of reads and writes. Returns the number of operations that succeeded and failed."""
+    random = Random(seed)
+    done, failed = 0, 0
+    for _ in range(OPERATIONS):
+        try:
+            with Session() as session:
+                account_id = f"account-{random.randrange(ACCOUNTS)}"
+                if random.random() < WRITE_RATIO:
+                    session.add(DBAuthEvent(account_id=account_id, event_type="login", host="127.0.0.1"))
+                    session.commit()
+                else:
+                    session.execute(select(DBAccount).where(DBAccount.id == account_id)).scalar_one()
+            done += 1
+        except OperationalError: # database is locked
+            failed += 1
+    return done, failed
+
+def measure(name: str, tuned: bool) -> None:
+    with TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'benchmark.db')}", pool_size=THREADS)
+        if tuned:
+            configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            session.add_all([ DBAccount(id=f"account-{i}", username=f"user{i}", hashed_password=f"hash{i}") for i in range(ACCOUNTS) ])
+            session.commit()
+        start = perf_counter()
+        with ThreadPoolExecutor(THREADS) as executor:
+            results = list(executor.map(lambda seed: worker(Session, seed), range(THREADS)))
+        elapsed = perf_counter() - start
+        engine.dispose()
+    done = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    print(f"{name:>8}: {done / elapsed:8.0f} ops/s, {failed} failed with {THREADS} threads")
+
+if __name__ == "__main__":
+    measure("default", False)
+    measure("pragmas", True)
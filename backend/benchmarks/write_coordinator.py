@@ -0,0 +1,67 @@
+"""Measure write throughput as concurrency grows, with and without the write coordinator.
+
+Each thread runs small transactions that read a row, write, and then spend a moment on other
+work before committing, the way handlers like `shift_list` write several rows between
+queries. Run from the backend folder with `PYTHONPATH=.. python -m backend.benchmarks.write_coordinator`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+import os
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend.database.schema import Base, DBAccount, DBAuthEvent
+from backend.dependencies import configure_sqlite
+from backend.exceptions import ServiceOverloaded
+from backend.utils.write_coordinator import WriteCoordinator
+
+TRANSACTIONS = 2000 # in total, split between the threads
+WORK = 0.0005 # seconds spent between writes in each transaction
+
+def worker(Session, count: int) -> tuple[list[float], int]:
+    """Run write transactions. Returns how long each successful one took, and the number that failed."""
+    latencies, failed = [], 0
+    for _ in range(count):
+        start = perf_counter()
+        try:
+            with Session() as session:
+                account = session.execute(select(DBAccount).where(DBAccount.id == "account")).scalar_one()
+                session.add(DBAuthEvent(account_id=account.id, event_type="login", host="127.0.0.1"))
+                session.flush()
+                sleep(WORK)
+                session.add(DBAuthEvent(account_id=account.id, event_type="logout", host="127.0.0.1"))
+                session.commit()
+            latencies.append(perf_counter() - start)
+        except (OperationalError, ServiceOverloaded):
+            failed += 1
+    return latencies, failed
+
+def measure(threads: int, coordinated: bool) -> None:
+    with TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'benchmark.db')}", pool_size=threads)
+        configure_sqlite(engine)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            session.add(DBAccount(id="account", username="user", hashed_password="hash"))
+            session.commit()
+        if coordinated:
+            WriteCoordinator(threads, 5000, 5, 10).install(Session)
+        start = perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(lambda _: worker(Session, TRANSACTIONS // threads), range(threads)))
+        elapsed = perf_counter() - start
+        engine.dispose()
+    latencies = sorted(latency for result in results for latency in result[0])
+    failed = sum(result[1] for result in results)
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{'coordinated' if coordinated else 'contended':>11} x{threads:<3}: {len(latencies) / elapsed:6.0f} tx/s, p99 {p99:7.1f} ms, max {latencies[-1] * 1000:7.1f} ms, {failed} failed")
+
+if __name__ == "__main__":
+    for threads in [ 1, 4, 16, 32 ]:
+        measure(threads, False)
+        measure(threads, True)
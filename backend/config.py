@@ -19,17 +19,58 @@ class Settings(BaseSettings):
 
     db_url: str
     db_sqlite: bool
+    db_journal_mode: str
+    db_synchronous: str
+    db_busy_timeout: int
+    db_mmap_size: int
+    db_cache_size: int
+    db_foreign_keys: bool
+    db_item_storage: str
+    db_compress_threshold: int
+    db_compress_level: int
+    db_read_url: str | None
+    db_read_sticky_duration: int
+    db_write_coordinator: bool
+    db_write_queue_size: int
+    db_write_timeout: int
+    db_write_retries: int
+    db_write_backoff: int
+    db_backup_path: str
+    db_backup_pages: int
+    db_backup_pause: int
+    db_backup_interval: int
+    db_backup_retention: int
     assets_folder_path: str
 
     free_tier_item_limit: int
+    subscription_grace_period: int
 
     jwt_algorithm: str
     jwt_access_cookie_key: str
     jwt_refresh_cookie_key: str
     jwt_access_duration: int
     jwt_refresh_duration: int
+    jwt_entitlement_claims: bool
+    jwt_refresh_prune_batch: int
+    jwt_refresh_grace: int
     jwt_secret_key: str = "jwt-secret-key-dev"
     cookie_max_age: int
+    auth_cache_size: int
+    auth_cache_ttl: int
+    audit_batch_size: int
+    audit_flush_interval: int
+    audit_queue_size: int
+    account_purge_batch_size: int
+    account_purge_interval: int
+    maintenance_batch_size: int
+    maintenance_budget: int
+    maintenance_interval: int
+    rate_limit_backend: str
+    rate_limit_cache_size: int
+    rate_limit_db_path: str
+    rate_limit_upload_unit: int
+    load_shedding: bool
+    load_shedding_retry_after: int
 
     email_verification_duration: int
     editor_invitation_duration: int
@@ -58,17 +99,58 @@ def get_settings() -> Settings:
 
         db_url="sqlite:///database/development.db",
         db_sqlite=True,
+        db_journal_mode="WAL", # Readers don't block the writer, and the writer doesn't block readers
+        db_synchronous="NORMAL", # With WAL, only checkpoints wait for the disk. A power loss can lose the last commits but not corrupt the database
+        db_busy_timeout=5000, # Milliseconds to wait for a lock before failing with "database is locked"
+        db_mmap_size=256*1024*1024, # Read the database through up to 256 MiB of memory-mapped I/O
+        db_cache_size=-64*1024, # Page cache per connection, in KiB when negative
+        db_foreign_keys=True, # Enforce foreign keys on every connection
+        db_compress_threshold=128, # Bytes from which document and note text and auth event details are stored compressed
+        db_compress_level=6, # zlib compression level, from 1 (fastest) to 9 (smallest)
+        db_item_storage="joined", # "joined" for a table per item type, "single" to keep every type's fields in the items table. Choose before creating the database
+        db_read_url=None, # Replica for reads, e.g. "sqlite:///file:database/replica.db?mode=ro&uri=true". Reads use db_url if not set
+        db_read_sticky_duration=10, # Seconds a client keeps reading from the primary after committing something
+        db_write_coordinator=False, # Queue write transactions for a single write slot instead of contending for SQLite's lock
+        db_write_queue_size=64, # Write transactions that can wait for the slot before requests fail with a 503
+        db_write_timeout=5000, # Milliseconds a write transaction waits for the slot
+        db_write_retries=5, # Extra attempts to take SQLite's write lock when another process holds it
+        db_write_backoff=10, # Milliseconds before the first retry, doubling each time
+        db_backup_path="database/backups", # Folder for snapshots of the SQLite database
+        db_backup_pages=256, # Pages copied per batch by an online backup
+        db_backup_pause=5, # Milliseconds between batches, so backups don't compete with requests for I/O
+        db_backup_interval=3600*24, # Seconds between snapshots, or 0 to only take them with `python -m backend.backup`
+        db_backup_retention=7, # Snapshots kept before the oldest are deleted
         assets_folder_path="./assets/",
 
         free_tier_item_limit=100,
+        subscription_grace_period=3600*24*7, # Expired subscriptions keep premium features for 7 days before going back to free
 
         jwt_algorithm="HS256",
         jwt_access_cookie_key="bulletinator_access_token",
         jwt_refresh_cookie_key="bulletinator_refresh_token",
         jwt_access_duration=900,
         jwt_refresh_duration=3600*24*14,
+        jwt_refresh_prune_batch=100, # Expired refresh tokens deleted each time a token is issued
+        jwt_refresh_grace=30, # Seconds a rotated refresh token is still accepted, getting the same replacement, for refreshes that raced it
+        jwt_entitlement_claims=True, # Put role and subscription claims in access tokens so permission checks can skip the database
         app_domain="http://127.0.0.1",
         cookie_max_age=3600*24*14,
+        auth_cache_size=4096, # Verified access tokens and account snapshots kept in memory
+        auth_cache_ttl=60, # Account snapshots are re-read from the database at least once a minute
+        audit_batch_size=100, # Auth events inserted per batch
+        audit_flush_interval=250, # Auth events are written at least every 250 milliseconds
+        audit_queue_size=10000, # Auth events waiting to be written before requests write their own
+        account_purge_batch_size=500, # Rows of each kind a deleted account's purge removes per transaction
+        account_purge_interval=60, # Seconds between retries of account purges that failed
+        maintenance_batch_size=500, # Rows each maintenance statement deletes or updates at once
+        maintenance_budget=200, # Milliseconds a maintenance task runs for before letting other writers in
+        maintenance_interval=300, # Seconds between passes of the maintenance tasks
+        rate_limit_backend="memory", # "memory" for one worker process, "sqlite" to share limits between worker processes
+        rate_limit_cache_size=100000, # Hosts tracked by the rate limiter before the least recently seen are forgotten
+        rate_limit_db_path="database/rate_limits.db", # Only used by the sqlite backend
+        rate_limit_upload_unit=256*1024, # Uploads count as one extra request for every 256 KiB
+        load_shedding=True, # Limit concurrent requests to auth, media and board routes, rejecting the excess with a 503
+        load_shedding_retry_after=1, # Seconds clients are told to wait after a 503
 
         email_verification_duration=3600*24, # Should expire after 24 hours
         editor_invitation_duration=3600*24*7, # Should expire after 7 days
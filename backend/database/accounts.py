@@ -1,14 +1,17 @@
-from sqlalchemy import select
+from sqlalchemy import select, event, update as update_statement, delete as delete_statement
+from datetime import datetime, UTC
+import os
 import re
-from json import dumps
 
 from backend.dependencies import DBSession
-from backend.database.schema import DBAccount, DBCustomer, DBEmailVerification, DBAuthEvent
+from backend.database.schema import DBAccount, DBBoard, DBItem, DBCustomer, DBEmailVerification, DBImage, DBPermission, DBPasswordChangeRequest, DBRefreshToken, DBReport, editor_table
 from backend.exceptions import *
+from backend.config import settings
 
 from backend import auth
 from backend.utils import email_handler
 from backend.utils import stripe
+from backend.utils import audit
 from backend.models.accounts import AccountUpdate, AuthenticatedAccount
 
 # Account creation logic will be handled only by authentication module
@@ -16,7 +19,7 @@ from backend.models.accounts import AccountUpdate, AuthenticatedAccount
 def get_by_id(session: DBSession, account_id: str) -> DBAccount: # type: ignore
     """Retrieve account by email"""
     account = session.get(DBAccount, account_id)
-    if account is None:
+    if account is None or account.deleted_at is not None:
         raise EntityNotFound("account", "id", account_id)
     return account
 
@@ -29,28 +32,21 @@ def get_by_stripe_id(session: DBSession, stripe_id: str) -> DBCustomer: # type:
     return customer
 
 def get_by_email(session: DBSession, email: str) -> DBAccount | None: # type: ignore
-    """Retrieve account by email"""
-    stmt = select(DBAccount).where(DBAccount.email == email)
-    account: DBAccount | None = session.execute(stmt).scalars().one_or_none()
-    if account is not None:
-        return account
-    stmt = select(DBEmailVerification).where(DBEmailVerification.email == email) # also check unverified emails
-    verification: DBEmailVerification | None = session.execute(stmt).scalars().one_or_none()
-    return verification.account if verification is not None else None
+    """Retrieve account by email or pending email, ignoring case"""
+    return auth.get_by_email(session, email)
 
 def get_by_username(session: DBSession, username: str) -> DBAccount | None: # type: ignore
-    """Retrieve account by email"""
-    stmt = select(DBAccount).where(DBAccount.username == username)
-    return session.execute(stmt).scalars().one_or_none()
+    """Retrieve account by username, ignoring case"""
+    return auth.get_by_username(session, username)
 
 def get_all(session: DBSession) -> list[DBAccount]: # type: ignore
     """Retrieve all accounts"""
-    return list(session.execute(select(DBAccount)).scalars().all())
+    return list(session.execute(select(DBAccount).where(DBAccount.deleted_at == None)).scalars().all())
 
 def force_get_by_username(session: DBSession, username: str) -> DBAccount: # type: ignore
     """Raise 404 if no account has this username"""
     account: DBAccount | None = get_by_username(session, username)
-    if account is None:
+    if account is None or account.deleted_at is not None:
         raise EntityNotFound('account', 'username', username)
     return account
 
@@ -58,7 +54,7 @@ def update(host: str, session: DBSession, account: DBAccount, update: AccountUpd
     """Updates an account with non-sensitive information"""
     # Make sure the username isn't taken, and update it
     if update.username is not None and update.username != account.username:
-        if get_by_username(session, update.username) is not None:
+        if get_by_username(session, update.username) not in [ None, account ]:
             raise DuplicateEntity("account", "username", update.username)
         if len(update.username) > 64:
             raise FieldTooLong('username')
@@ -79,7 +75,7 @@ def update(host: str, session: DBSession, account: DBAccount, update: AccountUpd
     if update.email is not None and update.email != account.email:
         if not verified:
             raise InvalidCredentials()
-        if get_by_email(session, update.email) is not None:
+        if get_by_email(session, update.email) not in [ None, account ]:
             raise DuplicateEntity("account", "email", update.email)
         if len(update.email) > 64:
             raise FieldTooLong('email')
@@ -94,28 +90,65 @@ def update(host: str, session: DBSession, account: DBAccount, update: AccountUpd
         
     # Update in DB
     session.add(account)
-    session.commit()
-    session.refresh(account)
-    event = DBAuthEvent(account_id=account.id, event_type="account_update" if not verified else "sensitive_update", host=host, detail=dumps({
+    session.flush()
+    audit.record(session, account.id, "account_update" if not verified else "sensitive_update", host, {
         "account": AuthenticatedAccount.model_validate(account.__dict__).model_dump(),
         "config": update.model_dump()
-    }))
-    session.add(event)
-    session.commit()
+    })
     # Create a verification email
     if updating_email: # already did validation
         verification = DBEmailVerification( account_id=account.id, email=update.email)
         account.email_verification = verification
         session.add(account)
-        session.commit()
-        session.refresh(account)
-        email_handler.send_update_verification_email(account, verification)
+        session.flush()
+        email_handler.send_after_commit(session, email_handler.send_update_verification_email, account, verification)
     return account
 
 def delete(host: str, session: DBSession, account: DBAccount) -> None: # type: ignore
-    """Delete an account and log an event"""
-    stripe.delete_customer(account.customer)
-    session.delete(account)
-    event = DBAuthEvent(account_id=account.id, event_type="deletion", host=host, detail=dumps(AuthenticatedAccount.model_validate(account.__dict__).model_dump()))
-    session.add(event)
-    session.commit()
\ No newline at end of file
+    """Mark an account as deleted and log an event. Everything it owns is purged in the background."""
+    detail = AuthenticatedAccount.model_validate(account.__dict__).model_dump()
+    account.deleted_at = datetime.now(UTC)
+    session.add(account)
+    session.flush()
+    audit.record(session, account.id, "deletion", host, detail)
+    event.listen(session, "after_commit", lambda _: account_purge.wake(), once=True)
+
+def purge(session: DBSession, account_id: str, batch_size: int) -> bool: # type: ignore
+    """Purge the next batch of a deleted account's data, from the Stripe customer to image files, items, and finally
+    the boards and the account itself. Returns True once the account is gone.
+
+    Commit after each call. Each step is done before the next starts, so a purge that was interrupted picks up where it left off.
+    """
+    account: DBAccount | None = session.get(DBAccount, account_id)
+    if account is None:
+        return True
+    if account.customer is not None and account.customer.stripe_id is not None:
+        stripe.delete_customer(account.customer)
+        account.customer.stripe_id = None
+        return False
+    images: list[DBImage] = list(session.execute(select(DBImage).where(DBImage.uploader_id == account_id).limit(batch_size)).scalars().all())
+    if len(images) > 0:
+        for image in images:
+            try:
+                os.remove(os.path.join(settings.static_path, 'images', image.filename))
+            except OSError:
+                pass
+        session.execute(delete_statement(DBImage).where(DBImage.uuid.in_([ image.uuid for image in images ])))
+        return False
+    # Top-level items, which take the items in their lists with them
+    boards = select(DBBoard.id).where(DBBoard.owner_id == account_id)
+    items = list(session.execute(select(DBItem.id).where(DBItem.board_id.in_(boards), DBItem.list_id == None).limit(batch_size)).scalars().all())
+    if len(items) > 0:
+        items_db.delete_items(session, items)
+        return False
+    boards_db.delete_boards(session, boards)
+    session.execute(delete_statement(editor_table).where(editor_table.c.account_id == account_id))
+    session.execute(update_statement(DBReport).where(DBReport.moderator_id == account_id).values(moderator_id=None)) # reports it was assigned stay open
+    for column in [ DBReport.account_id, DBPermission.account_id, DBCustomer.account_id, DBEmailVerification.account_id, DBPasswordChangeRequest.account_id, DBRefreshToken.account_id ]:
+        session.execute(delete_statement(column.class_).where(column == account_id))
+    session.execute(delete_statement(DBAccount).where(DBAccount.id == account_id))
+    return True
+
+# gotta import this down here
+from backend.database import boards as boards_db, items as items_db
+from backend.utils import account_purge
@@ -1,11 +1,12 @@
-from sqlalchemy import select
+from sqlalchemy import select, delete as delete_statement
+from sqlalchemy.ext.asyncio import AsyncSession
 import re
 
-from backend.utils.email_handler import send_editor_invitation_email
+from backend.utils.email_handler import send_after_commit, send_editor_invitation_email
 from backend.dependencies import DBSession, name_to_identifier
 from backend.utils.permissions import BoardPolicyDecisionPoint
 from backend.database import accounts as accounts_db
-from backend.database.schema import DBBoard, DBAccount, DBEditorInvitation
+from backend.database.schema import DBBoard, DBAccount, DBEditorInvitation, DBItem, DBPin, editor_table
 from backend.exceptions import *
 
 from backend.models.boards import BoardCreate, BoardUpdate, BoardTransfer, EditorInvitation
@@ -45,17 +46,16 @@ def get_all(session: DBSession) -> list[DBBoard]: # type: ignore
     stmt = select(DBBoard).order_by(DBBoard.name)
     return list(session.execute(stmt).scalars().all())
 
-def get_visible(session: DBSession, account: DBAccount | None) -> list[DBBoard]: # type: ignore
-    """Returns a list of all boards, ordered by name, that the account can see.
-    
-    If not logged in, this is all public boards. If logged in, also includes private boards they can access."""
-    stmt = select(DBBoard).where(DBBoard.public).order_by(DBBoard.name)
-    public = list(session.execute(stmt).scalars().all())
-    editable = [] if account is None else get_editable(session, BoardPolicyDecisionPoint(session, account))
+async def get_visible_async(session: AsyncSession, account: DBAccount | None) -> list[DBBoard]:
+    """Returns a list of all boards, ordered by name, that the account can see, in a single query.
 
-    # join them into a list making sure not to add duplicates
-    union = public + [ board for board in editable if board not in public ]
-    return sorted(union, key=lambda b: b.name)
+    If not logged in, this is all public boards. If logged in, also includes private boards they own or can edit."""
+    stmt = select(DBBoard).order_by(DBBoard.name)
+    if account is None:
+        stmt = stmt.where(DBBoard.public)
+    else:
+        stmt = stmt.where(DBBoard.public | (DBBoard.owner_id == account.id) | DBBoard.id.in_(select(editor_table.c.board_id).where(editor_table.c.account_id == account.id)))
+    return list((await session.execute(stmt)).scalars().all())
 
 def get_editable(session: DBSession, pdp: BoardPolicyDecisionPoint) -> list[DBBoard]: # type: ignore
     """Returns a list of all boards editable by this account, ordered by name"""
@@ -113,8 +113,7 @@ def create(session: DBSession, pdp: BoardPolicyDecisionPoint, config: BoardCreat
         editors=editors
     )
     session.add(new_board)
-    session.commit()
-    session.refresh(new_board)
+    session.flush()
     return new_board
 
 def update(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, config: BoardUpdate) -> DBBoard: # type: ignore
@@ -144,16 +143,22 @@ def update(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, con
     if config.public is not None:
         board.public = config.public
     session.add(board)
-    session.commit()
-    session.refresh(board)
+    session.flush()
     return board
 
 def delete(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str) -> None: # type: ignore
     """Delete a board owned by this account"""
     board = get_by_id(session, board_id)
     pdp.ensure_delete(board_id)
-    session.delete(board)
-    session.commit()
+    delete_boards(session, [ board.id ])
+
+def delete_boards(session: DBSession, board_ids) -> None: # type: ignore
+    """Deletes boards with everything on them, using a few DELETE statements instead of loading it all. `board_ids` is a list of IDs or a select of them."""
+    items_db.delete_pins(session, select(DBPin.id).where(DBPin.board_id.in_(board_ids)))
+    items_db.delete_items(session, select(DBItem.id).where(DBItem.board_id.in_(board_ids)))
+    session.execute(delete_statement(DBEditorInvitation).where(DBEditorInvitation.board_id.in_(board_ids)))
+    session.execute(delete_statement(editor_table).where(editor_table.c.board_id.in_(board_ids)))
+    session.execute(delete_statement(DBBoard).where(DBBoard.id.in_(board_ids)))
 
 def get_editors(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str) -> list[DBAccount]: # type: ignore
     """Get a list of editors on this board. Editors can be seen by other editors."""
@@ -175,10 +180,9 @@ def invite_editor(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: s
     # Create an invitation
     invitation = DBEditorInvitation( board_id=board_id, email=invitation.email )
     session.add(invitation)
-    session.commit()
-    session.refresh(invitation)
+    session.flush()
     # Send the email
-    send_editor_invitation_email(board, invitation, invitation.email)
+    send_after_commit(session, send_editor_invitation_email, board, invitation, invitation.email)
     return True
 
 def remove_editor(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, editor_id: str) -> list[DBAccount]: # type: ignore
@@ -188,8 +192,7 @@ def remove_editor(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: s
     editor = accounts_db.get_by_id(session, editor_id)
     board.editors = [ e for e in board.editors if e != editor ]
     session.add(board)
-    session.commit()
-    session.refresh(board)
+    session.flush()
     return sorted(board.editors, key=lambda e: e.id)
 
 def transfer_board(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, transfer: BoardTransfer) -> DBBoard: # type: ignore
@@ -202,8 +205,7 @@ def transfer_board(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id:
     board.editors.remove(other)
     board.editors.append(pdp.account)
     session.add(board)
-    session.commit()
-    session.refresh(board)
+    session.flush()
     return board
 
 def accept_editor_invitation(session: DBSession, invitation_id: str) -> DBBoard: # type: ignore
@@ -217,6 +219,8 @@ def accept_editor_invitation(session: DBSession, invitation_id: str) -> DBBoard:
         board.editors.append(account)
     session.delete(invitation)
     session.add(board)
-    session.commit()
-    session.refresh(board)
-    return board
\ No newline at end of file
+    session.flush()
+    return board
+
+# gotta import this down here
+from backend.database import items as items_db
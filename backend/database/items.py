@@ -1,25 +1,26 @@
 from random import random
 from datetime import datetime, UTC
 
-from sqlalchemy import select
+from sqlalchemy import select, delete, update as update_statement, inspect
 from sqlalchemy.orm import selectin_polymorphic, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.dependencies import DBSession, format_list
 from backend.utils.permissions import BoardPolicyDecisionPoint
 from backend.database import boards as boards_db
-from backend.database.schema import DBItem, DBBoard, DBAccount, DBItemNote, DBItemLink, DBItemMedia, DBItemTodo, DBItemList, DBPin
+from backend.database.schema import DBItem, DBBoard, DBAccount, DBItemNote, DBItemLink, DBItemMedia, DBItemTodo, DBItemList, DBItemDocument, DBPin, DBTodoItem, connection_table, SINGLE_TABLE_ITEMS
 from backend.exceptions import *
 
 from backend.models.items import *
 
-# options for select
-polymorphic = selectin_polymorphic(DBItem, [DBItemNote, DBItemLink, DBItemMedia, DBItemTodo, DBItemList])
-loadlistcontents = selectinload(DBItemList.contents).options(polymorphic)
+# options for select. In a single table, every type's fields are already in the item's row
+polymorphic = [] if SINGLE_TABLE_ITEMS else [ selectin_polymorphic(DBItem, [DBItemNote, DBItemLink, DBItemMedia, DBItemTodo, DBItemList, DBItemDocument]) ]
+loadlistcontents = selectinload(DBItemList.contents).options(*polymorphic)
 
 def get_by_id(session: DBSession, item_id: str, typestr: str = 'item') -> DBItem: # type: ignore
     """Returns the item with this ID"""
     # tragically due to polymorphism session.get doesn't work
-    stmt = select(DBItem).options(polymorphic, loadlistcontents).where(DBItem.id == item_id)
+    stmt = select(DBItem).options(*polymorphic, loadlistcontents).where(DBItem.id == item_id)
     results = list(session.execute(stmt).scalars().all())
     if len(results) == 0:
         raise EntityNotFound(typestr, "id", item_id)
@@ -29,7 +30,7 @@ def get_items(session: DBSession, board_id: str, account: DBAccount | None) -> l
     """Returns the items on the board with this ID, if the account can see them"""
     board: DBBoard = boards_db.get_for_viewer(session, board_id, account)
     # Get a list of top-level items
-    stmt = select(DBItem).options(polymorphic, loadlistcontents).where(DBItem.board_id == board_id).where(DBItem.list_id == None)
+    stmt = select(DBItem).options(*polymorphic, loadlistcontents).where(DBItem.board_id == board_id).where(DBItem.list_id == None)
     items = list(session.execute(stmt).scalars().all())
     return items
 
@@ -41,6 +42,14 @@ def get_item(session: DBSession, board_id: str, item_id: str, account: DBAccount
         raise EntityNotFound("item", "id", item_id)
     return item
 
+async def get_items_async(session: AsyncSession, board_id: str, account: DBAccount | None) -> ItemCollection:
+    """Async version of get_items. Items are converted to a response inside the session, since converting them loads their pins and contents."""
+    return await session.run_sync(lambda sync_session: ItemCollection.model_validate(get_items(sync_session, board_id, account)))
+
+async def get_item_async(session: AsyncSession, board_id: str, item_id: str, account: DBAccount | None) -> SomeItem:
+    """Async version of get_item, converting the item to a response inside the session."""
+    return await session.run_sync(lambda sync_session: convert_item(get_item(sync_session, board_id, item_id, account)))
+
 def create_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, config: ItemCreate) -> DBItem: # type: ignore
     """Creates an item on this board."""
     pdp.ensure_create_item(board_id, config.type)
@@ -54,6 +63,10 @@ def create_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str
     missing = [ f for f in required_fields if config_dict[f] == None ]
     if len(missing) > 0:
         raise MissingItemFields(config.type, format_list(missing))
+    # Apply the type's own defaults, since with single-table storage its columns are shared and can't hold them
+    for k, field in subclass.model_fields.items():
+        if config_dict.get(k) is None and field.default is not None:
+            config_dict[k] = field.default
     # Verify subclass fields
     if 'text' in config_dict and config_dict['text'] is not None and config.type in [ 'note', 'document' ]:
         if len(config_dict['text']) > { 'note': 300, 'document': 65536 }[ config.type ]:
@@ -90,7 +103,9 @@ def create_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str
         config_dict['index'] = target
     # Create a minimal dictionary
     dbclass: type = ITEMTYPES.get(config.type)['db']
-    stripped_dict = dict( (k, v) for k, v in config_dict.items() if k in ITEMFIELDS or v is not None ) # remove fields for different subclasses
+    columns = inspect(dbclass).columns
+    # remove fields for different subclasses, and leave out missing ones that have a default. Every other column is set, so the insert leaves nothing to load afterwards
+    stripped_dict = dict( (k, v) for k, v in config_dict.items() if k in ITEMFIELDS or (k in columns and (v is not None or columns[k].default is None)) )
     stripped_dict['board_id'] = board_id
     # Create a DBItem for the subclass and add it to the database
     item: DBItem = dbclass(**stripped_dict)
@@ -99,9 +114,9 @@ def create_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str
         item.position = None
     else:
         item.index = None
+    item.pin = None # a new item has no pin, so there's no need to look for one
     session.add(item)
-    session.commit()
-    session.refresh(item)
+    session.flush()
     return item
 
 def update_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, item_id: str, config: ItemUpdate) -> DBItem: # type: ignore
@@ -201,8 +216,11 @@ def update_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str
     # Update in database.
     item.updated_at = datetime.now(UTC)
     session.add(item)
-    session.commit()
-    session.refresh(item)
+    session.flush()
+    # An item that was already in the session and expired can come back without its subtype's columns. They are converted from __dict__, so load any that are missing
+    unloaded = [ column.key for column in inspect(type(item)).column_attrs if column.key in inspect(item).unloaded ]
+    if len(unloaded) > 0:
+        session.refresh(item, unloaded)
     # Collapse lists before returning
     for l in lists_to_collapse:
         collapse_list(session, l)
@@ -215,14 +233,39 @@ def delete_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str
     item: DBItem = get_by_id(session, item_id)
     if item.board_id != board_id:
         raise EntityNotFound('item', 'id', item_id)
-    # Deleting a list deletes all child objects with ondelete=cascade
+    # Deleting a list deletes everything in it, which is quicker without loading it all
+    if item.type == 'list':
+        delete_items(session, [ item.id ])
+        return
     # Delete and collapse any containing list
     item_list: DBItemList | None = item.list
     session.delete(item)
-    session.commit()
     if item_list:
         collapse_list(session, item_list)
 
+def delete_items(session: DBSession, item_ids) -> None: # type: ignore
+    """Deletes items, along with the contents of any lists among them, and their pins and todo items.
+
+    Runs a few DELETE statements instead of loading every item to delete it. `item_ids` is a list of IDs or a select of them.
+    """
+    contents = select(DBItem.id).where(DBItem.list_id.in_(item_ids))
+    item_ids = select(DBItem.id).where(DBItem.id.in_(item_ids) | DBItem.list_id.in_(item_ids))
+    # items and their pins reference each other, so unpin them first
+    session.execute(update_statement(DBItem).where(DBItem.id.in_(item_ids)).values(pin_id=None).execution_options(synchronize_session=False))
+    delete_pins(session, select(DBPin.id).where(DBPin.item_id.in_(item_ids)))
+    session.execute(delete(DBTodoItem).where(DBTodoItem.list_id.in_(item_ids)))
+    # the contents of lists before the lists, and each type's own table before the items they join to
+    for ids in [ contents, item_ids ]:
+        for mapper in DBItem.__mapper__.self_and_descendants:
+            if mapper.local_table is not DBItem.__table__:
+                session.execute(delete(mapper.local_table).where(mapper.local_table.c.id.in_(ids)))
+        session.execute(delete(DBItem).where(DBItem.id.in_(ids)))
+
+def delete_pins(session: DBSession, pin_ids) -> None: # type: ignore
+    """Deletes pins and their connections in both directions. `pin_ids` is a list of IDs or a select of them."""
+    session.execute(delete(connection_table).where(connection_table.c.source_id.in_(pin_ids) | connection_table.c.destination_id.in_(pin_ids)))
+    session.execute(delete(DBPin).where(DBPin.id.in_(pin_ids)))
+
 def create_todo_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, config: TodoItemCreate) -> DBTodoItem: # type: ignore
     """Creates and returns a TodoItem in this todo list"""
     pdp.ensure_modify(board_id)
@@ -244,8 +287,7 @@ def create_todo_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id
     todo.updated_at = datetime.now(UTC)
     session.add(todo)
     session.add(todo_item)
-    session.commit()
-    session.refresh(todo_item)
+    session.flush()
     return todo_item
 
 def update_todo_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, todo_item_id: str, config: TodoItemUpdate) -> DBTodoItem: # type: ignore
@@ -273,8 +315,7 @@ def update_todo_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id
     if config.done is not None:
         todo_item.done = config.done
     session.add(todo_item)
-    session.commit()
-    session.refresh(todo_item)
+    session.flush()
     return todo_item
 
 def delete_todo_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, todo_item_id: str) -> None: # type: ignore
@@ -289,7 +330,6 @@ def delete_todo_item(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id
     if todo.type != 'todo':
         raise ItemTypeMismatch(todo.id, 'todo', todo.type)
     session.delete(todo_item)
-    session.commit()
 
 def shift_list(session: DBSession, list: DBItemList, start_index: int) -> DBItemList: # type: ignore
     """Shifts the items on this list after this index by one, leaving an open space, and then return the list. Used for when you want to add something at this new index."""
@@ -303,8 +343,7 @@ def shift_list(session: DBSession, list: DBItemList, start_index: int) -> DBItem
             session.add(item)
     list.updated_at = datetime.now(UTC)
     session.add(list)
-    session.commit()
-    session.refresh(list)
+    session.flush()
     return list
 
 def collapse_list(session: DBSession, list: DBItemList) -> DBItemList: # type: ignore
@@ -316,8 +355,7 @@ def collapse_list(session: DBSession, list: DBItemList) -> DBItemList: # type: i
         session.add(item)
     list.updated_at = datetime.now(UTC)
     session.add(list)
-    session.commit()
-    session.refresh(list)
+    session.flush()
     return list
 
 def create_pin(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, config: PinCreate) -> DBPin: # type: ignore
@@ -339,8 +377,7 @@ def create_pin(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str,
     item.updated_at = datetime.now(UTC) 
     session.add(item)
     session.add(pin)
-    session.commit()
-    session.refresh(pin)
+    session.flush()
     return pin
 
 def update_pin(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, pin_id: str, config: PinUpdate) -> DBPin: # type: ignore
@@ -363,8 +400,7 @@ def update_pin(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str,
     if config.compass is not None:
         pin.compass = config.compass
     session.add(pin)
-    session.commit()
-    session.refresh(pin)
+    session.flush()
     return pin
 
 def delete_pin(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, pin_id: str) -> None: # type: ignore
@@ -376,7 +412,6 @@ def delete_pin(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str,
     pin.item.updated_at = datetime.now(UTC) 
     session.add(pin.item)
     session.delete(pin)
-    session.commit()
 
 def add_pin_connection(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, pin1_id: str, pin2_id: str) -> list[DBPin]: # type: ignore
     """Adds a connection between two pins."""
@@ -387,13 +422,14 @@ def add_pin_connection(session: DBSession, pdp: BoardPolicyDecisionPoint, board_
     pin2: DBPin = session.get(DBPin, pin2_id)
     if pin2 == None or pin2.board_id != board_id:
         raise EntityNotFound('pin', 'id', pin2_id)
-    pin1.connections.append(pin2)
-    pin2.connections.append(pin1)
+    # connections go both ways, and appending to one side also appends to the other
+    if pin2 not in pin1.connections:
+        pin1.connections.append(pin2)
+    if pin1 not in pin2.connections:
+        pin2.connections.append(pin1)
     session.add(pin1)
     session.add(pin2)
-    session.commit()
-    session.refresh(pin1)
-    session.refresh(pin2)
+    session.flush()
     return [ pin1, pin2 ]
 
 def remove_pin_connection(session: DBSession, pdp: BoardPolicyDecisionPoint, board_id: str, pin1_id: str, pin2_id: str) -> list[DBPin]: # type: ignore
@@ -411,7 +447,5 @@ def remove_pin_connection(session: DBSession, pdp: BoardPolicyDecisionPoint, boa
         pin2.connections.remove(pin1)
     session.add(pin1)
     session.add(pin2)
-    session.commit()
-    session.refresh(pin1)
-    session.refresh(pin2)
+    session.flush()
     return [ pin1, pin2 ]
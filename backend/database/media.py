@@ -1,5 +1,6 @@
 from sqlalchemy import select
 
+from anyio import to_thread
 from fastapi import UploadFile
 
 from backend.dependencies import DBSession
@@ -59,8 +60,7 @@ async def upload_image(session: DBSession, account: DBAccount, file: UploadFile,
         filename=filename,
     )
     session.add(db_image)
-    session.commit()
-    session.refresh(db_image)
+    await to_thread.run_sync(session.flush) # writing may wait for the write slot, so keep it off the event loop
     # Save to static directory (after trying to insert, on the one in a quintillion chance that we get a collision)
     filepath = os.path.join(settings.static_path, 'images', filename)
     image.save(filepath)
@@ -83,7 +83,6 @@ def delete_image(session: DBSession, image_uuid: str, account: DBAccount) -> Non
         pass
     # Delete from database
     session.delete(image)
-    session.commit()
 
 async def upload_avatar(session: DBSession, account: DBAccount, image: UploadFile, content_length: int) -> DBAccount: # type: ignore
     """Uploads an image, resizes it to 64x64, sets the account's profile picture to that image, and returns the account."""
@@ -92,8 +91,7 @@ async def upload_avatar(session: DBSession, account: DBAccount, image: UploadFil
     # Update the account
     account.profile_image = image.filename
     session.add(account)
-    session.commit()
-    session.refresh(account)
+    await to_thread.run_sync(session.flush)
     return account
 
 def get_account_images(session: DBSession, account: DBAccount) -> list[DBImage]: # type: ignore
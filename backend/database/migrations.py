@@ -0,0 +1,177 @@
+"""Versioned schema migrations.
+
+`Base.metadata.create_all` only creates tables that don't exist yet, so changes to existing
+tables are applied by the migrations registered here. Migrations run once each, in the order
+they are defined, and the number of applied migrations is stored in the `schema_version` table.
+A brand new database is created at the latest version without running any of them.
+
+Migrations run after `create_all`, so a table may already be in its latest form. Use the
+helpers below, which skip columns and indexes that already exist.
+"""
+
+from typing import Callable
+
+from sqlalchemy import Connection, Engine, inspect, text
+
+from backend.database.schema import Base, BinaryUUID, uuid_to_bytes
+
+MIGRATIONS: list[Callable[[Connection], None]] = []
+
+class MigrationConflict(Exception):
+    """Existing rows stop a migration from being applied, and have to be fixed by hand first."""
+
+def migration(func: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    """Decorator that registers a migration."""
+    MIGRATIONS.append(func)
+    return func
+
+def get_version(connection: Connection) -> int | None:
+    """Get the number of migrations applied to this database, or None if it has never been versioned."""
+    if not inspect(connection).has_table("schema_version"):
+        return None
+    return connection.execute(text("SELECT version FROM schema_version")).scalar()
+
+def set_version(connection: Connection, version: int) -> None:
+    """Record the number of migrations applied to this database."""
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    connection.execute(text("DELETE FROM schema_version"))
+    connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), { "version": version })
+
+def upgrade(engine: Engine) -> None:
+    """Create missing tables and apply any pending migrations."""
+    with engine.begin() as connection:
+        fresh = not inspect(connection).has_table("accounts")
+        Base.metadata.create_all(connection)
+        version = len(MIGRATIONS) if fresh else (get_version(connection) or 0)
+        for index in range(version, len(MIGRATIONS)):
+            MIGRATIONS[index](connection)
+        set_version(connection, len(MIGRATIONS))
+
+# Helpers
+
+def add_column(connection: Connection, table: str, column: str, ddl: str) -> None:
+    """Add a column to a table unless it already has it. `ddl` is the column definition, e.g. 'INTEGER NOT NULL DEFAULT 0'."""
+    if column in [ c['name'] for c in inspect(connection).get_columns(table) ]:
+        return
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def create_index(connection: Connection, name: str, table: str, columns: list[str], unique: bool = False) -> None:
+    """Create an index unless one with this name already exists."""
+    connection.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+def check_unique(connection: Connection, table: str, column: str, expression: str) -> None:
+    """Make sure no two rows have the same value of an expression, before a unique index on it is created.
+
+    Raises:
+        MigrationConflict: listing the rows that collide
+    """
+    rows = connection.execute(text(
+        f"SELECT {expression}, id, {column} FROM {table} WHERE {expression} IN "
+        f"(SELECT {expression} FROM {table} WHERE {column} IS NOT NULL GROUP BY {expression} HAVING count(*) > 1) ORDER BY 1, 2"
+    )).all()
+    if len(rows) == 0:
+        return
+    conflicts = "\n".join(f"  {table}.id={id.hex() if isinstance(id, bytes) else id} {column}={value!r}" for _, id, value in rows)
+    raise MigrationConflict(f"Can't create a unique index on {expression} of {table}, because these rows would collide. Change all but one of each before starting the application again:\n{conflicts}")
+
+def rebuild_table(connection: Connection, table: str) -> None:
+    """Recreate a table from its model, keeping its rows, to change constraints SQLite can't alter in place.
+
+    Only the columns the old and new tables share are copied, and the model's indexes are created again.
+    """
+    columns = [ c['name'] for c in inspect(connection).get_columns(table) if c['name'] in Base.metadata.tables[table].columns ]
+    indexes = [ index['name'] for index in inspect(connection).get_indexes(table) ]
+    connection.execute(text("PRAGMA defer_foreign_keys = ON")) # checked when the migrations commit
+    connection.execute(text(f"ALTER TABLE {table} RENAME TO _{table}_old"))
+    for index in indexes:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    Base.metadata.tables[table].create(connection)
+    connection.execute(text(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM _{table}_old"))
+    connection.execute(text(f"DROP TABLE _{table}_old"))
+
+# Migrations. Never reorder or remove these, only append.
+
+@migration
+def add_account_claims_version(connection: Connection):
+    """Version number for the role and entitlement claims in access tokens."""
+    add_column(connection, "accounts", "claims_version", "INTEGER NOT NULL DEFAULT 0")
+
+@migration
+def rotate_refresh_tokens(connection: Connection):
+    """Refresh token rotation, and indexes for revoking and pruning refresh tokens."""
+    add_column(connection, "refresh_tokens", "current_uid", "VARCHAR(36)")
+    create_index(connection, "ix_refresh_tokens_account_id", "refresh_tokens", [ "account_id" ])
+    create_index(connection, "ix_refresh_tokens_expires_at", "refresh_tokens", [ "expires_at" ])
+
+@migration
+def lower_case_identifier_indexes(connection: Connection):
+    """Indexes for looking up accounts by lower-cased username, email and pending email."""
+    check_unique(connection, "accounts", "username", "lower(username)")
+    check_unique(connection, "accounts", "email", "lower(email)")
+    create_index(connection, "ix_accounts_username_lower", "accounts", [ "lower(username)" ], unique=True)
+    create_index(connection, "ix_accounts_email_lower", "accounts", [ "lower(email)" ], unique=True)
+    create_index(connection, "ix_email_verifications_email_lower", "email_verifications", [ "lower(email)" ])
+
+@migration
+def binary_uuids(connection: Connection):
+    """Store UUIDs in 16 bytes instead of 36 character strings.
+
+    SQLite stores whatever type of value it is given, so the columns keep their declared type
+    and only the values are converted. Run VACUUM afterwards to give back the space.
+    """
+    connection.connection.driver_connection.create_function("uuid_to_bytes", 1, uuid_to_bytes, deterministic=True)
+    connection.execute(text("PRAGMA defer_foreign_keys = ON")) # keys and the references to them are converted one at a time
+    for table in Base.metadata.tables.values():
+        if not inspect(connection).has_table(table.name):
+            continue
+        existing = [ c['name'] for c in inspect(connection).get_columns(table.name) ]
+        for column in table.columns:
+            if isinstance(column.type, BinaryUUID) and column.name in existing:
+                connection.execute(text(f"UPDATE {table.name} SET {column.name} = uuid_to_bytes({column.name}) WHERE typeof({column.name}) = 'text'"))
+
+@migration
+def add_query_indexes(connection: Connection):
+    """Indexes for the foreign keys and filter columns that queries look rows up by."""
+    for table, column in [
+        ("items", "list_id"), ("items", "pin_id"), ("pins", "board_id"), ("pins", "item_id"),
+        ("todo_items", "list_id"), ("images", "uploader_id"), ("editor_table", "account_id"),
+        ("editor_table", "board_id"), ("connection_table", "source_id"), ("connection_table", "destination_id"),
+        ("permissions", "account_id"), ("customers", "account_id"), ("customers", "stripe_id"),
+        ("email_verifications", "account_id"), ("password_changes", "account_id"),
+        ("editor_invitations", "board_id"), ("editor_invitations", "email"), ("auth_events", "timestamp"),
+        ("reports", "account_id"), ("reports", "moderator_id"), ("reports", "status"),
+    ]:
+        create_index(connection, f"ix_{table}_{column}", table, [ column ])
+    create_index(connection, "ix_items_board_id_list_id", "items", [ "board_id", "list_id" ])
+    create_index(connection, "ix_boards_owner_id_identifier", "boards", [ "owner_id", "identifier" ])
+    create_index(connection, "ix_boards_public_name", "boards", [ "public", "name" ])
+    create_index(connection, "ix_auth_events_account_id_timestamp", "auth_events", [ "account_id", "timestamp" ])
+
+@migration
+def add_account_deleted_at(connection: Connection):
+    """Accounts are marked as deleted, and purged in the background."""
+    add_column(connection, "accounts", "deleted_at", "DATETIME")
+    create_index(connection, "ix_accounts_deleted_at", "accounts", [ "deleted_at" ])
+
+@migration
+def report_moderator_accounts(connection: Connection):
+    """Reports store the id of the moderator's account, not their permission row, so reference accounts."""
+    if not inspect(connection).has_table("reports"):
+        return
+    if [ key['referred_table'] for key in inspect(connection).get_foreign_keys("reports") if key['constrained_columns'] == [ "moderator_id" ] ] == [ "accounts" ]:
+        return
+    connection.execute(text("UPDATE reports SET moderator_id = NULL WHERE moderator_id NOT IN (SELECT id FROM accounts)"))
+    rebuild_table(connection, "reports")
+
+@migration
+def add_maintenance_indexes(connection: Connection):
+    """Indexes for the expiry columns that the maintenance tasks delete and downgrade rows by."""
+    for table in [ "email_verifications", "password_changes", "editor_invitations" ]:
+        create_index(connection, f"ix_{table}_expires_at", table, [ "expires_at" ])
+    create_index(connection, "ix_customers_type_expiration", "customers", [ "type", "expiration" ])
+
+@migration
+def refresh_token_grace(connection: Connection):
+    """The token a refresh replaced, so a refresh racing it with the same cookie still succeeds."""
+    add_column(connection, "refresh_tokens", "previous_uid", "BLOB")
+    add_column(connection, "refresh_tokens", "rotated_at", "INTEGER")
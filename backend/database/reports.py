@@ -72,8 +72,7 @@ def create_report(
         **config.model_dump(),
     )
     session.add(report)
-    session.commit()
-    session.refresh(report)
+    session.flush()
     return report
 
 def update_report(
@@ -88,8 +87,7 @@ def update_report(
     if config.report_text is not None:
         report.report_text = config.report_text
     session.add(report)
-    session.commit()
-    session.refresh(report)
+    session.flush()
     return report
 
 def update_report_status(
@@ -109,8 +107,7 @@ def update_report_status(
         else:
             report.resolved_at = None
     session.add(report)
-    session.commit()
-    session.refresh(report)
+    session.flush()
     return report
 
 def delete_report(
@@ -122,7 +119,6 @@ def delete_report(
     report: DBReport = get_by_id(session, report_id)
     pdp.ensure_delete(report_id)
     session.delete(report)
-    session.commit()
 
 def update_assignee(
     session: DBSession, # type: ignore
@@ -141,8 +137,7 @@ def update_assignee(
     if report.status == "fresh":
         report.status = "assigned"
     session.add(report)
-    session.commit()
-    session.refresh(report)
+    session.flush()
     return report
 
 def remove_assignee(
@@ -156,6 +151,5 @@ def remove_assignee(
     report.moderator_id = None
     report.status = "fresh"
     session.add(report)
-    session.commit()
-    session.refresh(report)
+    session.flush()
     return report
@@ -1,14 +1,16 @@
 """Database table models."""
 
 from sqlalchemy import (
-    Integer, Float, String, Text, DateTime,
-    ForeignKey, Table, Column,
-    func
+    Integer, Float, String, Text, DateTime, LargeBinary,
+    ForeignKey, Table, Column, Index,
+    TypeDecorator, func
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship, declarative_base, validates
 from typing import List, Optional
+from uuid import UUID
 from uuid_extensions import uuid7
 from datetime import datetime, UTC, timedelta
+import zlib
 
 from backend.config import settings
 
@@ -18,12 +20,77 @@ def gen_uuid() -> str:
     # Function to generate a UUID string
     return str(uuid7())
 
+def uuid_to_bytes(value: str) -> bytes:
+    """Get the 16 bytes of a UUID string. Strings that aren't UUIDs are encoded as they are, so looking one up finds nothing rather than failing."""
+    try:
+        return UUID(str(value)).bytes
+    except ValueError:
+        return str(value).encode()
+
+def bytes_to_uuid(value: bytes) -> str:
+    """Get the canonical string of a UUID from its bytes."""
+    return str(UUID(bytes=value)) if len(value) == 16 else value.decode()
+
+class BinaryUUID(TypeDecorator):
+    """A UUID stored in 16 bytes rather than a 36 character string, but used as the string everywhere else.
+    The bytes are big-endian, so uuid7 keys stay in time order in indexes."""
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value: str | None, dialect) -> bytes | None:
+        return uuid_to_bytes(value) if value is not None else None
+
+    def process_result_value(self, value: bytes | None, dialect) -> str | None:
+        return bytes_to_uuid(value) if value is not None else None
+
+class CompressedText(TypeDecorator):
+    """Text that is stored compressed once it is at least `db_compress_threshold` bytes long, and decompressed when loaded.
+    Compressed values are blobs that start with a format byte, followed by raw deflate data, made with the column's preset
+    dictionary if it has one. Shorter values, and values that don't get smaller, stay plain text, so existing rows load
+    as they are and the column needs no migration. A column's dictionary can't change once rows use it.
+
+    Args:
+        length (int | None): The length of the underlying text column
+        dictionary (bytes): Strings that values of the column often contain, most common last
+    """
+    impl = Text
+    cache_ok = True
+
+    DEFLATE = b"\x01"
+    DEFLATE_DICTIONARY = b"\x02"
+
+    def __init__(self, length: int | None = None, dictionary: bytes = b""):
+        super().__init__(length)
+        self.dictionary = dictionary
+
+    def process_bind_param(self, value: str | None, dialect) -> str | bytes | None:
+        if value is None:
+            return None
+        encoded = value.encode()
+        if len(encoded) < settings.db_compress_threshold:
+            return value
+        if self.dictionary:
+            marker, compressor = self.DEFLATE_DICTIONARY, zlib.compressobj(settings.db_compress_level, zlib.DEFLATED, -15, zdict=self.dictionary)
+        else:
+            marker, compressor = self.DEFLATE, zlib.compressobj(settings.db_compress_level, zlib.DEFLATED, -15)
+        compressed = marker + compressor.compress(encoded) + compressor.flush()
+        return compressed if len(compressed) < len(encoded) else value
+
+    def process_result_value(self, value: str | bytes | None, dialect) -> str | None:
+        if not isinstance(value, bytes):
+            return value
+        if value[:1] == self.DEFLATE:
+            return zlib.decompress(value[1:], -15).decode()
+        if value[:1] == self.DEFLATE_DICTIONARY:
+            return zlib.decompressobj(-15, zdict=self.dictionary).decompress(value[1:]).decode()
+        return value.decode()
+
 # Intermediate table for many-to-many relationship between Accounts and the Boards they are allowed to edit
 editor_table = Table(
     "editor_table",
     Base.metadata,
-    Column("account_id", ForeignKey("accounts.id", ondelete="CASCADE")),
-    Column("board_id", ForeignKey("boards.id", ondelete="CASCADE")),
+    Column("account_id", ForeignKey("accounts.id", ondelete="CASCADE"), index=True),
+    Column("board_id", ForeignKey("boards.id", ondelete="CASCADE"), index=True),
 )
 
 class DBAccount(Base):
@@ -36,7 +103,9 @@ class DBAccount(Base):
         - email: the email associated with this account
         - hashed_password: the hashed password used to log in
         - profile_image: the src of the profile image (usually links to static directory, but backend should support links to any image)
+        - claims_version: incremented when the role or subscription changes, invalidating claims in older access tokens
         - created_at: the time at which this was created
+        - deleted_at: the time at which the account was deleted, until everything it owns has been purged
 
     Relationships:
         - boards: Board, one-to-many
@@ -46,17 +115,20 @@ class DBAccount(Base):
         - customer: Customer, one-to-one
         - email_verification: EmailVerification, one-to-one
         - reports: Report, one-to-many
+        - assigned_reports: Report, one-to-many
     """
     __tablename__ = "accounts"
 
     # fields
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
     username: Mapped[str] = mapped_column( String(64), unique=True, index=True )
     email: Mapped[Optional[str]] = mapped_column( String(64), index=True, default=None ) # Null until verification
     display_name: Mapped[Optional[str]] = mapped_column( String(64), default=None )
     hashed_password: Mapped[str] = mapped_column( String(72), unique=True, index=True )
     profile_image: Mapped[Optional[str]] = mapped_column( String(120) )
+    claims_version: Mapped[int] = mapped_column( default=0, server_default="0" )
     created_at: Mapped[datetime] = mapped_column( DateTime(), server_default=func.now() )
+    deleted_at: Mapped[Optional[datetime]] = mapped_column( DateTime(), default=None, index=True )
 
     # relationships
     boards: Mapped[List["DBBoard"]] = relationship( back_populates="owner", cascade="all, delete-orphan" ) # maybe later don't cascade delete unless they are the only editor
@@ -67,6 +139,11 @@ class DBAccount(Base):
     email_verification: Mapped[Optional["DBEmailVerification"]] = relationship(back_populates="account", uselist=False, cascade="all, delete-orphan" )
     password_change: Mapped[Optional["DBPasswordChangeRequest"]] = relationship(back_populates="account", uselist=False, cascade="all, delete-orphan" )
     reports: Mapped[List["DBReport"]] = relationship(back_populates="account", foreign_keys="DBReport.account_id", cascade="all, delete-orphan")
+    assigned_reports: Mapped[List["DBReport"]] = relationship(back_populates="moderator", foreign_keys="DBReport.moderator_id")
+
+# Accounts are looked up by lower-cased username or email. These also stop two accounts differing only by case.
+Index("ix_accounts_username_lower", func.lower(DBAccount.username), unique=True)
+Index("ix_accounts_email_lower", func.lower(DBAccount.email), unique=True)
 
 class DBBoard(Base):
     """Boards table. Each row represents a bulletin board.
@@ -90,7 +167,7 @@ class DBBoard(Base):
     
     __tablename__ = "boards"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
     identifier: Mapped[str] = mapped_column(String(64))
     name: Mapped[str] = mapped_column( String(64) )
     icon: Mapped[str] = mapped_column( String(32), default="default" )
@@ -104,6 +181,23 @@ class DBBoard(Base):
     pins: Mapped[List["DBPin"]] = relationship( back_populates="board", cascade="all, delete-orphan", foreign_keys="DBPin.board_id" )
     pending_invites: Mapped[List["DBEditorInvitation"]] = relationship(back_populates="board", cascade="all, delete-orphan" )
 
+# Boards are looked up by owner and identifier, and public boards are listed by name
+Index("ix_boards_owner_id_identifier", DBBoard.owner_id, DBBoard.identifier)
+Index("ix_boards_public_name", DBBoard.public, DBBoard.name)
+
+# Each item type keeps its own fields in a table joined to the items table, unless items are stored in a single table
+SINGLE_TABLE_ITEMS = settings.db_item_storage == "single"
+
+def item_table(name: str) -> str | None:
+    """The name of the table for an item type's fields, or None to keep them in the items table."""
+    return None if SINGLE_TABLE_ITEMS else name
+
+def item_column(*args, **kwargs):
+    """A column for an item type's field. In a single table, other types leave it empty, and types with a field of the same name share it."""
+    if SINGLE_TABLE_ITEMS:
+        return mapped_column(*args, nullable=True, use_existing_column=True, **kwargs)
+    return mapped_column(*args, **kwargs)
+
 class DBItem(Base):
     """Items table. Each row represents an item.
     
@@ -125,23 +219,24 @@ class DBItem(Base):
     """
     __tablename__ = "items"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
     board_id: Mapped[int] = mapped_column(ForeignKey("boards.id"))
-    list_id: Mapped[Optional[int]] = mapped_column(ForeignKey("items_list.id"), default=None)
+    list_id: Mapped[Optional[int]] = mapped_column(ForeignKey("items.id" if SINGLE_TABLE_ITEMS else "items_list.id"), index=True, default=None)
     position: Mapped[Optional[str]] # will be set conditionally
     index: Mapped[Optional[int]] # will be set conditionally
-    pin_id: Mapped[Optional[int]] = mapped_column(ForeignKey("pins.id"), default=None)
+    pin_id: Mapped[Optional[int]] = mapped_column(ForeignKey("pins.id"), index=True, default=None)
     type: Mapped[str] # used for polymorphism
     created_at: Mapped[datetime] = mapped_column( DateTime(), server_default=func.now() )
     updated_at: Mapped[datetime] = mapped_column( DateTime(), server_default=func.now() )
     
     board: Mapped["DBBoard"] = relationship(back_populates="items")
-    list: Mapped["DBItemList"] = relationship(back_populates="contents", foreign_keys=[list_id])
+    list: Mapped["DBItemList"] = relationship(back_populates="contents", foreign_keys=[list_id], remote_side="DBItemList.id")
     pin: Mapped[Optional["DBPin"]] = relationship( back_populates="item", cascade="all, delete-orphan", foreign_keys="DBPin.item_id" )
     
     __mapper_args__ = {
         "polymorphic_identity": "item",
-        "polymorphic_on": "type"
+        "polymorphic_on": "type",
+        "with_polymorphic": "*" if SINGLE_TABLE_ITEMS else None, # every type's fields are in the row, so load them with it
     }
     
     def __repr__(self):
@@ -167,6 +262,9 @@ class DBItem(Base):
             return len(self.list.contents) - 1
         return 0
 
+# Items are listed by board, and only the ones not in a list are on the board itself
+Index("ix_items_board_id_list_id", DBItem.board_id, DBItem.list_id)
+
 class DBItemNote(DBItem):
     """Notes table. Each row represents a note item.
     
@@ -174,10 +272,11 @@ class DBItemNote(DBItem):
         - id: primary key - the id of the parent item
         - text: the markdown text of the note
     """
-    __tablename__ = "items_note"
+    __tablename__ = item_table("items_note")
     
-    id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
-    text: Mapped[str] = mapped_column(Text(300))
+    if not SINGLE_TABLE_ITEMS:
+        id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
+    text: Mapped[str] = item_column(CompressedText(300))
     
     __mapper_args__ = {
         "polymorphic_identity": "note",
@@ -191,11 +290,12 @@ class DBItemLink(DBItem):
         - title: The text of the link
         - url: The URL of the link
     """
-    __tablename__ = "items_link"
+    __tablename__ = item_table("items_link")
     
-    id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
-    title: Mapped[str] = mapped_column( String(64) )
-    url: Mapped[str] = mapped_column( String(128) )
+    if not SINGLE_TABLE_ITEMS:
+        id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
+    title: Mapped[str] = item_column( String(64) )
+    url: Mapped[str] = item_column( String(128) )
     
     __mapper_args__ = {
         "polymorphic_identity": "link",
@@ -210,11 +310,12 @@ class DBItemMedia(DBItem):
         - url: The link to the image, whether uploaded by the account or not.
         - size: The resized image size (overridden if in list)
     """
-    __tablename__ = "items_media"
+    __tablename__ = item_table("items_media")
     
-    id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
-    url: Mapped[str] = mapped_column( String(128) )
-    size: Mapped[Optional[str]] = mapped_column(default=None)
+    if not SINGLE_TABLE_ITEMS:
+        id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
+    url: Mapped[str] = item_column( String(128) )
+    size: Mapped[Optional[str]] = item_column(default=None)
     
     __mapper_args__ = {
         "polymorphic_identity": "media",
@@ -230,10 +331,11 @@ class DBItemTodo(DBItem):
     Relationships:
         - contents: TodoItem, one-to-many. Ordered by TodoItem.id.
     """
-    __tablename__ = "items_todo"
+    __tablename__ = item_table("items_todo")
     
-    id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
-    title: Mapped[str] = mapped_column( String(64) )
+    if not SINGLE_TABLE_ITEMS:
+        id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
+    title: Mapped[str] = item_column( String(64) )
     
     contents: Mapped[List["DBTodoItem"]] = relationship(back_populates="todo", cascade="all, delete-orphan")
     
@@ -253,17 +355,19 @@ class DBItemList(DBItem):
     Relationships:
         - contents: Item, one-to-many.
     """
-    __tablename__ = "items_list"
+    __tablename__ = item_table("items_list")
     
-    id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
-    title: Mapped[str] = mapped_column( String(64) )
+    if not SINGLE_TABLE_ITEMS:
+        id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
+    title: Mapped[str] = item_column( String(64) )
     
     contents: Mapped[List["DBItem"]] = relationship(back_populates="list", cascade="all, delete-orphan", foreign_keys="DBItem.list_id", order_by="DBItem.index")
     
     __mapper_args__ = {
         "polymorphic_identity": "list",
-        "inherit_condition": id == DBItem.id  # specify the condition for inheritance
     }
+    if not SINGLE_TABLE_ITEMS:
+        __mapper_args__["inherit_condition"] = id == DBItem.id  # specify the condition for inheritance
 
 class DBItemDocument(DBItem):
     """Document table. Each row represents a document item.
@@ -276,16 +380,18 @@ class DBItemDocument(DBItem):
     Relationships:
         - contents: Item, one-to-many.
     """
-    __tablename__ = "items_document"
+    __tablename__ = item_table("items_document")
     
-    id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
-    title: Mapped[str] = mapped_column( String(64) )
-    text: Mapped[str] = mapped_column( Text, default="" )
+    if not SINGLE_TABLE_ITEMS:
+        id: Mapped[str] = mapped_column(ForeignKey("items.id"), primary_key=True)
+    title: Mapped[str] = item_column( String(64) )
+    text: Mapped[str] = item_column( CompressedText, default="" )
     
     __mapper_args__ = {
         "polymorphic_identity": "document",
-        "inherit_condition": id == DBItem.id  # specify the condition for inheritance
     }
+    if not SINGLE_TABLE_ITEMS:
+        __mapper_args__["inherit_condition"] = id == DBItem.id  # specify the condition for inheritance
 
 class DBTodoItem(Base):
     """Todo item table. Each row represents an item in a todo list item.
@@ -303,8 +409,8 @@ class DBTodoItem(Base):
     """
     __tablename__ = "todo_items"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    list_id: Mapped[int] = mapped_column(ForeignKey("items_todo.id"))
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    list_id: Mapped[int] = mapped_column(ForeignKey("items.id" if SINGLE_TABLE_ITEMS else "items_todo.id"), index=True)
     text: Mapped[str] = mapped_column( String(128) )
     link: Mapped[Optional[str]] = mapped_column( String(128), default=None)
     done: Mapped[bool]
@@ -326,33 +432,40 @@ class DBImage(Base):
     """
     __tablename__ = "images"
     
-    uuid: Mapped[str] = mapped_column(String(36), primary_key=True, unique=True)
-    uploader_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"))
+    uuid: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, unique=True)
+    uploader_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), index=True)
     filename: Mapped[str] = mapped_column( String(64) )
     uploaded_at: Mapped[datetime] = mapped_column( DateTime(), server_default=func.now() )
     
     uploader: Mapped["DBAccount"] = relationship(back_populates="uploaded", foreign_keys=[uploader_id])
     
 class DBRefreshToken(Base):
-    """Refresh token table. Each row represents a relationship between tokens and accounts.
+    """Refresh token table. Each row represents a login session, which is a family of refresh tokens.
+    Refreshing rotates the token, so only the most recently issued token in a family is accepted.
     
     Fields:
-        - token_id: the UUID of the token
+        - token_id: the UUID of the token family. This is the uid of the first token issued
+        - current_uid: the UUID of the latest token in this family
+        - previous_uid: the UUID of the token the latest one replaced, still accepted for `jwt_refresh_grace` seconds
+        - rotated_at: the time at which the latest token was issued
         - account_id: the account the token belongs to
         - expires_at: the time at which this token should automatically expire
     """
     __tablename__ = "refresh_tokens"
     
-    token_id: Mapped[str] = mapped_column(primary_key=True, unique=True)
-    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"))
-    expires_at: Mapped[int]
+    token_id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, unique=True)
+    current_uid: Mapped[Optional[str]] = mapped_column(BinaryUUID(), default=None) # None for tokens issued before rotation, treated as token_id
+    previous_uid: Mapped[Optional[str]] = mapped_column(BinaryUUID(), default=None)
+    rotated_at: Mapped[Optional[int]] = mapped_column(default=None)
+    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), index=True)
+    expires_at: Mapped[int] = mapped_column(index=True)
 
 # Intermediate table for many-to-many relationship between connected Pins
 connection_table = Table(
     "connection_table",
     Base.metadata,
-    Column("source_id", ForeignKey("pins.id", ondelete="CASCADE")),
-    Column("destination_id", ForeignKey("pins.id", ondelete="CASCADE")),
+    Column("source_id", ForeignKey("pins.id", ondelete="CASCADE"), index=True),
+    Column("destination_id", ForeignKey("pins.id", ondelete="CASCADE"), index=True),
 )
 
 class DBPin(Base):
@@ -374,11 +487,11 @@ class DBPin(Base):
     """
     __tablename__ = "pins"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
     label: Mapped[Optional[str]] = mapped_column( String(64) )
     compass: Mapped[bool] = mapped_column(default=False)
-    board_id: Mapped[int] = mapped_column(ForeignKey("boards.id"))
-    item_id: Mapped[int] = mapped_column(ForeignKey("items.id"))
+    board_id: Mapped[int] = mapped_column(ForeignKey("boards.id"), index=True)
+    item_id: Mapped[int] = mapped_column(ForeignKey("items.id"), index=True)
     created_at: Mapped[datetime] = mapped_column( DateTime(), server_default=func.now() )
     
     board: Mapped["DBBoard"] = relationship(back_populates="pins", foreign_keys=[board_id])
@@ -401,16 +514,14 @@ class DBPermission(Base):
 
     Relationships:
         - account (DBAccount, one-to-one): The account object
-        - assigned_reports (DBReport, one-to-many): The reports assigned to this staff member
     """
     __tablename__ = "permissions"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"))
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"), index=True)
     role: Mapped[str] = mapped_column(String(32), default="user")
 
     account: Mapped["DBAccount"] = relationship(back_populates="permission", foreign_keys="DBPermission.account_id")
-    assigned_reports: Mapped[List["DBReport"]] = relationship(back_populates="moderator", foreign_keys="DBReport.moderator_id")
 
 class DBCustomer(Base):
     """Represents an account's purchase object.
@@ -427,13 +538,16 @@ class DBCustomer(Base):
     """
     __tablename__ = "customers"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"))
-    stripe_id: Mapped[Optional[str]] = mapped_column(String(64), default=None)
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"), index=True)
+    stripe_id: Mapped[Optional[str]] = mapped_column(String(64), index=True, default=None)
     type: Mapped[str] = mapped_column(String(32), default="free")
     expiration: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
 
     account: Mapped["DBAccount"] = relationship(back_populates="customer", foreign_keys="DBCustomer.account_id")
+
+# Lapsed subscriptions are found by type and expiration (see utils/maintenance.py)
+Index("ix_customers_type_expiration", DBCustomer.type, DBCustomer.expiration)
     
 class DBEmailVerification(Base):
     """Represents an email verification request. If an account has this object associated with it, it means they haven't verified their email account and should be notified of that.
@@ -446,13 +560,15 @@ class DBEmailVerification(Base):
     """
     __tablename__ = "email_verifications"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"))
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"), index=True)
     email: Mapped[str] = mapped_column(String(64))
-    expires_at: Mapped[datetime] = mapped_column(DateTime(), default=lambda: (datetime.now(UTC) + timedelta(0, settings.email_verification_duration)))
+    expires_at: Mapped[datetime] = mapped_column(DateTime(), index=True, default=lambda: (datetime.now(UTC) + timedelta(0, settings.email_verification_duration)))
 
     account: Mapped["DBAccount"] = relationship(back_populates="email_verification", foreign_keys="DBEmailVerification.account_id")
 
+Index("ix_email_verifications_email_lower", func.lower(DBEmailVerification.email))
+
 class DBPasswordChangeRequest(Base):
     """Represents a password change request. If an account has this object associated with it, it means they have requested to change their password.
     
@@ -463,9 +579,9 @@ class DBPasswordChangeRequest(Base):
     """
     __tablename__ = "password_changes"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"))
-    expires_at: Mapped[datetime] = mapped_column(DateTime(), default=lambda: (datetime.now(UTC) + timedelta(0, settings.email_verification_duration)))
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"), index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(), index=True, default=lambda: (datetime.now(UTC) + timedelta(0, settings.email_verification_duration)))
 
     account: Mapped["DBAccount"] = relationship(back_populates="password_change", foreign_keys="DBPasswordChangeRequest.account_id")
 
@@ -481,13 +597,19 @@ class DBEditorInvitation(Base):
     """
     __tablename__ = "editor_invitations"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    board_id: Mapped[str] = mapped_column(ForeignKey("boards.id"))
-    email: Mapped[str] = mapped_column(String(64))
-    expires_at: Mapped[datetime] = mapped_column(DateTime(), default=lambda: (datetime.now(UTC) + timedelta(0, settings.editor_invitation_duration)))
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    board_id: Mapped[str] = mapped_column(ForeignKey("boards.id"), index=True)
+    email: Mapped[str] = mapped_column(String(64), index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(), index=True, default=lambda: (datetime.now(UTC) + timedelta(0, settings.editor_invitation_duration)))
 
     board: Mapped["DBBoard"] = relationship(back_populates="pending_invites", foreign_keys="DBEditorInvitation.board_id")
 
+# Most auth event details are an account snapshot, and account updates add the update that was requested, as JSON
+AUTH_EVENT_DICTIONARY = (
+    b'{"account": {"config": {"old_password": null, "new_password": null, "@gmail.com", "@example.com", '
+    b'"/static/images/.png", "profile_image": null, "display_name": null, "email": "", "username": "", "id": "'
+)
+
 class DBAuthEvent(Base):
     """Some kind of authentication event
     
@@ -510,12 +632,14 @@ class DBAuthEvent(Base):
     """ # probably dont log every token request or refresh
     __tablename__ = "auth_events"
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    account_id: Mapped[str] = mapped_column(String(36)) # not a foreign key in case they delete their account
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    account_id: Mapped[str] = mapped_column(BinaryUUID()) # not a foreign key in case they delete their account
     event_type: Mapped[str] = mapped_column(String(32))
     host: Mapped[str] = mapped_column(String(32))
-    detail: Mapped[Optional[str]] = mapped_column(Text, default=None)
-    timestamp: Mapped[datetime] = mapped_column(DateTime(), default=func.now())
+    detail: Mapped[Optional[str]] = mapped_column(CompressedText(dictionary=AUTH_EVENT_DICTIONARY), default=None)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(), default=func.now(), index=True)
+
+Index("ix_auth_events_account_id_timestamp", DBAuthEvent.account_id, DBAuthEvent.timestamp)
 
 class DBReport(Base):
     """A user report
@@ -534,20 +658,20 @@ class DBReport(Base):
     
     Relationships:
         - account (DBAccount): The account that submitted the report
-        - moderator (DBPermission | None): The moderator assigned to this report
+        - moderator (DBAccount | None): The moderator assigned to this report
     """
     __tablename__ = "reports"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: gen_uuid())
-    account_id: Mapped[str] = mapped_column(String(36), ForeignKey("accounts.id"))
-    entity_id: Mapped[str] = mapped_column(String(36)) # not a foreign key because it depends on entity type
+    id: Mapped[str] = mapped_column(BinaryUUID(), primary_key=True, default=lambda: gen_uuid())
+    account_id: Mapped[str] = mapped_column(ForeignKey("accounts.id"), index=True)
+    entity_id: Mapped[str] = mapped_column(BinaryUUID()) # not a foreign key because it depends on entity type
     entity_type: Mapped[str] = mapped_column(String(36))
     report_type: Mapped[str] = mapped_column(String(32))
     report_text: Mapped[str] = mapped_column(Text(600))
-    status: Mapped[str] = mapped_column(String(32), default="fresh")
-    moderator_id: Mapped[Optional[str]] = mapped_column(String(36), ForeignKey("permissions.id"), default=None)
+    status: Mapped[str] = mapped_column(String(32), default="fresh", index=True)
+    moderator_id: Mapped[Optional[str]] = mapped_column(ForeignKey("accounts.id"), index=True, default=None)
     created_at: Mapped[datetime] = mapped_column(DateTime(), default=func.now())
     resolved_at: Mapped[Optional[datetime]] = mapped_column(DateTime(), default=None)
 
     account: Mapped["DBAccount"] = relationship(back_populates="reports", foreign_keys="DBReport.account_id")
-    moderator: Mapped[Optional["DBPermission"]] = relationship(back_populates="assigned_reports", foreign_keys="DBReport.moderator_id")
\ No newline at end of file
+    moderator: Mapped[Optional["DBAccount"]] = relationship(back_populates="assigned_reports", foreign_keys="DBReport.moderator_id")
\ No newline at end of file
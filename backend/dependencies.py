@@ -6,26 +6,89 @@ Args:
     refresh_cookie_scheme (APIKeyCookie): The scheme to extract refresh token JWT from cookies
     bearer_scheme (HTTPBearer): The scheme to extract access token JWT from authorization headers
     DBSession (Session): A database session as a dependency
+    ReadDBSession (Session): A database session for reads, which may use a replica, as a dependency
+    AsyncDBSession (AsyncSession): An async database session as a dependency
+    AsyncReadDBSession (AsyncSession): An async database session for reads, which may use a replica, as a dependency
     CurrentAccount (DBAccount): The current account as a dependency
+    ReadCurrentReadOnlyAccount (DBAccount): The current account, loaded through the read session, as a dependency
+    ReadCurrentAccount (DBAccount): The current account with a verified email, loaded through the read session, as a dependency
+    ReadOptionalAccount (DBAccount | None): The current account if logged in, loaded through the read session, as a dependency
     RefreshToken (str): The refresh token as a dependency
 """
 
 from typing import Annotated
+from contextlib import contextmanager
 import re
-from datetime import datetime, UTC, timedelta
 
-from fastapi import Depends, Response
+from fastapi import Depends, Request, Response
 from fastapi.security import APIKeyCookie, HTTPAuthorizationCredentials, HTTPBearer
 
-from sqlalchemy import create_engine, text, select, delete
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.orm import sessionmaker, Session as SessionType, ORMExecuteState
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from backend.config import settings
 from backend.database.schema import * # includes Base
+from backend.database import migrations
 from backend.exceptions import *
+from backend.utils.cache import TTLCache
+from backend.utils import write_coordinator
+
+def configure_sqlite(engine: Engine) -> None:
+    """Apply the pragmas in the settings to every connection the engine opens.
+
+    Pragmas only last as long as a connection, so they are set when each pooled connection is
+    created rather than once at startup.
+    """
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.db_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.db_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.db_busy_timeout}")
+        cursor.execute(f"PRAGMA mmap_size={settings.db_mmap_size}")
+        cursor.execute(f"PRAGMA cache_size={settings.db_cache_size}")
+        cursor.execute(f"PRAGMA foreign_keys={'ON' if settings.db_foreign_keys else 'OFF'}")
+        cursor.close()
 
 engine = create_engine(settings.db_url, echo=True)
-Session = sessionmaker(bind=engine)
+if settings.db_sqlite:
+    configure_sqlite(engine)
+# Objects stay loaded after a commit, so serializing them afterwards doesn't query them all again
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+if settings.db_sqlite and settings.db_write_coordinator:
+    write_coordinator.coordinator.install(Session)
+
+def async_url(url: str) -> str:
+    """Get the URL for the async driver of a database."""
+    return url.replace("sqlite://", "sqlite+aiosqlite://", 1) if url.startswith("sqlite://") else url
+
+async_engine = create_async_engine(async_url(settings.db_url), echo=True)
+if settings.db_sqlite:
+    configure_sqlite(async_engine.sync_engine)
+# The sync sessions behind the async ones, in a class of their own so session events can be registered for them
+class AsyncBackingSession(SessionType):
+    pass
+AsyncSessionMaker = async_sessionmaker(bind=async_engine, expire_on_commit=False, sync_session_class=AsyncBackingSession)
+
+# Reads can go to a replica, such as a read-only snapshot of the SQLite file. Without one, they use the primary.
+if settings.db_read_url is not None:
+    read_engine = create_engine(settings.db_read_url, echo=True)
+    async_read_engine = create_async_engine(async_url(settings.db_read_url), echo=True)
+    if settings.db_sqlite:
+        configure_sqlite(read_engine)
+        configure_sqlite(async_read_engine.sync_engine)
+else:
+    read_engine = engine
+    async_read_engine = async_engine
+ReadSession = sessionmaker(bind=read_engine, expire_on_commit=False)
+AsyncReadSessionMaker = async_sessionmaker(bind=async_read_engine, expire_on_commit=False, sync_session_class=AsyncBackingSession)
+
+# Clients that committed recently keep reading from the primary, so they see their own writes.
+# This is kept in each worker process, so a client whose next request goes to another worker can
+# read from the replica before it has caught up. Run one worker per host with a replica, or use
+# sticky load balancing, if that matters.
+recent_writers = TTLCache(settings.auth_cache_size, settings.db_read_sticky_duration)
 
 access_cookie_scheme = APIKeyCookie(name=settings.jwt_access_cookie_key, auto_error=False)
 refresh_cookie_scheme = APIKeyCookie(name=settings.jwt_refresh_cookie_key, auto_error=False)
@@ -34,72 +97,64 @@ bearer_scheme = HTTPBearer(auto_error=False)
 # Database functions
 
 def create_db_tables():
-    """Ensure the database and tables are created."""
+    """Ensure the database and tables are created and up to date."""
 
-    Base.metadata.create_all(engine)
+    migrations.upgrade(engine)
 
-    if settings.db_sqlite:
-        with engine.connect() as connection:
-            connection.execute(text("PRAGMA foreign_key=ON"))
+@contextmanager
+def unit_of_work(session: SessionType):
+    """Run a request as a single transaction. The database functions only flush, and the session
+    commits once when the request succeeds, or rolls back if it raises."""
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    session.commit()
 
-def get_session():
-    """Database session dependency."""
+def get_session(request: Request):
+    """Database session dependency. Commits at the end of a successful request."""
 
     with Session() as session:
-        yield session
+        with unit_of_work(session):
+            yield session
+        if session.info.get("wrote"):
+            recent_writers.set(client_id(request), True)
 
 DBSession = Annotated[Session, Depends(get_session)]
 
-def cleanup_db():
-    """Cleans up unused entries from certain tables in the database"""
-    with Session() as session:
-        # Remove expired refresh tokens
-        statement = delete(DBRefreshToken).where(DBRefreshToken.expires_at < datetime.now(UTC).timestamp())
-        session.execute(statement)
-        session.commit()
-        # Remove expired email verifications
-        statement = delete(DBEmailVerification).where(DBEmailVerification.expires_at < datetime.now(UTC).replace(tzinfo=None))
-        session.execute(statement)
-        session.commit()
-        # Remove expired password change requests
-        statement = delete(DBPasswordChangeRequest).where(DBPasswordChangeRequest.expires_at < datetime.now(UTC).replace(tzinfo=None))
-        session.execute(statement)
-        session.commit()
-        # Remove accounts that have no email and no pending email verifications
-        statement = delete(DBAccount).where((DBAccount.email == None) & (DBAccount.email_verification == None))
-        session.execute(statement)
-        session.commit()
-        # Remove expired editor invitations
-        statement = delete(DBEditorInvitation).where(DBEditorInvitation.expires_at < datetime.now(UTC).replace(tzinfo=None))
-        session.execute(statement)
-        session.commit()
-        # Remove auth events older than 30 days
-        statement = delete(DBAuthEvent).where(DBAuthEvent.timestamp < (datetime.now(UTC).replace(tzinfo=None) - timedelta(30)))
-        session.execute(statement)
-        session.commit()
-        # Downgrade expired active subscriptions to inactive
-        statement = select(DBCustomer).where(DBCustomer.type == "active").where(DBCustomer.expiration < datetime.now(UTC).replace(tzinfo=None))
-        results: list[DBCustomer] = list( session.execute(statement).scalars().all() )
-        for customer in results:
-            customer.type = "inactive"
-            session.add(customer)
-        session.commit()
-        # Downgrade expired+7 days inactive subscriptions to free
-        statement = select(DBCustomer).where(DBCustomer.type == "inactive").where(DBCustomer.expiration < (datetime.now(UTC).replace(tzinfo=None) - timedelta(7)))
-        results: list[DBCustomer] = list( session.execute(statement).scalars().all() )
-        for customer in results:
-            customer.type = "free"
-            customer.expiration = None
-            session.add(customer)
-        session.commit()
-        # Downgrade terminated subscriptions to free
-        statement = select(DBCustomer).where(DBCustomer.type == "terminated").where(DBCustomer.expiration < datetime.now(UTC).replace(tzinfo=None))
-        results: list[DBCustomer] = list( session.execute(statement).scalars().all() )
-        for customer in results:
-            customer.type = "free"
-            customer.expiration = None
-            session.add(customer)
-        session.commit()
+@event.listens_for(SessionType, "after_flush")
+def _mark_flushed(session: SessionType, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(SessionType, "do_orm_execute")
+def _mark_bulk_write(state: ORMExecuteState):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
+def get_read_session(request: Request):
+    """Database session dependency for routes that only read. Uses the read engine, unless this client committed something recently."""
+
+    with (Session if recent_writers.get(client_id(request)) else ReadSession)() as session:
+        yield session
+
+ReadDBSession = Annotated[Session, Depends(get_read_session)]
+
+async def get_async_session():
+    """Async database session dependency, for routes that shouldn't hold a thread while they wait on the database."""
+
+    async with AsyncSessionMaker() as session:
+        yield session
+
+AsyncDBSession = Annotated[AsyncSession, Depends(get_async_session)]
+
+async def get_async_read_session(request: Request):
+    """Async database session dependency for routes that only read. Uses the read engine, unless this client committed something recently."""
+
+    async with (AsyncSessionMaker if recent_writers.get(client_id(request)) else AsyncReadSessionMaker)() as session:
+        yield session
+
+AsyncReadDBSession = Annotated[AsyncSession, Depends(get_async_read_session)]
 
 # Authentication Functions
         
@@ -141,7 +196,20 @@ OptionalRefreshToken = Annotated[str | None, Depends(get_optional_refresh_token)
 # account dependencies
 
 # gotta import this down here
-from backend.auth import extract_account
+from backend.auth import extract_account, _extract_access_payload
+
+def client_id(request: Request) -> str:
+    """Identify who a request is from: the account, if it has a valid access token, or else the host. Only verifies the token, without loading the account."""
+    token = request.cookies.get(settings.jwt_access_cookie_key)
+    if token is None:
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" and credentials else None
+    if token is not None:
+        try:
+            return f"account:{_extract_access_payload(token).sub}"
+        except (InvalidAccessToken, ValueError):
+            pass
+    return request.client.host if request.client is not None else ""
 
 # an account with only read permissions
 
@@ -192,6 +260,49 @@ def get_optional_account(
 
 OptionalAccount = Annotated[Optional[DBAccount], Depends(get_optional_account)]
 
+async def get_optional_async_account(
+    session: AsyncReadDBSession, # type: ignore
+    access_token: str = Depends(get_optional_access_token),
+) -> Optional[DBAccount]:
+    """Optional account dependency for async routes. The account is loaded through the async session, so it can be compared with objects loaded by the route."""
+    if access_token is None:
+        return None
+    return await session.run_sync(extract_account, access_token)
+
+AsyncOptionalAccount = Annotated[Optional[DBAccount], Depends(get_optional_async_account)]
+
+# for routes that only read, so the account is loaded through the same session as everything else
+
+def get_read_current_account(
+    session: ReadDBSession, # type: ignore
+    access_token: str = Depends(get_access_token),
+) -> DBAccount:
+    """Current account dependency for routes that only read, like `CurrentReadOnlyAccount`."""
+    return extract_account(session, access_token)
+
+ReadCurrentReadOnlyAccount = Annotated[DBAccount, Depends(get_read_current_account)]
+
+def get_read_current_verified_account(
+    account: DBAccount = Depends(get_read_current_account),
+) -> DBAccount:
+    """Current account dependency for routes that only read, like `CurrentAccount`."""
+    if account.email is None:
+        raise UnverifiedEmailAddress()
+    return account
+
+ReadCurrentAccount = Annotated[DBAccount, Depends(get_read_current_verified_account)]
+
+def get_read_optional_account(
+    session: ReadDBSession, # type: ignore
+    access_token: str = Depends(get_optional_access_token),
+) -> Optional[DBAccount]:
+    """Optional account dependency for routes that only read."""
+    if access_token is None:
+        return None
+    return extract_account(session, access_token)
+
+ReadOptionalAccount = Annotated[Optional[DBAccount], Depends(get_read_optional_account)]
+
 def format_list(items: list[str]):
     """Formats a list nicely in alphabetical order. 'Alice, Bob, Charlie'"""
     items = sorted(items)
@@ -219,4 +219,16 @@ class TooManyRequests(BadRequestException):
     def __init__(self):
         self.status_code = 429
         self.error = "too_many_requests"
-        self.message = f"You are accessing this resource too quickly. Please try again later."
\ No newline at end of file
+        self.message = f"You are accessing this resource too quickly. Please try again later."
+
+class ServiceOverloaded(BadRequestException):
+    def __init__(self, retry_after: int):
+        self.status_code = 503
+        self.error = "service_overloaded"
+        self.message = f"The server is too busy to handle this request. Please try again later."
+        self.retry_after = retry_after
+
+    def response(self) -> Response:
+        response = super().response()
+        response.headers["Retry-After"] = str(self.retry_after)
+        return response
\ No newline at end of file
@@ -11,12 +11,13 @@ from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-from backend.dependencies import create_db_tables, cleanup_db
+from backend.dependencies import create_db_tables, Session
 from backend.exceptions import BadRequestException
 from backend.routers import boards, accounts, items, auth, media, reports
 from backend.config import settings
-from backend.utils.rate_limiter import limit
-from backend.utils import stripe
+from backend.utils.rate_limiter import limit, RateLimitMiddleware
+from backend.utils.load_shedding import LoadSheddingMiddleware
+from backend.utils import stripe, audit, account_purge, maintenance, backup
 
 from os import path
 
@@ -24,8 +25,15 @@ from os import path
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_tables()
-    cleanup_db()
+    audit.start(Session)
+    account_purge.start(Session)
+    maintenance.start(Session)
+    backup.start()
     yield
+    backup.stop()
+    maintenance.stop()
+    account_purge.stop()
+    audit.stop()
 
 # Setup and start the application
 
@@ -82,6 +90,11 @@ ORIGINS = [
     "http://localhost:3000",
 ]
 
+# Rate limits are checked before anything else, but inside CORS so rejections still have CORS headers.
+# Requests within the limits then wait for a slot in their route group.
+app.add_middleware(LoadSheddingMiddleware)
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ORIGINS, # Currently allows our frontend, if hosted on the same machine with port 3000
@@ -29,11 +29,26 @@ class AccessPayload(BaseModel):
     iss: str # issuer domain
     iat: int # time this token was issued
     exp: int # time after which this token has expired
+    # Optional entitlement claims, trusted while ver matches the account's claims_version
+    ver: int | None = None # claims version
+    role: str | None = None # permission role
+    tier: str | None = None # effective subscription tier
+    tier_exp: int | None = None # time after which the tier claim is out of date, if it changes with time
+    verified: bool | None = None # if the account had a verified email address when this was issued
     
 class RefreshPayload(BaseModel):
     """Model for JWT refresh token payload"""
     sub: str # subject. account ID as string.
-    uid: str # unique ID of this token so we can manually revoke it
+    uid: str # unique ID of this token, which changes every time it is refreshed
+    fid: str | None = None # ID of the token family (login session). Same as uid for older tokens.
     iss: str # issuer domain
     iat: int # time this token was issued
-    exp: int # time after which this token has expired
\ No newline at end of file
+    exp: int # time after which this token has expired
+    
+class AccountSnapshot(BaseModel):
+    """Model for the cached authorization details of an account"""
+    id: str
+    email_verified: bool
+    role: str # role from the account's permission object
+    tier: str | None # effective subscription tier from the account's customer object
+    tier_until: int | None = None # time at which the effective tier changes next
@@ -11,7 +11,7 @@ from backend.database.schema import *
 from backend import auth
 from backend.utils.rate_limiter import limit
 from backend.database import accounts as accounts_db, media as media_db
-from backend.dependencies import DBSession, CurrentAccount, CurrentReadOnlyAccount
+from backend.dependencies import DBSession, ReadDBSession, CurrentAccount, CurrentReadOnlyAccount, ReadCurrentReadOnlyAccount
 from backend.models.accounts import Account, AuthenticatedAccount, AccountUpdate
 from backend.models.media import Image
 from backend.models.shared import CollectionFactory
@@ -23,7 +23,7 @@ router = APIRouter(prefix="/accounts", tags=["Account"])
 @limit("main")
 def get_accounts(
     request: Request,
-    session: DBSession # type: ignore
+    session: ReadDBSession # type: ignore
 ) -> list[DBAccount]:
     """Get a list of all accounts"""
     return accounts_db.get_all(session)
@@ -32,8 +32,8 @@ def get_accounts(
 @limit("account")
 def get_current_account(
     request: Request,
-    session: DBSession, # type: ignore
-    account: CurrentReadOnlyAccount
+    session: ReadDBSession, # type: ignore
+    account: ReadCurrentReadOnlyAccount
 ) -> DBAccount:
     """Get the currently authenticated account"""
     return accounts_db.get_by_id(session, account.id)
@@ -66,8 +66,8 @@ def delete_current_account(
 @limit("account")
 def get_current_account(
     request: Request,
-    session: DBSession, # type: ignore
-    account: CurrentReadOnlyAccount
+    session: ReadDBSession, # type: ignore
+    account: ReadCurrentReadOnlyAccount
 ) -> list[DBImage]:
     """Get a list of images uploaded by the current account"""
     return media_db.get_account_images(session, account)
@@ -76,7 +76,7 @@ def get_current_account(
 @limit("account")
 def get_account_by_id(
     request: Request,
-    session: DBSession, # type: ignore
+    session: ReadDBSession, # type: ignore
     account_id: UUID
 ) -> DBAccount:
     """Gets an account object"""
@@ -86,7 +86,7 @@ def get_account_by_id(
 @limit("account")
 def get_account_by_username(
     request: Request,
-    session: DBSession, # type: ignore
+    session: ReadDBSession, # type: ignore
     username: str
 ) -> DBAccount:
     """Gets an account object by the username"""
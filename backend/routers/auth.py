@@ -53,9 +53,10 @@ def refresh_access_token(
     session: DBSession, # type: ignore
     refresh_token: RefreshToken
 ) -> None:
-    """Generate a new access token using the refresh token."""
-    access_token = auth.refresh_access_token(session, refresh_token)
+    """Generate a new access token using the refresh token. The refresh token is replaced as well."""
+    access_token, refresh_token = auth.refresh_access_token(session, refresh_token)
     set_cookie_secure(response, settings.jwt_access_cookie_key, access_token)
+    set_cookie_secure(response, settings.jwt_refresh_cookie_key, refresh_token)
 
 @router.post("/web/logout", status_code=204)
 @limit("auth", no_content=True)
@@ -9,8 +9,8 @@ from uuid import UUID
 
 from backend.database.schema import *
 from backend.database import boards as boards_db
-from backend.dependencies import DBSession, OptionalAccount
-from backend.utils.permissions import BoardPDP
+from backend.dependencies import DBSession, ReadDBSession, AsyncReadDBSession, ReadOptionalAccount, AsyncOptionalAccount
+from backend.utils.permissions import BoardPDP, ReadBoardPDP
 from backend.utils.rate_limiter import limit
 from backend.models.boards import Board, BoardCreate, BoardUpdate, BoardTransfer, EditorInvitation
 from backend.models.accounts import Account
@@ -19,21 +19,21 @@ from backend.models.shared import CollectionFactory
 router = APIRouter(prefix="/boards", tags=["Board"])
 
 @router.get("/", status_code=200, response_model=CollectionFactory(Board, DBBoard))
-@limit("board")
-def get_boards(
+@limit("board", is_async=True)
+async def get_boards(
     request: Request,
-    session: DBSession, # type: ignore
-    account: OptionalAccount = None
+    session: AsyncReadDBSession, # type: ignore
+    account: AsyncOptionalAccount = None
 ) -> list[DBBoard]:
     """Returns a collection of all visible boards, including both public ones and editable ones"""
-    return boards_db.get_visible(session, account)
+    return await boards_db.get_visible_async(session, account)
 
 @router.get("/editable", status_code=200, response_model=CollectionFactory(Board, DBBoard))
 @limit("board")
 def get_editable_boards(
     request: Request,
-    session: DBSession, # type: ignore
-    pdp: BoardPDP
+    session: ReadDBSession, # type: ignore
+    pdp: ReadBoardPDP
 ) -> list[DBBoard]:
     """Returns a collection of boards that the currently logged-in account can edit"""
     return boards_db.get_editable(session, pdp)
@@ -55,9 +55,9 @@ def create_board(
 @limit("board")
 def get_board(
     request: Request,
-    session: DBSession, # type: ignore
+    session: ReadDBSession, # type: ignore
     board_id: UUID,
-    account: OptionalAccount = None
+    account: ReadOptionalAccount = None
 ) -> DBBoard:
     """Returns the board with this ID if the account can access it"""
     return boards_db.get_for_viewer(session, str(board_id), account)
@@ -66,10 +66,10 @@ def get_board(
 @limit("board")
 def get_board_by_name_and_id(
     request: Request,
-    session: DBSession, # type: ignore
+    session: ReadDBSession, # type: ignore
     username: str,
     identifier: str,
-    account: OptionalAccount = None,
+    account: ReadOptionalAccount = None,
 ) -> DBBoard:
     """Returns the board with this ID and name if it exists and the account can view it."""
     return boards_db.get_by_name_identifier(session, username, identifier, account)
@@ -101,8 +101,8 @@ def delete_board(
 @limit("board")
 def get_editors(
     request: Request,
-    session: DBSession, # type: ignore
-    pdp: BoardPDP,
+    session: ReadDBSession, # type: ignore
+    pdp: ReadBoardPDP,
     board_id: UUID,
 ) -> list[DBAccount]:
     """Gets all accounts that can edit the board with this ID, excluding the owner."""
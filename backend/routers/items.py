@@ -10,7 +10,7 @@ from uuid import UUID
 from backend.utils.rate_limiter import limit
 from backend.database.schema import *
 from backend.database import items as items_db
-from backend.dependencies import DBSession, OptionalAccount
+from backend.dependencies import DBSession, AsyncReadDBSession, AsyncOptionalAccount
 from backend.utils.permissions import BoardPDP
 from backend.models.items import *
 from backend.models.shared import CollectionFactory
@@ -18,27 +18,27 @@ from backend.models.shared import CollectionFactory
 router = APIRouter(prefix="/boards/{board_id}/items", tags=["Item"])
 
 @router.get("/", status_code=200, response_model=ItemCollection)
-@limit("board_action")
-def get_items(
+@limit("board_action", is_async=True)
+async def get_items(
     request: Request,
-    session: DBSession, # type: ignore
+    session: AsyncReadDBSession, # type: ignore
     board_id: UUID,
-    account: OptionalAccount
-) -> list[DBItem]:
+    account: AsyncOptionalAccount
+) -> ItemCollection:
     """If the current account can see the board with this ID, return a collection of all items on this board."""
-    return items_db.get_items(session, str(board_id), account)
+    return await items_db.get_items_async(session, str(board_id), account)
 
 @router.get("/{item_id}", status_code=200, response_model=SomeItem)
-@limit("board_action")
-def get_item(
+@limit("board_action", is_async=True)
+async def get_item(
     request: Request,
-    session: DBSession, # type: ignore
+    session: AsyncReadDBSession, # type: ignore
     board_id: UUID,
     item_id: UUID,
-    account: OptionalAccount
+    account: AsyncOptionalAccount
 ) -> SomeItem:
     """If the account can edit this board, add an item."""
-    return convert_item( items_db.get_item(session, str(board_id), str(item_id), account) )
+    return await items_db.get_item_async(session, str(board_id), str(item_id), account)
 
 @router.post("/", status_code=201, response_model=SomeItem)
 @limit("board_action")
@@ -7,7 +7,7 @@ Args:
 from fastapi import APIRouter, UploadFile, Header, Request
 from fastapi.responses import FileResponse
 
-from backend.utils.rate_limiter import limit
+from backend.utils.rate_limiter import limit, upload_cost
 from backend.database.schema import *
 from backend.database import media as media_db
 from backend.dependencies import DBSession, CurrentAccount, OptionalAccount
@@ -18,7 +18,7 @@ from backend.models.shared import Metadata
 router = APIRouter(prefix="/media", tags=["Media"])
 
 @router.post('/images/upload', status_code=201, response_model=Image)
-@limit("media", is_async=True)
+@limit("media", is_async=True, cost=upload_cost)
 async def upload_image_file(
     request: Request,
     session: DBSession, # type: ignore
@@ -40,7 +40,7 @@ def delete_image(
     media_db.delete_image(session, uuid, account)
 
 @router.post('/avatar/upload', status_code=201, response_model=AuthenticatedAccount)
-@limit("media", is_async=True)
+@limit("media", is_async=True, cost=upload_cost)
 async def upload_avatar_image(
     request: Request,
     session: DBSession, # type: ignore
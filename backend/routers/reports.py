@@ -3,8 +3,8 @@
 from fastapi import APIRouter, Request
 from uuid import UUID
 
-from backend.dependencies import DBSession
-from backend.utils.permissions import ReportPDP
+from backend.dependencies import DBSession, ReadDBSession
+from backend.utils.permissions import ReportPDP, ReadReportPDP
 from backend.utils.rate_limiter import limit
 from backend.database.schema import DBReport
 from backend.database import reports as reports_db
@@ -20,8 +20,8 @@ router = APIRouter(
 @limit("main")
 def get_submitted(
     request: Request,
-    session: DBSession, # type: ignore
-    pdp: ReportPDP,
+    session: ReadDBSession, # type: ignore
+    pdp: ReadReportPDP,
 ) -> list[DBReport]:
     """Returns a list of reports submitted by this user, sorted by most recent."""
     return reports_db.get_submitted(session, pdp)
@@ -30,8 +30,8 @@ def get_submitted(
 @limit("main")
 def get_reports(
     request: Request,
-    session: DBSession, # type: ignore
-    pdp: ReportPDP,
+    session: ReadDBSession, # type: ignore
+    pdp: ReadReportPDP,
 ) -> list[DBReport]:
     """Returns a list of all reports sorted by most recent."""
     return reports_db.get_all(session, pdp)
@@ -40,8 +40,8 @@ def get_reports(
 @limit("main")
 def get_assigned(
     request: Request,
-    session: DBSession, # type: ignore
-    pdp: ReportPDP,
+    session: ReadDBSession, # type: ignore
+    pdp: ReadReportPDP,
 ) -> list[DBReport]:
     """Returns a list of reports assigned to this account, sorted by most recent."""
     return reports_db.get_assigned(session, pdp)
@@ -61,8 +61,8 @@ def submit_report(
 @limit("main")
 def get_report(
     request: Request,
-    session: DBSession, # type: ignore
-    pdp: ReportPDP,
+    session: ReadDBSession, # type: ignore
+    pdp: ReadReportPDP,
     report_id: UUID,
 ) -> DBReport:
     """Finds and returns a report."""
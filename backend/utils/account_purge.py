@@ -0,0 +1,117 @@
+"""Background purge of deleted accounts.
+
+Deleting an account only marks it as deleted, and the request revokes its tokens. Everything
+the account owns, from its Stripe customer and uploaded image files to its boards and items, is
+purged here on a background thread, `account_purge_batch_size` rows at a time with a commit
+after each batch. An interrupted purge resumes from the deleted accounts still in the database,
+on the next pass after a restart.
+
+The thread wakes up when a deletion is committed, and also every `account_purge_interval`
+seconds, to retry accounts whose purge failed, for example because Stripe could not be reached.
+Each failure is logged with the account's ID and counted in `errors`.
+"""
+
+from threading import Thread, Event
+from typing import Callable
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.database.schema import DBAccount
+
+logger = logging.getLogger(__name__)
+
+class AccountPurger():
+    """Purges deleted accounts in batches on a background thread.
+
+    Args:
+        session_factory (Callable[[], Session]): Creates sessions for the background thread
+        batch_size (int): The most rows of each kind deleted in one transaction
+        interval (int): The longest time in seconds between passes
+
+    Fields:
+        - errors (int): The number of times purging an account failed
+    """
+    def __init__(self, session_factory: Callable[[], Session], batch_size: int, interval: int):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.errors = 0
+        self._wake = Event()
+        self._stopping = Event()
+        self._thread: Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the background thread."""
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="account-purge", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread after the batch it is working on."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def wake(self) -> None:
+        """Start a pass now rather than at the next interval."""
+        self._wake.set()
+
+    def purge_all(self) -> int:
+        """Purge every deleted account. Returns the number of accounts that are gone."""
+        with self.session_factory() as session:
+            account_ids = list(session.execute(select(DBAccount.id).where(DBAccount.deleted_at != None).order_by(DBAccount.deleted_at)).scalars().all())
+        purged = 0
+        for account_id in account_ids:
+            try:
+                while not self._stopping.is_set():
+                    with self.session_factory() as session:
+                        done = accounts_db.purge(session, account_id, self.batch_size)
+                        session.commit()
+                    if done:
+                        purged += 1
+                        break
+            except Exception:
+                self.errors += 1
+                logger.exception("Failed to purge account %s, retrying on the next pass", account_id)
+        return purged
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.clear()
+            self.purge_all()
+            self._wake.wait(self.interval)
+
+# The application's purger. Sessions come from the application session factory.
+purger: AccountPurger | None = None
+
+def start(session_factory: Callable[[], Session]) -> None:
+    """Start the application's purger."""
+    global purger
+    purger = AccountPurger(session_factory, settings.account_purge_batch_size, settings.account_purge_interval)
+    purger.start()
+
+def stop() -> None:
+    """Stop the application's purger. Accounts it didn't finish are purged after the next start."""
+    global purger
+    if purger is not None:
+        purger.stop()
+        purger = None
+
+def wake() -> None:
+    """Wake the application's purger, if it is running."""
+    if purger is not None:
+        purger.wake()
+
+# gotta import this down here
+from backend.database import accounts as accounts_db
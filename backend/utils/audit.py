@@ -0,0 +1,189 @@
+"""Write-behind logging for authentication events.
+
+Auth events used to be inserted with their own commit on the request path. Instead, `record`
+holds them until the caller's session commits, then puts them on a bounded in-memory queue, and
+a background thread inserts them in batches of up to `audit_batch_size` events, at least every
+`audit_flush_interval` milliseconds. Events of a session that rolls back are dropped, so a
+failed registration doesn't log one. Remaining events are written when the writer is stopped.
+
+If the writer is not running (for example in tests, where the lifespan does not run) or its
+queue is full, the event is added to the caller's session, and is written when the request's
+unit of work commits. Events that no longer fit in the queue by the time their session commits
+are inserted straight away.
+
+A batch that fails to insert, for example because the database is locked, is retried up to
+`WRITE_ATTEMPTS` times, waiting twice as long before each attempt. If it still fails, it is
+logged and dropped, so the writer keeps going with the events behind it.
+"""
+
+from datetime import datetime, UTC
+from json import dumps
+import logging
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+from time import monotonic
+from typing import Any, Callable
+
+from sqlalchemy import insert, event
+from sqlalchemy.orm import Session, SessionTransaction
+
+from backend.config import settings
+from backend.database.schema import DBAuthEvent, gen_uuid
+
+logger = logging.getLogger(__name__)
+
+# Attempts to insert a batch before it is dropped
+WRITE_ATTEMPTS = 5
+
+class AuditWriter():
+    """Buffers auth events and inserts them in batches on a background thread.
+
+    Args:
+        session_factory (Callable[[], Session]): Creates sessions for the background thread
+        batch_size (int): The most events inserted at once
+        flush_interval (int): The longest time in milliseconds an event waits before being written
+        max_queue (int): The most events that can be waiting at once
+    """
+    def __init__(self, session_factory: Callable[[], Session], batch_size: int, flush_interval: int, max_queue: int):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000
+        self._queue: Queue[dict[str, Any]] = Queue(max_queue)
+        self._failed: list[dict[str, Any]] = [] # a batch that is waiting to be retried
+        self._stopping = Event()
+        self._thread: Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the background thread."""
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and write any events still waiting."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        try:
+            self._write(self._failed)
+            while self._write(self._take(block=False)):
+                pass
+        except Exception:
+            logger.exception("Failed to write auth events while stopping")
+        self._failed = []
+
+    def record(self, session: Session, account_id: str, event_type: str, host: str, detail: dict | None = None) -> None:
+        """Log an auth event.
+
+        Args:
+            session (Session): The caller's session. The event is queued once it commits, or added to it if the queue is full
+            account_id (str): The account in question
+            event_type (str): The type of event
+            host (str): The IP address of the event
+            detail (dict | None): More information, serialized to JSON when written
+        """
+        row = {
+            "account_id": account_id,
+            "event_type": event_type,
+            "host": host,
+            "detail": detail,
+            "timestamp": datetime.now(UTC).replace(tzinfo=None),
+        }
+        if self.running and not self._queue.full():
+            if not session.info.get("audit_hooks"):
+                event.listen(session, "after_commit", self._after_commit)
+                event.listen(session, "after_transaction_end", self._after_transaction_end)
+                session.info["audit_hooks"] = True
+            session.info.setdefault("audit_events", []).append(row)
+            return
+        session.add(DBAuthEvent(**_serialize(row)))
+
+    def _after_commit(self, session: Session) -> None:
+        overflow = []
+        for row in session.info.pop("audit_events", []):
+            try:
+                self._queue.put_nowait(row)
+            except Full:
+                overflow.append(row)
+        try:
+            self._write(overflow)
+        except Exception:
+            logger.exception("Failed to write %d auth events, dropping them", len(overflow))
+
+    def _after_transaction_end(self, session: Session, transaction: SessionTransaction) -> None:
+        # Anything still held wasn't committed
+        if transaction.parent is None:
+            session.info.pop("audit_events", None)
+
+    def _run(self) -> None:
+        attempts = 0
+        while not self._stopping.is_set():
+            rows = self._failed or self._take(block=True)
+            try:
+                self._write(rows)
+                self._failed, attempts = [], 0
+            except Exception:
+                attempts += 1
+                if attempts < WRITE_ATTEMPTS:
+                    logger.warning("Failed to write %d auth events, retrying (attempt %d of %d)", len(rows), attempts, WRITE_ATTEMPTS, exc_info=True)
+                    self._failed = rows
+                    self._stopping.wait(self.flush_interval * 2 ** attempts)
+                else:
+                    logger.exception("Failed to write %d auth events, dropping them", len(rows))
+                    self._failed, attempts = [], 0
+
+    def _take(self, block: bool) -> list[dict[str, Any]]:
+        """Take up to one batch of events off the queue. If blocking, wait up to the flush interval for the batch to fill."""
+        rows: list[dict[str, Any]] = []
+        deadline = monotonic() + self.flush_interval
+        while len(rows) < self.batch_size:
+            try:
+                if block:
+                    rows.append(self._queue.get(timeout=max(deadline - monotonic(), 0)))
+                else:
+                    rows.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return rows
+
+    def _write(self, rows: list[dict[str, Any]]) -> int:
+        """Insert a batch of events. Returns the number written."""
+        if len(rows) == 0:
+            return 0
+        with self.session_factory() as session:
+            session.execute(insert(DBAuthEvent), [ _serialize(row) | { "id": gen_uuid() } for row in rows ])
+            session.commit()
+        return len(rows)
+
+def _serialize(row: dict[str, Any]) -> dict[str, Any]:
+    return row | { "detail": dumps(row["detail"]) if row["detail"] is not None else None }
+
+# The application's writer. Sessions come from the application session factory.
+writer: AuditWriter | None = None
+
+def start(session_factory: Callable[[], Session]) -> None:
+    """Start the application's writer."""
+    global writer
+    writer = AuditWriter(session_factory, settings.audit_batch_size, settings.audit_flush_interval, settings.audit_queue_size)
+    writer.start()
+
+def stop() -> None:
+    """Stop the application's writer, writing any events still waiting."""
+    global writer
+    if writer is not None:
+        writer.stop()
+        writer = None
+
+def record(session: Session, account_id: str, event_type: str, host: str, detail: dict | None = None) -> None:
+    """Log an auth event through the application's writer, or directly if it is not running."""
+    if writer is not None:
+        writer.record(session, account_id, event_type, host, detail)
+        return
+    session.add(DBAuthEvent(account_id=account_id, event_type=event_type, host=host, detail=dumps(detail) if detail is not None else None))
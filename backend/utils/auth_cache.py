@@ -0,0 +1,89 @@
+"""In-process cache for the authentication hot path.
+
+Every authenticated request decodes a JWT and the permission checks load the account's
+permission and customer objects. This module keeps verified access token payloads, keyed by
+the token signature, and a compact snapshot of each account's authorization details.
+
+Snapshots are invalidated whenever an account, permission or customer row is updated or
+deleted through the ORM, and when an account is force-logged-out. Bulk UPDATE/DELETE
+statements bypass the ORM events, so code using them must call `invalidate_account` or
+`clear` itself.
+"""
+
+from datetime import datetime, UTC
+from hmac import compare_digest
+
+from sqlalchemy import event
+
+from backend.config import settings
+from backend.database.schema import DBAccount, DBPermission, DBCustomer
+from backend.models.auth import AccessPayload, AccountSnapshot
+from backend.utils.cache import TTLCache
+from backend.utils.entitlements import effective_tier
+
+# Maps token signatures to (token, payload) pairs
+tokens = TTLCache(settings.auth_cache_size, settings.jwt_access_duration)
+# Maps account IDs to account snapshots
+accounts = TTLCache(settings.auth_cache_size, settings.auth_cache_ttl)
+
+def _signature(token: str) -> str:
+    return token.rsplit('.', 1)[-1]
+
+def get_payload(token: str) -> AccessPayload | None:
+    """Get the payload of an access token that was already verified, if it hasn't expired."""
+    entry: tuple[str, AccessPayload] | None = tokens.get(_signature(token))
+    if entry is None or not compare_digest(entry[0], token):
+        return None
+    if entry[1].exp <= int(datetime.now(UTC).timestamp()):
+        return None
+    return entry[1]
+
+def set_payload(token: str, payload: AccessPayload) -> None:
+    """Remember the payload of an access token that was just verified, until it expires."""
+    tokens.set(_signature(token), (token, payload), payload.exp - int(datetime.now(UTC).timestamp()))
+
+def get_snapshot(account: DBAccount) -> AccountSnapshot:
+    """Get the authorization details for an account, loading its permission and customer objects on a cache miss.
+
+    The snapshot expires when the account's effective tier changes next, if that is sooner than `auth_cache_ttl`.
+    """
+    snapshot: AccountSnapshot | None = accounts.get(account.id)
+    if snapshot is None:
+        customer = account.customer
+        tier, tier_until = effective_tier(customer.type, customer.expiration) if customer is not None else (None, None)
+        snapshot = AccountSnapshot(
+            id=account.id,
+            email_verified=account.email is not None,
+            role=account.permission.role if account.permission is not None else "user",
+            tier=tier,
+            tier_until=int(tier_until.timestamp()) if tier_until is not None else None,
+        )
+        # Keep it no longer than the tier stays the same
+        accounts.set(account.id, snapshot, snapshot.tier_until - datetime.now(UTC).timestamp() if snapshot.tier_until is not None else None)
+    return snapshot
+
+def invalidate_account(account_id: str) -> None:
+    """Forget the snapshot and any verified access tokens for an account."""
+    accounts.pop(account_id)
+    tokens.discard_where(lambda _, entry: entry[1].sub == account_id)
+
+def clear() -> None:
+    """Forget everything."""
+    tokens.clear()
+    accounts.clear()
+
+# Invalidate snapshots whenever the rows they are built from change
+
+@event.listens_for(DBAccount, "after_update")
+@event.listens_for(DBAccount, "after_delete")
+def _on_account_change(mapper, connection, target: DBAccount):
+    invalidate_account(target.id)
+
+@event.listens_for(DBPermission, "after_insert")
+@event.listens_for(DBPermission, "after_update")
+@event.listens_for(DBPermission, "after_delete")
+@event.listens_for(DBCustomer, "after_insert")
+@event.listens_for(DBCustomer, "after_update")
+@event.listens_for(DBCustomer, "after_delete")
+def _on_entitlement_change(mapper, connection, target: DBPermission | DBCustomer):
+    invalidate_account(target.account_id)
@@ -0,0 +1,234 @@
+"""Online backups of the SQLite database.
+
+Backups use SQLite's online backup API, copying `db_backup_pages` pages at a time with a pause
+of `db_backup_pause` milliseconds between batches. The source connection holds one read
+transaction for the whole copy. With WAL, that read transaction doesn't block writers, and the
+backup copies the database as of its start, instead of starting over every time another
+connection commits. The WAL can't be checkpointed past that point until the copy is done.
+
+Snapshots are written next to each other in `db_backup_path` as `<database>-<UTC time>.db`,
+in rollback journal mode so each one is a single file. Only the newest `db_backup_retention`
+are kept. The snapshotter takes one every `db_backup_interval` seconds on a background thread.
+Every worker process starts one, but only the process holding an exclusive lock on
+`.snapshotter.lock` in that folder takes snapshots. The others try to take the lock once an
+interval, so one of them carries on if that process exits. Failed snapshots are logged.
+
+A snapshot is restored into the live database with the same API, in a single transaction, so
+other connections see either the old database or the restored one. Caches in running workers
+aren't cleared, so restore with the application stopped unless that is acceptable.
+
+Run `python -m backend.backup` for the command line interface.
+"""
+
+from datetime import datetime, UTC
+from threading import Thread, Event
+from time import sleep, monotonic
+from typing import IO
+import logging
+import os
+import sqlite3
+
+from sqlalchemy import make_url
+
+from backend.config import settings
+
+try:
+    import fcntl
+except ImportError: # not on Windows, where every process takes snapshots
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# The file in the snapshot folder locked by the process that takes snapshots
+LOCK_NAME = ".snapshotter.lock"
+
+def database_path() -> str:
+    """Get the path of the application's SQLite database."""
+    return make_url(settings.db_url).database
+
+def backup(source: str, destination: str, pages: int | None = None, pause: int | None = None) -> int:
+    """Copy a database while it is in use, a batch of pages at a time.
+
+    Args:
+        source (str): The path of the database to copy
+        destination (str): The path to copy it to. It is written to a temporary file first, and replaced when done.
+        pages (int | None): The pages copied per batch, defaulting to db_backup_pages. -1 copies them all at once.
+        pause (int | None): Milliseconds between batches, defaulting to db_backup_pause
+
+    Returns:
+        int: The number of pages copied
+    """
+    pages = pages or settings.db_backup_pages
+    pause = (settings.db_backup_pause if pause is None else pause) / 1000
+    partial = destination + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    total = 0
+    def progress(status: int, remaining: int, count: int):
+        nonlocal total
+        total = count
+        if remaining > 0 and pause > 0:
+            sleep(pause)
+    source_connection = sqlite3.connect(source, timeout=settings.db_busy_timeout / 1000, isolation_level=None)
+    destination_connection = sqlite3.connect(partial, isolation_level=None)
+    try:
+        # Read the whole copy from one snapshot of the source
+        source_connection.execute("BEGIN")
+        source_connection.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        source_connection.backup(destination_connection, pages=pages, progress=progress)
+        source_connection.execute("COMMIT")
+        destination_connection.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        source_connection.close()
+        destination_connection.close()
+    os.replace(partial, destination)
+    return total
+
+def restore(snapshot: str, destination: str) -> None:
+    """Replace the contents of a database with a snapshot, in one transaction.
+
+    Raises:
+        sqlite3.DatabaseError: if the snapshot is not a healthy database
+    """
+    snapshot_connection = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+    destination_connection = sqlite3.connect(destination, timeout=settings.db_busy_timeout / 1000)
+    try:
+        result = snapshot_connection.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"{snapshot} is damaged: {result}")
+        snapshot_connection.backup(destination_connection)
+    finally:
+        snapshot_connection.close()
+        destination_connection.close()
+
+def list_snapshots(folder: str, source: str) -> list[str]:
+    """List the paths of a database's snapshots in a folder, oldest first."""
+    prefix = os.path.splitext(os.path.basename(source))[0] + "-"
+    if not os.path.isdir(folder):
+        return []
+    names = [ name for name in os.listdir(folder) if name.startswith(prefix) and name.endswith(".db") ]
+    return [ os.path.join(folder, name) for name in sorted(names) ]
+
+def snapshot(folder: str, source: str, retention: int | None = None) -> str:
+    """Back a database up into a new snapshot in a folder, and delete the oldest snapshots past the retention.
+
+    Args:
+        folder (str): The folder to keep snapshots in
+        source (str): The path of the database
+        retention (int | None): The most snapshots to keep, defaulting to db_backup_retention
+
+    Returns:
+        str: The path of the new snapshot
+    """
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.splitext(os.path.basename(source))[0]
+    path = os.path.join(folder, f"{name}-{datetime.now(UTC).strftime('%Y%m%dT%H%M%S%fZ')}.db")
+    backup(source, path)
+    for old in list_snapshots(folder, source)[:-(retention or settings.db_backup_retention)]:
+        os.remove(old)
+    return path
+
+class Snapshotter():
+    """Takes snapshots of a database on a background thread.
+
+    Args:
+        source (str): The path of the database
+        folder (str): The folder to keep snapshots in
+        interval (int): The time in seconds between snapshots
+        retention (int): The most snapshots to keep
+
+    Fields:
+        - last_snapshot (str): The path of the last snapshot taken
+        - last_duration (float): How long the last snapshot took, in milliseconds
+        - errors (int): The number of snapshots that failed
+    """
+    def __init__(self, source: str, folder: str, interval: int, retention: int):
+        self.source = source
+        self.folder = folder
+        self.interval = interval
+        self.retention = retention
+        self.last_snapshot: str | None = None
+        self.last_duration = 0.0
+        self.errors = 0
+        self._stopping = Event()
+        self._thread: Thread | None = None
+        self._lock: IO | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the background thread."""
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="backup", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread, waiting for a snapshot in progress, and let another process take over."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        if self._lock is not None:
+            self._lock.close() # releases the lock
+            self._lock = None
+
+    def claim(self) -> bool:
+        """Try to become the process that takes snapshots. Returns True if this snapshotter holds the lock."""
+        if self._lock is not None or fcntl is None:
+            return True
+        os.makedirs(self.folder, exist_ok=True)
+        lock = open(os.path.join(self.folder, LOCK_NAME), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._lock = lock
+        return True
+
+    def take(self) -> str | None:
+        """Take a snapshot now. Returns its path, or None if it failed."""
+        start = monotonic()
+        try:
+            self.last_snapshot = snapshot(self.folder, self.source, self.retention)
+        except Exception:
+            self.errors += 1
+            logger.exception("Failed to take a snapshot of %s (%d failures)", self.source, self.errors)
+            return None
+        finally:
+            self.last_duration = (monotonic() - start) * 1000
+        logger.info("Took a snapshot of %s in %d ms: %s", self.source, self.last_duration, self.last_snapshot)
+        return self.last_snapshot
+
+    def _run(self) -> None:
+        # The first snapshot is taken one interval after startup
+        while not self._stopping.wait(self.interval):
+            try:
+                claimed = self.claim()
+            except OSError:
+                logger.exception("Failed to lock %s", os.path.join(self.folder, LOCK_NAME))
+                continue
+            if claimed:
+                self.take()
+
+# The application's snapshotter, if snapshots are enabled
+snapshotter: Snapshotter | None = None
+
+def start() -> None:
+    """Start the application's snapshotter, if the database is SQLite and db_backup_interval is set."""
+    global snapshotter
+    if not settings.db_sqlite or not settings.db_backup_interval:
+        return
+    snapshotter = Snapshotter(database_path(), settings.db_backup_path, settings.db_backup_interval, settings.db_backup_retention)
+    snapshotter.start()
+
+def stop() -> None:
+    """Stop the application's snapshotter."""
+    global snapshotter
+    if snapshotter is not None:
+        snapshotter.stop()
+        snapshotter = None
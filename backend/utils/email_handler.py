@@ -1,6 +1,12 @@
 """Handles everything related to sending emails for various reasons."""
 
+from contextvars import ContextVar
 from os import path
+from typing import Callable, Any
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, SessionTransaction
 
 from backend.config import settings
 from backend.database.schema import DBAccount, DBCustomer, DBBoard, DBEmailVerification, DBPasswordChangeRequest, DBEditorInvitation
@@ -13,6 +19,37 @@ from email.utils import make_msgid
 # Type of text replacements for the dictionary
 TextReplacements = dict[str, dict[str, str]]
 
+logger = logging.getLogger(__name__)
+
+# Set while send_after_commit composes an email, so send_email holds it instead of sending it
+_outbox: ContextVar[list[EmailMessage] | None] = ContextVar("outbox", default=None)
+
+def send_after_commit(session: Session, send: Callable[..., None], *args: Any) -> None:
+    """Compose an email now, while the objects it mentions can still be loaded, and send it once the session
+    commits. None is sent for changes that are rolled back, and the database isn't held up while talking to
+    the SMTP server. The changes are already saved by then, so a failure to send is logged rather than raised."""
+    if not session.info.get("email_hooks"):
+        event.listen(session, "after_commit", _send_committed)
+        event.listen(session, "after_transaction_end", _drop_uncommitted)
+        session.info["email_hooks"] = True
+    token = _outbox.set(session.info.setdefault("emails", []))
+    try:
+        send(*args)
+    finally:
+        _outbox.reset(token)
+
+def _send_committed(session: Session) -> None:
+    for message in session.info.pop("emails", []):
+        try:
+            send_email(message)
+        except Exception:
+            logger.exception("Failed to send \"%s\" to %s", message["Subject"], message["To"])
+
+def _drop_uncommitted(session: Session, transaction: SessionTransaction) -> None:
+    # Anything still held wasn't committed
+    if transaction.parent is None:
+        session.info.pop("emails", None)
+
 def send_verification_email(account: DBAccount, verification: DBEmailVerification):
     name = account.display_name or account.username
     message: EmailMessage = compose_email(
@@ -103,6 +140,10 @@ def send_subscription_cancellation_email(customer: DBCustomer):
     send_email(message)
 
 def send_email(message: EmailMessage):
+    outbox = _outbox.get()
+    if outbox is not None:
+        outbox.append(message)
+        return
     with smtplib.SMTP_SSL(
         host=settings.smtp_host,
         port=settings.smtp_port,
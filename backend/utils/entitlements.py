@@ -0,0 +1,59 @@
+"""Subscription entitlements.
+
+A customer's stored `type` only changes when Stripe tells us something, or when the maintenance
+job compacts lapsed subscriptions. The tier an account is actually entitled to is worked out
+from `type` and `expiration` whenever it is read:
+
+- an `active` subscription becomes `inactive` once it expires
+- an `inactive` subscription goes back to `free` after `subscription_grace_period` seconds
+- a `terminated` subscription goes back to `free` once it expires
+
+The tier is cached in the account's auth snapshot until it next changes, so permission checks
+should use `get_tier` or `is_premium` rather than reading the customer object.
+"""
+
+from datetime import datetime, UTC, timedelta
+
+from backend.config import settings
+from backend.database.schema import DBAccount
+
+# Tiers with access to premium features
+PREMIUM_TIERS = [ "active", "inactive", "lifetime" ]
+
+def _aware(moment: datetime) -> datetime:
+    # SQLite gives back naive datetimes, which are stored in UTC
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=UTC)
+
+def effective_tier(type: str | None, expiration: datetime | None, now: datetime | None = None) -> tuple[str | None, datetime | None]:
+    """Work out the tier a customer is entitled to at a moment.
+
+    Args:
+        type (str | None): The customer's stored subscription type, or None without a customer
+        expiration (datetime | None): When the customer's subscription expires
+        now (datetime | None): The moment to evaluate at, defaulting to now
+
+    Returns:
+        str | None: The effective tier
+        datetime | None: When the effective tier changes next, or None if it only changes with the stored type
+    """
+    if expiration is None or type not in [ "active", "inactive", "terminated" ]:
+        return type, None
+    now = now or datetime.now(UTC)
+    expiration = _aware(expiration)
+    grace_end = expiration + timedelta(seconds=settings.subscription_grace_period)
+    if type == "active" and now < expiration:
+        return "active", expiration
+    if type == "terminated":
+        return ("terminated", expiration) if now < expiration else ("free", None)
+    return ("inactive", grace_end) if now < grace_end else ("free", None)
+
+def get_tier(account: DBAccount) -> str | None:
+    """Get an account's effective tier, from its cached snapshot if there is one."""
+    return auth_cache.get_snapshot(account).tier
+
+def is_premium(account: DBAccount) -> bool:
+    """Whether an account is entitled to premium features."""
+    return get_tier(account) in PREMIUM_TIERS
+
+# gotta import this down here
+from backend.utils import auth_cache
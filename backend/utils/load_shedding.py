@@ -0,0 +1,138 @@
+"""Adaptive concurrency limits for groups of routes.
+
+Sync routes run in worker threads, so under overload every request would wait for the same
+threads. Instead, routes are split into groups (bulkheads), each with its own concurrency
+limit, a small queue, and its own capacity limiter for the threads its sync routes run in. A request that finds its group's queue full is rejected with a 503
+and a Retry-After header straight away, so one busy group can't slow down the others.
+
+Each limit adapts with AIMD (additive increase, multiplicative decrease): when a request
+finishes within the group's target latency, the limit grows by about one per limit's worth
+of requests, and when it takes longer, the limit shrinks by a fixed factor.
+"""
+
+import asyncio
+from anyio import CapacityLimiter
+from collections import deque
+from time import monotonic
+
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from backend.config import settings
+from backend.exceptions import ServiceOverloaded
+
+# Tuples of initial limit, maximum limit, queue size and target latency in milliseconds
+GROUP_LIMITS = {
+    "auth": (4, 8, 16, 1000), # password hashing is slow on purpose
+    "media": (2, 4, 8, 2000),
+    "board_read": (32, 64, 128, 250),
+    "board_write": (16, 32, 64, 500),
+}
+
+# Rate limit keys of the routes in each group. Board routes are split by method.
+KEY_GROUPS = {
+    "auth": "auth",
+    "from_email": "auth",
+    "media": "media",
+    "board": "board",
+    "board_action": "board",
+}
+
+READ_METHODS = [ "GET", "HEAD", "OPTIONS" ]
+
+# Each group's sync routes borrow threads from their own limiter, sized by the group's maximum
+# limit. Routes outside of any group use anyio's default limiter.
+THREAD_LIMITERS = { group: CapacityLimiter(limits[1]) for group, limits in GROUP_LIMITS.items() }
+
+# Multiplicative decrease when a request is slower than the target
+BACKOFF = 0.9
+
+class Bulkhead():
+    """An adaptive concurrency limit with a bounded queue.
+
+    Args:
+        limit (int): The initial number of requests allowed at once
+        max_limit (int): The most requests ever allowed at once
+        queue_size (int): The most requests that can wait for a slot
+        target_latency (float): Requests slower than this many milliseconds reduce the limit
+    """
+    def __init__(self, limit: int, max_limit: int, queue_size: int, target_latency: float):
+        self.limit = float(limit)
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.target_latency = target_latency / 1000
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting up to `timeout` seconds in the queue. Returns False if the queue is full or the wait timed out."""
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True # the slot was handed over by release
+        except TimeoutError:
+            return waiter.done() and not waiter.cancelled() # the slot may have been handed over just as the wait timed out
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, latency: float) -> None:
+        """Give back a slot, adjusting the limit based on how long the request took in seconds."""
+        if latency > self.target_latency:
+            self.limit = max(1.0, self.limit * BACKOFF)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        # Hand the slot straight to the next waiting request, if the limit still allows it
+        if self.in_flight <= int(self.limit):
+            while len(self._waiters) > 0:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+def create_bulkheads() -> dict[str, Bulkhead]:
+    """Create a bulkhead for every group."""
+    return { group: Bulkhead(*limits) for group, limits in GROUP_LIMITS.items() }
+
+def route_group(key: str, method: str) -> str | None:
+    """Get the group for a route from its rate limit key and method."""
+    group = KEY_GROUPS.get(key)
+    if group == "board":
+        return "board_read" if method in READ_METHODS else "board_write"
+    return group
+
+def thread_limiter(key: str, method: str) -> CapacityLimiter | None:
+    """Get the capacity limiter for the threads of a sync route from its rate limit key and method."""
+    group = route_group(key, method)
+    return THREAD_LIMITERS[group] if group is not None else None
+
+class LoadSheddingMiddleware():
+    """ASGI middleware that runs each grouped route inside its group's bulkhead.
+
+    It relies on `RateLimitMiddleware` to match the route, so it must be added before it.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.bulkheads = create_bulkheads()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        key: str | None = scope.get("state", {}).get("rate_limit_key")
+        group = route_group(key, scope["method"]) if scope["type"] == "http" and key is not None else None
+        if group is None or not settings.load_shedding:
+            await self.app(scope, receive, send)
+            return
+        bulkhead = self.bulkheads[group]
+        if not await bulkhead.acquire(bulkhead.target_latency):
+            await ServiceOverloaded(settings.load_shedding_retry_after).response()(scope, receive, send)
+            return
+        start = monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release(monotonic() - start)
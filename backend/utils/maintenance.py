@@ -0,0 +1,212 @@
+"""Periodic database maintenance.
+
+Expired refresh tokens, email verifications, password change requests, editor invitations and
+old auth events are deleted, accounts that never verified an email are handed to the account
+purge (utils/account_purge.py), and lapsed subscriptions are compacted, by tasks that a background
+thread runs every `maintenance_interval` seconds. Each task is a step that deletes or updates
+at most `maintenance_batch_size` rows with a single statement, and the scheduler commits after
+every step, so no transaction holds the write slot for long. Steps repeat until one changes
+fewer rows than the batch size or the task has used up its `maintenance_budget` milliseconds.
+A task that ran out of time is picked up again after a pause as long as the time it ran for.
+
+This used to run once, in full, before the application started taking requests. Now the first
+pass starts in the background at startup. The progress of every task is kept in `metrics`, and
+each pass logs the tasks that changed rows or failed.
+"""
+
+from datetime import datetime, UTC, timedelta
+import logging
+from threading import Thread, Event
+from time import monotonic
+from typing import Callable
+
+from sqlalchemy import select, delete, update, event
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.database.schema import DBAccount, DBAuthEvent, DBCustomer, DBEditorInvitation, DBEmailVerification, DBPasswordChangeRequest
+
+logger = logging.getLogger(__name__)
+
+class TaskMetrics():
+    """Progress of one maintenance task.
+
+    Fields:
+        - runs (int): The number of times the task has run
+        - rows (int): The number of rows deleted or updated, in total
+        - errors (int): The number of runs that failed
+        - last_run (datetime): When the task last started
+        - last_rows (int): The number of rows deleted or updated in the last run
+        - last_duration (float): How long the last run took, in milliseconds
+        - pending (bool): Whether the last run ran out of time with rows left to do
+    """
+    def __init__(self):
+        self.runs = 0
+        self.rows = 0
+        self.errors = 0
+        self.last_run: datetime | None = None
+        self.last_rows = 0
+        self.last_duration = 0.0
+        self.pending = False
+
+# A step gets a session and a batch size, and returns the number of rows it changed. It does not commit.
+Step = Callable[[Session, int], int]
+
+class MaintenanceScheduler():
+    """Runs maintenance tasks in small transactions on a background thread.
+
+    Args:
+        session_factory (Callable[[], Session]): Creates sessions for the background thread
+        tasks (dict[str, Step]): The steps of each task, by name
+        batch_size (int): The most rows a step changes
+        budget (int): The longest time in milliseconds a task runs for at once
+        interval (int): The time in seconds between passes over every task
+    """
+    def __init__(self, session_factory: Callable[[], Session], tasks: dict[str, Step], batch_size: int, budget: int, interval: int):
+        self.session_factory = session_factory
+        self.tasks = tasks
+        self.batch_size = batch_size
+        self.budget = budget / 1000
+        self.interval = interval
+        self.metrics = { name: TaskMetrics() for name in tasks }
+        self._stopping = Event()
+        self._thread: Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the background thread."""
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread after the step it is working on."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def run_task(self, name: str) -> bool:
+        """Run a task's steps until it is done or out of time. Returns whether it has rows left to do."""
+        metrics = self.metrics[name]
+        metrics.runs += 1
+        metrics.last_run = datetime.now(UTC)
+        metrics.last_rows = 0
+        start = monotonic()
+        pending = True
+        try:
+            while pending and not self._stopping.is_set():
+                with self.session_factory() as session:
+                    rows = self.tasks[name](session, self.batch_size)
+                    session.commit()
+                metrics.last_rows += rows
+                metrics.rows += rows
+                pending = rows >= self.batch_size
+                if monotonic() - start >= self.budget:
+                    break
+        except Exception:
+            logger.exception("Maintenance task %s failed", name)
+            metrics.errors += 1
+            pending = False # tried again on the next pass
+        metrics.last_duration = (monotonic() - start) * 1000
+        metrics.pending = pending
+        return pending
+
+    def run_all(self) -> bool:
+        """Run every task once, and log what they did. Returns whether any of them has rows left to do."""
+        pending = False
+        summary = []
+        for name in self.tasks:
+            if self._stopping.is_set():
+                break
+            metrics = self.metrics[name]
+            errors = metrics.errors
+            pending = self.run_task(name) or pending
+            if metrics.errors > errors:
+                summary.append(f"{name} failed")
+            elif metrics.last_rows > 0:
+                summary.append(f"{name} {metrics.last_rows} rows in {metrics.last_duration:.0f} ms" + (" (pending)" if metrics.pending else ""))
+        logger.log(logging.INFO if summary else logging.DEBUG, "Maintenance pass: %s", ", ".join(summary) or "nothing to do")
+        return pending
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            start = monotonic()
+            pending = self.run_all()
+            # Tasks that ran out of time continue after a pause as long as they ran for
+            self._stopping.wait(monotonic() - start if pending else self.interval)
+
+# Tasks
+
+def _now() -> datetime:
+    return datetime.now(UTC).replace(tzinfo=None)
+
+def _delete_where(entity: type, condition) -> Step:
+    """Make a step that deletes a batch of the rows that match a condition."""
+    def step(session: Session, limit: int) -> int:
+        batch = select(entity.id).where(condition()).limit(limit)
+        statement = delete(entity).where(entity.id.in_(batch))
+        return session.execute(statement, execution_options={ "synchronize_session": False }).rowcount
+    return step
+
+def _compact_where(condition, values: dict) -> Step:
+    """Make a step that updates a batch of the customers that match a condition, invalidating the claims of their accounts."""
+    def step(session: Session, limit: int) -> int:
+        batch = select(DBCustomer.id).where(condition()).limit(limit)
+        statement = update(DBCustomer).where(DBCustomer.id.in_(batch)).values(values).returning(DBCustomer.account_id)
+        account_ids = list(session.execute(statement, execution_options={ "synchronize_session": False }).scalars().all())
+        auth.bump_claims_versions(session, account_ids)
+        return len(account_ids)
+    return step
+
+def _delete_unverified_accounts(session: Session, limit: int) -> int:
+    """Mark a batch of accounts with no email and no pending verification as deleted, for the purger
+    to remove along with their permission, customer and everything else that points at them."""
+    batch = select(DBAccount.id).where(DBAccount.email == None, DBAccount.email_verification == None, DBAccount.deleted_at == None).limit(limit)
+    statement = update(DBAccount).where(DBAccount.id.in_(batch)).values(deleted_at=_now())
+    rows = session.execute(statement, execution_options={ "synchronize_session": False }).rowcount
+    if rows > 0:
+        event.listen(session, "after_commit", lambda _: account_purge.wake(), once=True)
+    return rows
+
+def _prune_refresh_tokens(session: Session, limit: int) -> int:
+    return auth.prune_refresh_tokens(session, limit)
+
+TASKS: dict[str, Step] = {
+    "refresh_tokens": _prune_refresh_tokens,
+    "email_verifications": _delete_where(DBEmailVerification, lambda: DBEmailVerification.expires_at < _now()),
+    "password_changes": _delete_where(DBPasswordChangeRequest, lambda: DBPasswordChangeRequest.expires_at < _now()),
+    # Accounts that have no email and no pending email verifications
+    "unverified_accounts": _delete_unverified_accounts,
+    "editor_invitations": _delete_where(DBEditorInvitation, lambda: DBEditorInvitation.expires_at < _now()),
+    "auth_events": _delete_where(DBAuthEvent, lambda: DBAuthEvent.timestamp < _now() - timedelta(30)),
+    # Lapsed subscriptions are stored as the tier they have already fallen back to (see utils/entitlements.py)
+    "expired_subscriptions": _compact_where(lambda: (DBCustomer.type == "active") & (DBCustomer.expiration < _now()), { "type": "inactive" }),
+    "inactive_subscriptions": _compact_where(lambda: (DBCustomer.type == "inactive") & (DBCustomer.expiration < _now() - timedelta(seconds=settings.subscription_grace_period)), { "type": "free", "expiration": None }),
+    "terminated_subscriptions": _compact_where(lambda: (DBCustomer.type == "terminated") & (DBCustomer.expiration < _now()), { "type": "free", "expiration": None }),
+}
+
+# The application's scheduler. Sessions come from the application session factory.
+scheduler: MaintenanceScheduler | None = None
+
+def start(session_factory: Callable[[], Session]) -> None:
+    """Start the application's scheduler."""
+    global scheduler
+    scheduler = MaintenanceScheduler(session_factory, TASKS, settings.maintenance_batch_size, settings.maintenance_budget, settings.maintenance_interval)
+    scheduler.start()
+
+def stop() -> None:
+    """Stop the application's scheduler."""
+    global scheduler
+    if scheduler is not None:
+        scheduler.stop()
+        scheduler = None
+
+# gotta import this down here
+from backend import auth
+from backend.utils import account_purge
@@ -7,9 +7,10 @@ from typing import Annotated
 from sqlalchemy import select, func
 
 from backend.config import settings
-from backend.dependencies import DBSession, CurrentAccount
+from backend.dependencies import DBSession, ReadDBSession, CurrentAccount, ReadCurrentAccount
 from backend.database.schema import DBAccount, DBBoard, DBReport, DBItem
 from backend.exceptions import *
+from backend.utils import auth_cache, entitlements
 
 # Every item type in this list is considered a premium feature
 PREMIUM_TYPES = [ "document" , "sketch", "latex", "kanban", "widget" ] # some of these are just planned
@@ -21,7 +22,7 @@ class PolicyInformationPoint():
         self.account = account
 
     def is_app_staff(self) -> bool:
-        return self.account.permission.role in [ 'app_administrator', 'app_moderator' ]
+        return auth_cache.get_snapshot(self.account).role in [ 'app_administrator', 'app_moderator' ]
 
     def is_board_owner(self, target: DBBoard | str) -> bool:
         board: DBBoard = target if isinstance(target, DBBoard) else self.session.get(DBBoard, target)
@@ -42,7 +43,7 @@ class PolicyInformationPoint():
         return report is not None and self.account.id == report.moderator_id
     
     def is_premium(self) -> bool:
-        return self.account.customer is not None and self.account.customer.type in [ "active", "inactive", "lifetime" ]
+        return entitlements.is_premium(self.account)
     
     def created_item_count(self) -> int:
         """Gets the total amount of items on all boards owned by this user"""
@@ -135,24 +136,29 @@ class BoardPolicyDecisionPoint(PolicyDecisionPoint):
         
     def ensure_create_item(self, target_id: str, target_type: str): # Calls can_modify and has additional checks for premium features
         self.ensure_modify(target_id)
-        # Create a PDP for the board owner
-        board: DBBoard = self.session.get(DBBoard, target_id)
-        owner = BoardPolicyDecisionPoint(self.session, board.owner)
-        if not owner.pip.is_premium():
+        # Check the board owner's subscription
+        owner = self._owner_pip(target_id)
+        if not owner.is_premium():
             if target_type in PREMIUM_TYPES:
                 raise PremiumFeature()
-            if owner.pip.created_item_count() >= settings.free_tier_item_limit:
+            if owner.created_item_count() >= settings.free_tier_item_limit:
                 raise ItemLimitExceeded() 
         
     def ensure_update_item(self, target_id: str, target_type: str): # Calls can_modify and has additional checks for premium features
         self.ensure_modify(target_id)
-        # Create a PDP for the board owner
-        board: DBBoard = self.session.get(DBBoard, target_id)
-        owner = BoardPolicyDecisionPoint(self.session, board.owner)
-        if not owner.pip.is_premium():
+        # Check the board owner's subscription
+        owner = self._owner_pip(target_id)
+        if not owner.is_premium():
             if target_type in PREMIUM_TYPES:
                 raise PremiumFeature()
         
+    def _owner_pip(self, target_id: str) -> PolicyInformationPoint:
+        """Get a PIP for the owner of a board, reusing this one if the account is the owner"""
+        board: DBBoard = self.session.get(DBBoard, target_id)
+        if board.owner_id == self.account.id:
+            return self.pip
+        return PolicyInformationPoint(self.session, board.owner)
+        
     def ensure_delete(self, target_id): # Can delete a board if they are the owner
         if self.pip.is_app_staff():
             return # staff users automatically get permissions
@@ -272,9 +278,23 @@ def get_board_pdp(
     return BoardPolicyDecisionPoint(session, account)
 BoardPDP = Annotated[BoardPolicyDecisionPoint, Depends(get_board_pdp)]
 
+def get_read_board_pdp(
+    session: ReadDBSession, # type: ignore
+    account: ReadCurrentAccount,
+) -> BoardPolicyDecisionPoint:
+    return BoardPolicyDecisionPoint(session, account)
+ReadBoardPDP = Annotated[BoardPolicyDecisionPoint, Depends(get_read_board_pdp)]
+
 def get_report_pdp(
     session: DBSession, # type: ignore
     account: CurrentAccount,
 ) -> ReportPolicyDecisionPoint:
     return ReportPolicyDecisionPoint(session, account)
-ReportPDP = Annotated[ReportPolicyDecisionPoint, Depends(get_report_pdp)]
\ No newline at end of file
+ReportPDP = Annotated[ReportPolicyDecisionPoint, Depends(get_report_pdp)]
+
+def get_read_report_pdp(
+    session: ReadDBSession, # type: ignore
+    account: ReadCurrentAccount,
+) -> ReportPolicyDecisionPoint:
+    return ReportPolicyDecisionPoint(session, account)
+ReadReportPDP = Annotated[ReportPolicyDecisionPoint, Depends(get_read_report_pdp)]
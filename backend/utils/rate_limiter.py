@@ -1,11 +1,36 @@
-"""Rate limiter decorator"""
+"""Rate limiter decorator
 
+Limits use the generic cell rate algorithm (GCRA). Each (host, key) pair stores one timestamp,
+the theoretical arrival time (TAT) of the next request if requests arrived exactly at the
+allowed rate. A request is allowed if the TAT is no more than a window ahead of now, and
+moves the TAT forward by one interval (window / count). This allows bursts of up to `count`
+requests, then one request per interval.
+
+Entries expire once their TAT has passed, since an idle host has a full allowance again.
+
+The TATs are kept by a backend, chosen with the `rate_limit_backend` setting:
+    memory: In this process. Each worker process enforces the limits separately.
+    sqlite: In a SQLite database in WAL mode, shared by every worker process on this host.
+            Checks run in a worker thread so they never hold up the event loop.
+"""
+
+from abc import ABC as AbstractBaseClass, abstractmethod
+from anyio import to_thread
 from fastapi import Request, Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Scope, Receive, Send
 from typing import Callable, Any
-from datetime import datetime, UTC
+from threading import Lock, local
+from time import time
 import functools
+import logging
+import sqlite3
 
+from backend.config import settings
+from backend.dependencies import client_id
 from backend.exceptions import TooManyRequests
+from backend.utils.cache import TTLCache
+from backend.utils.load_shedding import thread_limiter
 
 # Tuples of request count and window size. X request per Y seconds.
 KEY_LIMITS = {
@@ -17,53 +42,199 @@ KEY_LIMITS = {
     "board": (5, 5),
     "board_action": (5, 5),
     "submit_report": (1, 30),
-    "media": (1, 10),
+    "media": (5, 50), # uploads cost more than one request each
     "static": (3, 5),
     "stripe": (2, 30),
 }
 
-# Usage dictionary
-USAGE = {}
+# Tolerate rounding when a burst is exactly used up
+TOLERANCE = 1 + 1e-9
+
+logger = logging.getLogger(__name__)
+
+class LimiterBackend(AbstractBaseClass):
+    """Stores the theoretical arrival time for each host and key."""
+    blocking: bool = False # Whether hit can wait on I/O, so should be called from a worker thread
+
+    @abstractmethod
+    def hit(self, host: str, key: str, interval: float, window_size: float, now: float) -> bool:
+        """Move the TAT for this host and key forward by one interval, unless that would put it more than a window ahead of now. Returns whether it was moved."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Forget every TAT."""
+
+class MemoryBackend(LimiterBackend):
+    """Keeps TATs in this process, evicting the least recently seen hosts if there are too many."""
+    def __init__(self, max_size: int):
+        self.usage = TTLCache(max_size, max(window_size for _, window_size in KEY_LIMITS.values()))
+        self._lock = Lock()
+
+    def hit(self, host, key, interval, window_size, now):
+        with self._lock:
+            tat = max(self.usage.get((host, key), now), now) + interval
+            if tat - now > window_size * TOLERANCE:
+                return False
+            self.usage.set((host, key), tat, tat - now)
+        return True
+
+    def clear(self):
+        self.usage.clear()
+
+class SQLiteBackend(LimiterBackend):
+    """Keeps TATs in a SQLite database that every worker process can share.
+
+    Each check is a single upsert, so it is atomic across processes. Expired rows are deleted
+    every `prune_every` checks made by a connection. A check that can't get the write lock
+    within `timeout` seconds fails open, since a slow limiter is worse than a missed limit.
+    """
+    blocking = True
+
+    def __init__(self, path: str, prune_every: int = 1000, timeout: float = 0.05):
+        self.path = path
+        self.prune_every = prune_every
+        self.timeout = timeout
+        self._local = local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, creating it and the table if needed."""
+        connection: sqlite3.Connection | None = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF") # losing the last few TATs in a crash is harmless
+            connection.execute("CREATE TABLE IF NOT EXISTS rate_limits (host TEXT NOT NULL, key TEXT NOT NULL, tat REAL NOT NULL, PRIMARY KEY (host, key)) WITHOUT ROWID")
+            self._local.connection = connection
+            self._local.checks = 0
+        return connection
+
+    def hit(self, host, key, interval, window_size, now):
+        connection = self._connection()
+        self._local.checks += 1
+        try:
+            if self._local.checks % self.prune_every == 0:
+                connection.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+            row = connection.execute(
+                """INSERT INTO rate_limits (host, key, tat) VALUES (:host, :key, :now + :interval)
+                ON CONFLICT (host, key) DO UPDATE SET tat = max(tat, :now) + :interval
+                WHERE max(tat, :now) + :interval - :now <= :limit
+                RETURNING tat""",
+                { "host": host, "key": key, "now": now, "interval": interval, "limit": window_size * TOLERANCE },
+            ).fetchone()
+        except sqlite3.OperationalError as e: # the database is locked
+            logger.warning("Allowing a request from %s without a rate limit check: %s", host, e)
+            return True
+        return row is not None
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limits")
+
+def get_backend(name: str) -> LimiterBackend:
+    """Create the backend with this name."""
+    if name == "memory":
+        return MemoryBackend(settings.rate_limit_cache_size)
+    if name == "sqlite":
+        return SQLiteBackend(settings.rate_limit_db_path)
+    raise ValueError(f"Unrecognized rate limit backend {name}")
+
+backend: LimiterBackend = get_backend(settings.rate_limit_backend)
+
+def hit(key: str, client: str, cost: int = 1) -> bool:
+    """Count a request from a client (an account or host) against a key's limit. Returns False, without counting it, if the limit has been exceeded.
+
+    A request with a cost of n uses up as much of the limit as n ordinary requests. Costs are
+    capped at the key's request count, so an expensive request is never rejected outright.
+    """
+    if key not in KEY_LIMITS:
+        raise ValueError(f"Unrecognized key {key}")
+    if key == "forced":
+        return True
+    count, window_size = KEY_LIMITS[key]
+    cost = min(max(cost, 1), count)
+    return backend.hit(client, key, window_size / count * cost, window_size, time())
+
+# Request costs
+
+def upload_cost(request: Request) -> int:
+    """One unit, plus one for every `rate_limit_upload_unit` bytes in the request body. Bodies without a length cost as much as the largest allowed upload."""
+    length = request.headers.get("content-length")
+    if length is None or not length.isdigit():
+        length = settings.media_img_max_bytes
+    return 1 + int(length) // settings.rate_limit_upload_unit
 
 # Decorator to take in the key
-def limit(key: str = "main", *, no_content: bool = False, is_async = False):
+def limit(key: str = "main", *, no_content: bool = False, is_async = False, cost: Callable[[Request], int] | None = None):
+    """Rate limit a route under a key. The limit is enforced by `RateLimitMiddleware` before the route's dependencies run.
+
+    Args:
+        key (str): The key in KEY_LIMITS
+        no_content (bool): Whether the route returns no content
+        is_async (bool): Whether the route function is a coroutine
+        cost (Callable[[Request], int] | None): Works out how much of the limit a request uses from its headers. Each request costs 1 by default.
+    """
+    if key not in KEY_LIMITS:
+        raise ValueError(f"Unrecognized key {key}")
     return_type = None if no_content else Any
 
     # Nested decorator that takes the actual request function
     def decorator(route_function: Callable[..., Any]) -> Callable[..., Any]:
 
-        # Call the route function if this host has not exceeded the window
+        # Call the route function, making sure to return a 204 if applicable. Sync route functions
+        # run in a worker thread borrowed from their group's limiter, never on the event loop.
         @functools.wraps(route_function)
         async def limiter(request: Request, *args, **kwargs) -> return_type: # type: ignore
-            # Extract actual limits
-            if key not in KEY_LIMITS:
-                raise ValueError(f"Unrecognized key {key}")
-            count, window_size = KEY_LIMITS[key]
-
-            host: str = request.client.host
-            time: int = datetime.now(UTC).timestamp()
-
-            # If this does not force traffic through, check for limiting
-            if key != "forced":
-                # Make sure the window exists for this key and get a reference
-                if host not in USAGE:
-                    USAGE[host] = {}
-                if key not in USAGE[host]:
-                    USAGE[host][key] = []
-                window = USAGE[host][key]
-                
-                # Remove outdated entries and add one
-                window[:] = [ t for t in window if time - t < window_size]
-                window.append(time)
-
-                # If the limit has been exceeded, throw an error
-                if (len(window) > count):
-                    raise TooManyRequests()
-
-            # Proceed to the actual route function, making sure to return a 204 if applicable
-            result: Any = await route_function(request, *args, **kwargs) if is_async else route_function(request, *args, **kwargs)
+            if is_async:
+                result: Any = await route_function(request, *args, **kwargs)
+            else:
+                call = functools.partial(route_function, request, *args, **kwargs)
+                result = await to_thread.run_sync(call, limiter=thread_limiter(key, request.method))
             if not no_content:
                 return result
 
+        limiter.rate_limit = (key, cost)
         return limiter
-    return decorator
\ No newline at end of file
+    return decorator
+
+_UNMATCHED = object()
+
+class RateLimitMiddleware():
+    """ASGI middleware that rejects rate limited requests before any dependencies are resolved.
+
+    The request is matched against the application's routes to find the key given to `limit`.
+    Requests from a logged in account are limited per account, and other requests per host.
+    The access token is only verified, never looked up in the database, so requests that are
+    over the limit get a 429 without opening a database session or reading the body. Backends
+    that block are called from a worker thread.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes = TTLCache(4096, 3600) # Maps (method, path) to the key and cost of the matching route
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            rate_limit = self.route_limit(scope)
+            if rate_limit is not None:
+                key, cost = rate_limit
+                scope.setdefault("state", {})["rate_limit_key"] = key
+                request = Request(scope)
+                arguments = (key, client_id(request), cost(request) if cost is not None else 1)
+                allowed = await to_thread.run_sync(hit, *arguments) if backend.blocking else hit(*arguments)
+                if not allowed:
+                    await TooManyRequests().response()(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+    def route_limit(self, scope: Scope) -> tuple[str, Callable[[Request], int] | None] | None:
+        """Get the rate limit key and cost of the route this request is for, if it has one."""
+        path = (scope["method"], scope["path"])
+        rate_limit = self._routes.get(path, _UNMATCHED)
+        if rate_limit is not _UNMATCHED:
+            return rate_limit
+        rate_limit = None
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                rate_limit = getattr(getattr(route, "endpoint", None), "rate_limit", None)
+                break
+        self._routes.set(path, rate_limit)
+        return rate_limit
@@ -45,8 +45,7 @@ def create_checkout_session(
     if account.customer.stripe_id is None:
         customer = stripe.Customer.create(description=account.username)
         account.customer.stripe_id = customer['id']
-        session.add(account)
-        session.commit()
+        session.add(account) # saved when the request's unit of work commits
 
     # Create session
     checkout_session = stripe.checkout.Session.create(
@@ -112,9 +111,8 @@ async def handle_stripe_webhook(
         customer.type = "active"
         customer.expiration = exp
         session.add(customer)
-        session.commit()
 
-        email_handler.send_purchase_confirmation_email(customer)
+        email_handler.send_after_commit(session, email_handler.send_purchase_confirmation_email, customer)
 
     # Lifetime subscription purchase
     elif type == 'checkout.session.completed' and data['mode'] == 'payment': # don't double-trigger if this is a subscription
@@ -129,9 +127,8 @@ async def handle_stripe_webhook(
         customer.type = "lifetime"
         customer.expiration = None
         session.add(customer)
-        session.commit()
 
-        email_handler.send_purchase_confirmation_email(customer)
+        email_handler.send_after_commit(session, email_handler.send_purchase_confirmation_email, customer)
 
     # Subscription renewal failure
     elif type == 'invoice.payment_failed':
@@ -143,9 +140,8 @@ async def handle_stripe_webhook(
         customer: DBCustomer = accounts_db.get_by_stripe_id(session, customer_id)
         customer.type = "inactive" if customer.type == "active" else customer.type
         session.add(customer)
-        session.commit()
 
-        email_handler.send_subscription_failure_email(customer)
+        email_handler.send_after_commit(session, email_handler.send_subscription_failure_email, customer)
 
     # Subscription cancellation
     elif type == 'customer.subscription.deleted':
@@ -157,9 +153,8 @@ async def handle_stripe_webhook(
         customer: DBCustomer = accounts_db.get_by_stripe_id(session, customer_id)
         customer.type = "terminated" if customer.type == "active" else customer.type
         session.add(customer)
-        session.commit()
 
-        email_handler.send_subscription_cancellation_email(customer)
+        email_handler.send_after_commit(session, email_handler.send_subscription_cancellation_email, customer)
 
     # Subscription pause
     elif type == 'customer.subscription.paused':
@@ -171,9 +166,8 @@ async def handle_stripe_webhook(
         customer: DBCustomer = accounts_db.get_by_stripe_id(session, customer_id)
         customer.type = "terminated" if customer.type == "active" else customer.type
         session.add(customer)
-        session.commit()
 
-        email_handler.send_subscription_cancellation_email(customer)
+        email_handler.send_after_commit(session, email_handler.send_subscription_cancellation_email, customer)
 
     # Customer deletion (just set customer_id to null, but don't necessarily revoke permissions)
     elif type == 'customer.deleted':
@@ -187,7 +181,6 @@ async def handle_stripe_webhook(
             customer.type = "terminated" if customer.type == "active" else customer.type
             customer.stripe_id = None
             session.add(customer)
-            session.commit()
         except EntityNotFound as e: # If this was triggered by an account deletion, do nothing
             pass
 
@@ -0,0 +1,131 @@
+"""Serialized writes for SQLite.
+
+SQLite allows one writer at a time. When several threadpool workers commit at once, each one
+waits for the database lock in SQLite's busy handler, which sleeps for longer and longer
+between attempts. Write throughput falls as concurrency grows, and requests that wait longer
+than the busy timeout fail with "database is locked".
+
+With the coordinator installed, a session takes the process-wide write slot before its first
+write and keeps it until its transaction commits or rolls back. Writers queue up in order, and each one gets the
+slot as soon as the previous one is done. At most `queue_size` writers can wait, and none for
+longer than `timeout` milliseconds, after which the request fails fast with a 503.
+
+Waiting for the slot blocks the thread, so sessions should write from a worker thread, as sync
+routes and the unit of work's commit do. A session that writes from the event loop never waits:
+if the slot is taken, it fails with a 503 straight away rather than stalling every other request.
+Slow external calls, like sending emails, belong after the commit (see
+`email_handler.send_after_commit`), so the slot isn't held while they run.
+
+Once a session has the slot, it takes SQLite's write lock straight away with BEGIN IMMEDIATE,
+retrying with exponential backoff while another process holds it. Nothing has been written at
+that point, so a retry loses no work.
+
+Commits are not merged across requests, as each request's objects live in its own session.
+Small writes that don't belong to a request, like auth events, are already grouped into one
+commit per batch by the audit writer, and its batches take the slot like any other writer.
+"""
+
+from asyncio import get_running_loop
+from threading import Lock
+import sqlite3
+from time import sleep
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, SessionTransaction, ORMExecuteState, sessionmaker
+
+from backend.config import settings
+from backend.exceptions import ServiceOverloaded
+
+class WriteCoordinator():
+    """A single write slot shared by every session of a sessionmaker.
+
+    Args:
+        queue_size (int): The most sessions that can wait for the slot
+        timeout (int): The longest time in milliseconds a session waits for the slot
+        retries (int): How many more times to try taking SQLite's write lock if it is busy
+        backoff (int): Milliseconds to wait before the first retry, doubling after each one
+    """
+    def __init__(self, queue_size: int, timeout: int, retries: int, backoff: int):
+        self.queue_size = queue_size
+        self.timeout = timeout / 1000
+        self.retries = retries
+        self.backoff = backoff / 1000
+        self.waiting = 0
+        self._slot = Lock()
+        self._waiting_lock = Lock()
+
+    def install(self, session_factory: sessionmaker) -> None:
+        """Make every session created by the factory write through the coordinator."""
+        event.listen(session_factory, "before_flush", self._before_flush)
+        event.listen(session_factory, "do_orm_execute", self._do_orm_execute)
+        event.listen(session_factory, "after_commit", self.release)
+        event.listen(session_factory, "after_transaction_end", self._after_transaction_end)
+
+    def acquire(self, session: Session) -> None:
+        """Take the write slot for the session, if it doesn't have it already, and begin an immediate transaction."""
+        if session.info.get("write_slot"):
+            return
+        if not self._slot.acquire(blocking=False):
+            if on_event_loop():
+                raise ServiceOverloaded(settings.load_shedding_retry_after)
+            with self._waiting_lock:
+                if self.waiting >= self.queue_size:
+                    raise ServiceOverloaded(settings.load_shedding_retry_after)
+                self.waiting += 1
+            try:
+                acquired = self._slot.acquire(timeout=self.timeout)
+            finally:
+                with self._waiting_lock:
+                    self.waiting -= 1
+            if not acquired:
+                raise ServiceOverloaded(settings.load_shedding_retry_after)
+        session.info["write_slot"] = True
+        try:
+            self._begin_immediate(session)
+        except BaseException:
+            self.release(session)
+            raise
+
+    def release(self, session: Session) -> None:
+        """Give back the session's write slot, if it has it."""
+        if session.info.pop("write_slot", False):
+            self._slot.release()
+
+    def _begin_immediate(self, session: Session) -> None:
+        connection = session.connection()
+        if connection.dialect.name != "sqlite" or connection.dialect.is_async:
+            return
+        dbapi_connection = connection.connection.dbapi_connection
+        if dbapi_connection.in_transaction:
+            return # the session already wrote something, so it has the lock
+        for attempt in range(self.retries + 1):
+            try:
+                dbapi_connection.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == self.retries:
+                    raise OperationalError("BEGIN IMMEDIATE", None, e) from e
+                sleep(self.backoff * 2 ** attempt)
+
+    def _before_flush(self, session: Session, flush_context, instances) -> None:
+        self.acquire(session)
+
+    def _do_orm_execute(self, state: ORMExecuteState) -> None:
+        # Bulk statements like session.execute(delete(...)) write without flushing
+        if state.is_insert or state.is_update or state.is_delete:
+            self.acquire(state.session)
+
+    def _after_transaction_end(self, session: Session, transaction: SessionTransaction) -> None:
+        if transaction.parent is None:
+            self.release(session)
+
+def on_event_loop() -> bool:
+    """Whether this thread is running an event loop, where blocking would hold up every other request."""
+    try:
+        get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+coordinator = WriteCoordinator(settings.db_write_queue_size, settings.db_write_timeout, settings.db_write_retries, settings.db_write_backoff)
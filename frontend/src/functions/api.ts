@@ -94,12 +94,13 @@ async function authenticatedFetch<T = void>(fetchFn: (token: string) => Promise<
     });
     if (!refresh.ok) // Redirect to login page if refresh token is invalid/expired
         return redirect(APP_PATHS.login);
-    const newToken = convertCookies(refresh)[ACCESS_KEY];
+    const refreshCookies = convertCookies(refresh); // Includes the rotated refresh token, as the old one can't be used again
+    const newToken = refreshCookies[ACCESS_KEY];
     
     // If the refresh was successful, retry the request.
     console.log("Retrying user request.");
     const retried: Response = await fetchFn(newToken.value);
-    return handleResponse<T>(retried, true, { accessTokenKey: newToken }); // Forcibly forward cookies now, and pass in the updated cookie.
+    return handleResponse<T>(retried, true, refreshCookies); // Forcibly forward cookies now, and pass in the updated cookies.
 }
 
 /**